@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""A stand-in for UNAFold.pl. It folds the sequence into a hairpin and writes
+BENCH_STRUCTURES connect files named after the input file.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+arguments = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+if not arguments:
+    sys.stderr.write("Usage: UNAFold.pl [options] file\n")
+    sys.exit(1)
+
+records = fakes.read_fasta(open(arguments[0], 'r').read())
+fakes.work('UNAFold.pl')
+name, sequence = records[0]
+prefix = os.path.basename(arguments[0])
+for index in range(max(fakes.setting('STRUCTURES', 1), 1)):
+    pairs = fakes.hairpin(len(sequence) - 2 * index)
+    pairs.extend([None] * (len(sequence) - len(pairs)))
+    filename = prefix + ('_%s' % index if index else '') + '.ct'
+    fakes.write(filename, fakes.connect(sequence, pairs, fakes.energy(pairs),
+                                        name=name))
@@ -0,0 +1,202 @@
+"""Shared code for the stand-in programs in this directory. Each one mimics
+the interface of the real program closely enough for the wrappers to parse its
+output, while its cost is controlled by environment variables:
+
+    BENCH_LATENCY       Seconds to sleep before producing output.
+    BENCH_JITTER        Extra random sleep of up to this many seconds.
+    BENCH_OUTPUT_SIZE   Bytes of padding to add to generated drawings.
+    BENCH_FAILURE_RATE  Chance, between 0 and 1, of failing with status 1.
+    BENCH_STRUCTURES    Number of foldings UNAFold.pl writes.
+
+These must run under any python, so they do not import rnastructure.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FILES = os.path.join(HERE, '..', '..', 'files')
+
+
+def setting(name, default):
+    return type(default)(os.environ.get('BENCH_%s' % name, default))
+
+
+def work(program):
+    """Sleep for the configured latency and fail if we are unlucky."""
+    delay = setting('LATENCY', 0.0) + random.random() * setting('JITTER', 0.0)
+    if delay > 0:
+        time.sleep(delay)
+    if random.random() < setting('FAILURE_RATE', 0.0):
+        sys.stderr.write("%s: simulated failure\n" % program)
+        sys.exit(1)
+
+
+def hairpin(length):
+    """Pairs, as 0 based partner indices or None, of a single hairpin with a
+    loop of at least 3 nucleotides.
+    """
+    pairs = [None] * length
+    stem = max(min((length - 3) // 2, 12), 0)
+    start = (length - 2 * stem - 3) // 2
+    for offset in range(stem):
+        first = start + offset
+        second = start + 2 * stem + 2 - offset
+        pairs[first] = second
+        pairs[second] = first
+    return pairs
+
+
+def dot_bracket(pairs):
+    chars = []
+    for index, partner in enumerate(pairs):
+        if partner is None:
+            chars.append('.')
+        elif index < partner:
+            chars.append('(')
+        else:
+            chars.append(')')
+    return ''.join(chars)
+
+
+def from_dot_bracket(structure):
+    pairs = [None] * len(structure)
+    stacks = {}
+    for index, char in enumerate(structure):
+        if char in '([{<':
+            stacks.setdefault(char, []).append(index)
+        elif char in ')]}>':
+            opening = '([{<'[')]}>'.index(char)]
+            partner = stacks[opening].pop()
+            pairs[index] = partner
+            pairs[partner] = index
+    return pairs
+
+
+def nested(pairs):
+    """Remove crossing pairs, keeping the ones that close first."""
+    kept = [None] * len(pairs)
+    stack = []
+    for index, partner in enumerate(pairs):
+        if partner is None:
+            continue
+        if index < partner:
+            stack.append(index)
+        elif partner in stack:
+            while stack[-1] != partner:
+                stack.pop()
+            stack.pop()
+            kept[index] = partner
+            kept[partner] = index
+    return kept
+
+
+def read_fasta(text):
+    """Get (name, sequence) records from fasta like text."""
+    records = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('>'):
+            records.append([line[1:], ''])
+        elif line and records:
+            records[-1][1] += line
+    return [tuple(record) for record in records]
+
+
+def connect(sequence, pairs, energy, name='sequence'):
+    """Format a CT file like the ones UNAFold writes."""
+    length = len(sequence)
+    lines = ['%s\tdG = %.1f\t%s\n' % (length, energy, name)]
+    for index in range(length):
+        partner = pairs[index]
+        after = index + 2 if index + 1 < length else 0
+        lines.append('%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (
+            index + 1, sequence[index], index, after,
+            0 if partner is None else partner + 1, index + 1, index, after))
+    return ''.join(lines)
+
+
+def read_connect(text):
+    lines = text.splitlines()
+    sequence = []
+    pairs = []
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) < 6:
+            continue
+        sequence.append(parts[1])
+        partner = int(parts[4])
+        pairs.append(None if partner == 0 else partner - 1)
+    return ''.join(sequence), pairs
+
+
+def energy(pairs):
+    return -1.7 * sum(1 for index, partner in enumerate(pairs)
+                      if partner is not None and index < partner)
+
+
+def postscript(sequence, pairs):
+    """Create a drawing in the format RNAplot writes, using the drawing in
+    the fixtures as the template. Nucleotides are placed on a circle.
+    """
+    with_template = open(os.path.join(FILES, 'alirna.ps'), 'r')
+    try:
+        template = with_template.read()
+    finally:
+        with_template.close()
+
+    length = len(sequence)
+    radius = max(15.0 * length / (2 * math.pi), 20.0)
+    coordinates = []
+    for index in range(length):
+        angle = 2 * math.pi * index / max(length, 1)
+        coordinates.append('[%.8f %.8f]' % (300 + radius * math.cos(angle),
+                                             300 + radius * math.sin(angle)))
+    pair_lines = ['[%s %s]' % (index + 1, partner + 1)
+                  for index, partner in enumerate(pairs)
+                  if partner is not None and index < partner]
+
+    data = ('/sequence (\\\n%s\\\n) def\n/coor [\n%s\n] def\n'
+            '/pairs [\n%s\n] def\n' % (sequence, '\n'.join(coordinates),
+                                       '\n'.join(pair_lines)))
+    low = int(300 - radius - 10)
+    high = int(300 + radius + 10)
+    text = re.sub(r'/sequence \(\\\n.*?\n\] def\n/pairs \[\n.*?\n\] def\n',
+                  lambda match: data, template, flags=re.S)
+    text = re.sub(r'%%BoundingBox: .*',
+                  '%%%%BoundingBox: %s %s %s %s' % (low, low, high, high), text)
+    padding = setting('OUTPUT_SIZE', 0)
+    if padding:
+        line = '% ' + 'x' * 76 + '\n'
+        text += line * (padding // len(line) + 1)
+    return text
+
+
+def dot_plot(sequence, pairs):
+    """Create a dot plot in the format RNAfold -p writes, where every pair
+    of the structure is likely and each pair next to it is not.
+    """
+    lines = ['%!PS-Adobe-3.0 EPSF-3.0\n', '%%Title: RNA Dot Plot\n',
+             '/sequence { (\\\n%s\\\n) } def\n' % sequence,
+             '%start of base pair probability data\n']
+    for index, partner in enumerate(pairs):
+        if partner is not None and index < partner:
+            lines.append('%s %s %.7f ubox\n' % (index + 1, partner + 1,
+                                                 math.sqrt(0.9)))
+            if partner - index > 5:
+                lines.append('%s %s %.7f ubox\n' % (index + 2, partner + 1,
+                                                     math.sqrt(0.05)))
+    lines.append('showpage\nend\n%%EOF\n')
+    return ''.join(lines)
+
+
+def write(filename, text):
+    out = open(filename, 'w')
+    try:
+        out.write(text)
+    finally:
+        out.close()
@@ -0,0 +1,120 @@
+"""Benchmark the wrappers against the stand-in programs in bench/bin. This
+measures how many calls per second each wrapper completes end to end, from
+validating the input to parsing the results, at several levels of concurrency.
+The cost of the stand-in programs is set with the options below, see
+bench/bin/fakes.py for details.
+
+    python bench/run.py --calls 200 --concurrency 1,2,4,8 --latency 0.05
+"""
+
+import os
+import sys
+import time
+import random
+from optparse import OptionParser
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from rnastructure.util import metrics
+from rnastructure.util.wrapper import Multiplexer
+from rnastructure.primary.fold import RNAfold
+from rnastructure.primary.fold import UNAFold
+from rnastructure.primary.fold import RNAalifold
+from rnastructure.secondary.rnaplot import RNAplot
+from rnastructure.secondary.pseudoknot import RemovePseudoknots
+from rnastructure.secondary.dot_bracket import Parser as DotParser
+
+
+def sequence(length):
+    return ''.join(random.choice('ACGU') for _ in xrange(length))
+
+
+def structure(length, knotted=False):
+    stem = min((length - 3) // 2, 10)
+    loop = length - 2 * stem
+    if knotted and loop >= 7:
+        middle = '.' + '[' * 2 + '.' * (loop - 6) + ']' * 2 + '.'
+    else:
+        middle = '.' * loop
+    parsed = DotParser('(' * stem + middle + ')' * stem)
+    parsed.sequence = sequence(length)
+    return parsed
+
+
+PROGRAMS = {
+    'RNAalifold': (RNAalifold, lambda n: [sequence(n)] * 3),
+    'RNAfold': (RNAfold, sequence),
+    'UNAFold': (UNAFold, sequence),
+    'RemovePseudoknots': (RemovePseudoknots,
+                          lambda n: structure(n, knotted=True)),
+    'RNAplot': (RNAplot, structure),
+}
+
+
+def run(name, calls, concurrency, length, mode):
+    """Make calls with a single wrapper and return the calls per second and
+    the number of failures.
+    """
+    klass, generate = PROGRAMS[name]
+    wrapper = klass()
+    inputs = [generate(length) for _ in xrange(calls)]
+    start = time.time()
+    if mode == 'threads':
+        results = wrapper.map(inputs, max_workers=concurrency)
+    else:
+        multiplexer = Multiplexer(limit=concurrency)
+        for raw in inputs:
+            multiplexer.submit(wrapper, raw)
+        results = multiplexer.run()
+    elapsed = time.time() - start
+    failures = sum(1 for result in results if isinstance(result, Exception))
+    return calls / elapsed, failures
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--program', action='append', dest='programs',
+                      choices=sorted(PROGRAMS),
+                      help='Program to benchmark, may be given several times')
+    parser.add_option('--calls', type='int', default=100,
+                      help='Calls to make at each level of concurrency')
+    parser.add_option('--concurrency', default='1,2,4,8',
+                      help='Comma separated levels of concurrency')
+    parser.add_option('--length', type='int', default=100,
+                      help='Length of the generated sequences')
+    parser.add_option('--mode', choices=['threads', 'multiplex'],
+                      default='threads',
+                      help='Run calls with Wrapper.map or a Multiplexer')
+    parser.add_option('--latency', type='float', default=0.0)
+    parser.add_option('--jitter', type='float', default=0.0)
+    parser.add_option('--output-size', type='int', default=0)
+    parser.add_option('--failure-rate', type='float', default=0.0)
+    options, _ = parser.parse_args()
+
+    os.environ['PATH'] = os.path.join(here, 'bin') + os.pathsep + \
+        os.environ.get('PATH', '')
+    os.environ['BENCH_LATENCY'] = str(options.latency)
+    os.environ['BENCH_JITTER'] = str(options.jitter)
+    os.environ['BENCH_OUTPUT_SIZE'] = str(options.output_size)
+    os.environ['BENCH_FAILURE_RATE'] = str(options.failure_rate)
+
+    programs = options.programs or sorted(PROGRAMS)
+    levels = [int(level) for level in options.concurrency.split(',')]
+    print '%-18s %6s %10s %8s %10s %10s' % ('program', 'conc', 'calls/s',
+                                             'failed', 'run p50', 'run p95')
+    for name in programs:
+        for level in levels:
+            metrics.stats.reset()
+            rate, failures = run(name, options.calls, level, options.length,
+                                 options.mode)
+            timings = {}
+            for data in metrics.stats.snapshot().values():
+                timings = data['timings'].get('run', {})
+            print '%-18s %6s %10.1f %8s %10.4f %10.4f' % (
+                name, level, rate, failures, timings.get('p50', 0),
+                timings.get('p95', 0))
+
+
+if __name__ == '__main__':
+    main()
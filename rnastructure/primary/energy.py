@@ -0,0 +1,284 @@
+"""This module folds sequences in process, without any external program, with
+a deliberately simple energy model. It is meant for quick triage, like
+filtering candidates before folding them with UNAFold, and not as a
+replacement for the real programs.
+
+The model knows only canonical and GU pairs. A helix gains the Turner nearest
+neighbour energy of every stacked pair in it and every loop, whatever its
+size or kind, costs a fixed penalty. With stacking off every pair is worth -1,
+so the minimum energy structure is the one with the most pairs, as in the
+Nussinov algorithm.
+"""
+
+import numpy as np
+
+from rnastructure.util.wrapper import is_in
+from rnastructure.primary.fold import Folder
+from rnastructure.secondary.basic import Parser
+
+BASES = 'ACGU'
+
+_CODES = np.full(256, len(BASES), dtype=np.int8)
+for _index, _base in enumerate(BASES):
+    _CODES[ord(_base)] = _index
+    _CODES[ord(_base.lower())] = _index
+_CODES[ord('T')] = _CODES[ord('t')] = BASES.index('U')
+
+PAIR_TYPES = ['CG', 'GC', 'GU', 'UG', 'AU', 'UA']
+"""The pairs that may form, in the order used by STACKS."""
+
+PAIRS = np.full((len(BASES) + 1, len(BASES) + 1), -1, dtype=np.int8)
+for _index, _pair in enumerate(PAIR_TYPES):
+    PAIRS[BASES.index(_pair[0]), BASES.index(_pair[1])] = _index
+
+STACKS = np.array([
+    [-2.4, -3.3, -2.1, -1.4, -2.1, -2.1],
+    [-3.3, -3.4, -2.5, -1.5, -2.2, -2.4],
+    [-2.1, -2.5, 1.3, -0.5, -1.4, -1.3],
+    [-1.4, -1.5, -0.5, 0.3, -0.6, -1.0],
+    [-2.1, -2.2, -1.4, -0.6, -1.1, -0.9],
+    [-2.1, -2.4, -1.3, -1.0, -0.9, -1.3],
+])
+"""The Turner 2004 stacking energies, in kcal/mol, of a pair (i, j) on the pair
+(i + 1, j - 1). Rows are the type of (i, j) and columns the type of
+(j - 1, i + 1)."""
+
+
+def encode(sequence):
+    """Convert a sequence to an array of indices into BASES. Anything which is
+    not a base, like a gap, becomes len(BASES) and can not pair.
+
+    :sequence: The sequence to convert.
+    """
+    return _CODES[np.frombuffer(str(sequence), dtype=np.uint8)]
+
+
+class Model(object):
+    """The energies of the simple model. All methods take the encoded
+    sequence and arrays of positions and return an array with the energy of
+    each, which is infinite where the positions can not pair.
+    """
+
+    def __init__(self, stacking=True, loop=3.0, min_loop=3):
+        """Create a new Model.
+
+        :stacking: If false every pair is worth -1 and loops are free.
+        :loop: The penalty for closing any loop.
+        :min_loop: The fewest unpaired bases in a hairpin.
+        """
+        self.stacking = stacking
+        self.loop = loop
+        self.min_loop = min_loop
+
+    def closing(self, codes, first, second):
+        """The energy of the pair (first, second) closing a loop."""
+        valid = PAIRS[codes[first], codes[second]] >= 0
+        energy = self.loop if self.stacking else -1.0
+        return np.where(valid, energy, np.inf)
+
+    def stack(self, codes, first, second):
+        """The energy of the pair (first, second) stacking on the pair
+        (first + 1, second - 1).
+        """
+        outer = PAIRS[codes[first], codes[second]]
+        inner = PAIRS[codes[second - 1], codes[first + 1]]
+        valid = (outer >= 0) & (inner >= 0)
+        if not self.stacking:
+            return np.where(valid, -1.0, np.inf)
+        return np.where(valid, STACKS[outer, inner], np.inf)
+
+
+class Nussinov(Folder):
+    """Folds a single sequence in process with the simple energy model. This
+    is called like the other folders and returns a list with a single
+    basic.Parser, with the energy of the structure set.
+
+    The tables are filled one anti-diagonal, that is one pair span, at a time
+    with every pair of the same span computed at once. Pairs may be limited to
+    a maximum span, in which case only spans up to it are stored and the time
+    and memory needed grow linearly with the length of the sequence.
+    """
+
+    program = None
+
+    options = {
+        'model': is_in('pairs', 'stacking'),
+        'span': lambda value: value is None or
+        (isinstance(value, int) and value > 0),
+        'min_loop': lambda value: isinstance(value, int) and value >= 0,
+        'loop': lambda value: isinstance(value, (int, float)),
+    }
+
+    def __init__(self, length=500, model='stacking', span=None, min_loop=3,
+                 loop=3.0):
+        """Create a new Nussinov.
+
+        :length: Maximum length of the sequence to allow.
+        :model: 'stacking' for the stacking energy model or 'pairs' to
+        maximize the number of pairs.
+        :span: The largest j - i of any pair (i, j), no limit if None.
+        :min_loop: The fewest unpaired bases in a hairpin.
+        :loop: The penalty for closing a loop in the stacking model.
+        """
+        super(Nussinov, self).__init__(length=length)
+        self.defaults = {'model': model, 'span': span, 'min_loop': min_loop,
+                         'loop': loop}
+
+    def pool(self, size=4, options=None):
+        raise NotImplementedError("Nussinov folds in process, there is no "
+                                  "program to keep running")
+
+    def __call__(self, sequence, options=None):
+        """Fold the given sequence.
+
+        :sequence: Sequence to fold.
+        :options: Options to override the defaults given when this was
+        created.
+        :returns: A list of a single basic.Parser.
+        """
+        options = options or {}
+        self.validate(sequence, options)
+        settings = dict(self.defaults)
+        settings.update(options)
+        model = Model(stacking=settings['model'] == 'stacking',
+                      loop=settings['loop'], min_loop=settings['min_loop'])
+        return [fold(sequence, model, span=settings['span'])]
+
+
+def fold(sequence, model, span=None):
+    """Find the minimum energy structure of a sequence.
+
+    :sequence: The sequence to fold.
+    :model: The energy Model to use.
+    :span: The largest j - i of any pair (i, j), no limit if None.
+    :returns: A basic.Parser of the structure with its energy set.
+    """
+    codes = encode(sequence)
+    length = len(codes)
+    tables = _Tables(codes, model, span)
+    tables.fill()
+    exterior = tables.exterior()
+
+    pairs = [None] * length
+    for first, second in tables.traceback(exterior):
+        pairs[first] = second
+        pairs[second] = first
+    parser = Parser(pairs, sequence=sequence)
+    parser.energy = float(exterior[length])
+    return parser
+
+
+class _Tables(object):
+    """The tables of the dynamic program, stored by position and span so that
+    v[i, d] is the best energy of i..i + d given i pairs with i + d, and
+    w[i, d + 1] the best energy of i..i + d with any structure. The extra
+    column of w holds the empty intervals and the extra row those past the end
+    of the sequence, so neither needs bounds checks.
+    """
+
+    def __init__(self, codes, model, span):
+        self.codes = codes
+        self.model = model
+        self.length = len(codes)
+        self.span = max(self.length - 1, 0)
+        if span is not None:
+            self.span = min(span, self.span)
+        self.v = np.full((self.length + 1, self.span + 1), np.inf)
+        self.w = np.zeros((self.length + 1, self.span + 2))
+
+    def fill(self):
+        v, w = self.v, self.w
+        smallest = self.model.min_loop + 1
+        for span in xrange(smallest, self.span + 1):
+            first = np.arange(self.length - span)
+            second = first + span
+
+            closed = w[first + 1, span - 1] + \
+                self.model.closing(self.codes, first, second)
+            if span >= 2:
+                stacked = v[first + 1, span - 2] + \
+                    self.model.stack(self.codes, first, second)
+                closed = np.minimum(closed, stacked)
+            v[first, span] = closed
+
+            best = np.minimum(w[first + 1, span], closed)
+            inner = np.arange(smallest, span)
+            if len(inner):
+                splits = v[first[:, None], inner[None, :]] + \
+                    w[first[:, None] + inner[None, :] + 1, span - inner]
+                best = np.minimum(best, splits.min(axis=1))
+            w[first, span + 1] = best
+
+    def exterior(self):
+        """Compute the best energy of every prefix of the sequence, where
+        exterior[k] is the best energy of the first k bases.
+        """
+        smallest = self.model.min_loop + 1
+        exterior = np.zeros(self.length + 1)
+        for last in xrange(self.length):
+            best = exterior[last]
+            start = max(last - self.span, 0)
+            stop = last - smallest + 1
+            if stop > start:
+                starts = np.arange(start, stop)
+                values = exterior[starts] + self.v[starts, last - starts]
+                best = min(best, values.min())
+            exterior[last + 1] = best
+        return exterior
+
+    def traceback(self, exterior):
+        """Find the pairs of the best structure.
+
+        :exterior: The prefix energies from exterior.
+        :returns: A list of (i, j) pairs.
+        """
+        v, w = self.v, self.w
+        smallest = self.model.min_loop + 1
+        pairs = []
+        todo = [('exterior', self.length, None)]
+        while todo:
+            kind, first, second = todo.pop()
+            if kind == 'exterior':
+                if first == 0:
+                    continue
+                last = first - 1
+                if np.isclose(exterior[first], exterior[last]):
+                    todo.append(('exterior', last, None))
+                    continue
+                start = max(last - self.span, 0)
+                for index in xrange(start, last - smallest + 1):
+                    value = exterior[index] + v[index, last - index]
+                    if np.isclose(exterior[first], value):
+                        todo.append(('exterior', index, None))
+                        todo.append(('pair', index, last))
+                        break
+
+            elif kind == 'pair':
+                pairs.append((first, second))
+                span = second - first
+                if span >= 2:
+                    stacked = v[first + 1, span - 2] + self.model.stack(
+                        self.codes, np.array([first]), np.array([second]))[0]
+                    if np.isclose(v[first, span], stacked):
+                        todo.append(('pair', first + 1, second - 1))
+                        continue
+                todo.append(('any', first + 1, second - 1))
+
+            else:
+                span = second - first
+                if span < smallest:
+                    continue
+                best = w[first, span + 1]
+                if np.isclose(best, w[first + 1, span]):
+                    todo.append(('any', first + 1, second))
+                elif np.isclose(best, v[first, span]):
+                    todo.append(('pair', first, second))
+                else:
+                    for inner in xrange(smallest, span):
+                        value = v[first, inner] + w[first + inner + 1,
+                                                    span - inner]
+                        if np.isclose(best, value):
+                            todo.append(('pair', first, first + inner))
+                            todo.append(('any', first + inner + 1, second))
+                            break
+        return pairs
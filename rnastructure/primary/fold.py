@@ -13,12 +13,24 @@ from __future__ import with_statement
 
 import os
 import re
-from collections import MutableSequence
+import itertools
+from collections import deque
+from collections import Sequence
 
+from rnastructure.util.cache import LRU
 from rnastructure.util.wrapper import Wrapper
+from rnastructure.util.wrapper import is_in
+from rnastructure.util.wrapper import is_true
+from rnastructure.util.workers import Worker
+from rnastructure.util.workers import WorkerPool
 from rnastructure.util.wrapper import InvalidInputError
+from rnastructure.util.wrapper import InvalidOptionError
+from rnastructure.util.wrapper import ProgramFailedError
+from rnastructure.util.wrapper import ProgramTimeOutError
 from rnastructure.secondary.connect import Parser as Connect
+from rnastructure.secondary.connect import Reader as ConnectReader
 from rnastructure.secondary.dot_bracket import Parser as DotBracket
+from rnastructure.secondary.dot_plot import PairProbabilities
 from rnastructure.secondary.rnaplot import PostScriptParser as RNAPlot
 
 
@@ -70,6 +82,102 @@ class Folder(Wrapper):
 
         return True
 
+    def pool(self, size=4, options=None):
+        """Create a pool of folding programs which are kept running between
+        sequences. This is only possible for programs which read several
+        sequences from stdin, so it raises NotImplementedError for programs
+        like UNAFold and RNAalifold which read a single input file.
+
+        :size: The number of programs to keep running.
+        :options: Options to fold with.
+        :returns: A util.workers.WorkerPool.
+        """
+        return WorkerPool(self, size=size, options=options,
+                          workspaces=self.workspaces)
+
+    def stream(self, sequences, options=None, window=64):
+        """Fold a stream of sequences with a single run of the program, which
+        must be able to read one sequence after another from stdin, see pool.
+        Sequences are sent as the program asks for them and each result is
+        parsed as soon as the program has written it, with no more than window
+        sequences sent ahead of the results taken from the generator. So the
+        sequences may come from a generator over more sequences than fit in
+        memory. A sequence which is invalid is given as an InvalidInputError in
+        its place, while a failure of the program stops the stream.
+
+        :sequences: An iterable of sequences to fold.
+        :options: Options to fold every sequence with.
+        :window: The most sequences to send before their results are read.
+        :returns: A generator of the result of each sequence, as read by
+        read_record, in the same order as the sequences.
+        """
+        worker = Worker(self, options=options, workspaces=self.workspaces)
+        try:
+            for result in worker.stream(sequences, window=window):
+                yield result
+        finally:
+            worker.stop()
+
+    def fold_many(self, sequences, options=None, chunk=500, max_workers=4):
+        """Fold many sequences. Programs which can be kept running, see
+        stream, fold all of them in a single run, which is only started again
+        after the program fails on a sequence. Other programs fold each
+        sequence in a run of its own, chunk sequences at a time with map. A
+        sequence which is invalid or could not be folded does not stop the
+        others, instead the exception is given in its place.
+
+        :sequences: An iterable of sequences to fold.
+        :options: Options to fold every sequence with.
+        :chunk: The number of sequences to give map at once.
+        :max_workers: The number of runs of the program to make at once.
+        :returns: A generator of what calling this object returns, or an
+        exception, for each sequence, in the same order as the sequences.
+        """
+        try:
+            self.persistent_arguments(options or {})
+        except (NotImplementedError, InvalidOptionError):
+            return self.__map_many__(sequences, options, chunk, max_workers)
+        return self.__stream_many__(sequences, options)
+
+    def __map_many__(self, sequences, options, chunk, max_workers):
+        sequences = iter(sequences)
+        while True:
+            batch = list(itertools.islice(sequences, chunk))
+            if not batch:
+                return
+            for result in self.map(batch, max_workers=max_workers,
+                                   options=options):
+                yield result
+
+    def __stream_many__(self, sequences, options):
+        def taken(source, sent):
+            for sequence in source:
+                sent.append(sequence)
+                yield sequence
+
+        # Sequences taken by a run but without a result yet, the first of
+        # which is the one the program fails on.
+        sequences = iter(sequences)
+        retry = []
+        while True:
+            sent = deque()
+            source = taken(itertools.chain(retry, sequences), sent)
+            results = self.stream(source, options)
+            try:
+                for result in results:
+                    sent.popleft()
+                    if not isinstance(result, Exception):
+                        result = [result]
+                    yield result
+                return
+            except (ProgramFailedError, ProgramTimeOutError,
+                    FoldingFailedError), err:
+                sent.popleft()
+                retry = list(sent)
+                yield err
+            finally:
+                results.close()
+
     def results(self, process, temp_dir, filename):
         """Generate a ResultSet object for the results.
 
@@ -77,8 +185,8 @@ class Folder(Wrapper):
         :temp_dir: Directory all work was done in.
         :filename: Input filename.
         """
-        return ResultSet(temp_dir, filename)
-
+        return ResultSet(temp_dir, filename,
+                         workspace=getattr(process, 'workspace', None))
 
 class RNAalifold(Folder):
     """Use RNAalifold to fold some sequences. RNAalifold takes a sequence
@@ -89,6 +197,8 @@ class RNAalifold(Folder):
 
     program = 'RNAalifold'
 
+    transport = 'stdin'
+
     def results(self, process, temp_dir, filename):
         """This will generate a list of size 1 because RNAalifold only
         generates a single structure. The result will be a Dot-Bracket parser
@@ -99,11 +209,11 @@ class RNAalifold(Folder):
         :temp_dir: The directory all work was done in.
         :filename: Input filename.
         """
-        self.raw = process.stdout.readlines()
-        if len(self.raw) != 3 and len(self.raw) != 2:
+        raw = process.stdout.readlines()
+        if len(raw) != 3 and len(raw) != 2:
             raise FoldingFailedError("No valid output")
-        consensus = self.raw[0].rstrip()
-        structure_line = self.raw[1].rstrip()
+        consensus = raw[0].rstrip()
+        structure_line = raw[1].rstrip()
         parts = structure_line.split(' ', 1)
         parser = DotBracket(parts[0])
         parser.sequence = consensus
@@ -111,6 +221,7 @@ class RNAalifold(Folder):
 
         ps_parser = self._load_locations(temp_dir, filename)
         parser.locations = ps_parser.locations
+        parser.layout = ps_parser.layout
         parser.box = ps_parser.box
 
         return [parser]
@@ -168,6 +279,112 @@ class RNAalifold(Folder):
         return super(RNAalifold, self).__call__(sequences)
 
 
+class RNAfold(Folder):
+    """Use RNAfold to fold single sequences. RNAfold reads one sequence after
+    another from stdin and writes the minimum free energy structure of each as
+    soon as it is folded, so it can be kept running, see pool and stream. For
+    details see: http://www.tbi.univie.ac.at/RNA/RNAfold.html.
+
+    The results are Dot-Bracket parsers with the sequence, as RNAfold printed
+    it, the name of the record and the energy of the structure set. With the
+    partition option RNAfold also computes base pair probabilities, which are
+    read from its dot plot into the probabilities property as a
+    dot_plot.PairProbabilities.
+    """
+
+    program = 'RNAfold'
+
+    transport = 'stdin'
+
+    options = {
+        'noLP': is_true,
+        'noGU': is_true,
+        'dangles': is_in(0, 1, 2, 3),
+        'partition': is_true,
+    }
+
+    dot_plot = 'sequence_dp.ps'
+    """The dot plot RNAfold writes for the record it is given."""
+
+    structure_pattern = re.compile(r'^(\S+)\s+\(\s*(-?\d+(?:\.\d+)?)\)\s*$')
+
+    def generate_arguments(self, filename, options):
+        return []
+
+    def generate_options(self, filename, options):
+        """RNAfold should not write a drawing of every structure, and its
+        options are not named like the generic ones so we translate them.
+        """
+        opts = ['--noPS']
+        for name in ('noLP', 'noGU'):
+            if options.get(name):
+                opts.append('--%s' % name)
+        if 'dangles' in options:
+            opts.append('-d%s' % options['dangles'])
+        if options.get('partition'):
+            opts.append('-p')
+        return opts
+
+    def persistent_arguments(self, options):
+        if options.get('partition'):
+            raise InvalidOptionError("RNAfold can not be kept running when "
+                                     "computing pair probabilities")
+        return [self.program] + self.generate_options(None, options)
+
+    def record(self, raw):
+        return ">sequence\n%s\n" % raw
+
+    def read_record(self, stream):
+        """Read the header, sequence and structure lines RNAfold writes for a
+        single sequence.
+
+        :stream: A file like object with RNAfold's output.
+        :returns: A Dot-Bracket parser or None if the output ended first.
+        """
+        name = None
+        lines = []
+        while len(lines) < 2:
+            line = stream.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>') and not lines:
+                name = line[1:].strip()
+                continue
+            lines.append(line)
+
+        sequence, structure_line = lines
+        match = self.structure_pattern.match(structure_line)
+        if not match or len(match.group(1)) != len(sequence):
+            raise FoldingFailedError("Could not parse structure line: %s" %
+                                     structure_line)
+        parser = DotBracket(match.group(1))
+        parser.sequence = sequence
+        parser.name = name
+        parser.energy = float(match.group(2))
+        parser.probabilities = None
+        return parser
+
+    def results(self, process, temp_dir, filename):
+        """This will generate a list of size 1 because RNAfold only writes the
+        minimum free energy structure.
+
+        :process: The process object.
+        :temp_dir: The directory all work was done in.
+        :filename: Input filename.
+        """
+        parser = self.read_record(process.stdout)
+        if parser is None:
+            raise FoldingFailedError("No valid output")
+        plot = os.path.join(temp_dir, self.dot_plot)
+        if os.path.exists(plot):
+            with open(plot, 'r') as raw:
+                parser.probabilities = PairProbabilities.from_postscript(raw)
+        return [parser]
+
+
 class UNAFold(Folder):
     """This class wraps up UNAFold for use. UNAFold is the sucessor to mfold.
     UNAFold takes a single sequence and folds it to produce a secondary
@@ -188,51 +405,130 @@ class UNAFold(Folder):
         return super(UNAFold, self).__call__(sequence)
 
 
-class ResultSet(MutableSequence):
-    def __init__(self, base, name):
+class ResultSet(Sequence):
+    """The foldings of a single sequence, in the order the program numbered
+    them, which is by increasing energy. Foldings are read from their connect
+    files each time they are used and are not kept, unless a cache_size is
+    given in which case the most recently used foldings are kept in an LRU.
+    Negative indices and slices work as they do for lists.
+    """
+
+    def __init__(self, base, name, workspace=None, cache_size=0):
+        """Create a new ResultSet of the foldings in a directory.
+
+        :base: The directory the foldings were written to.
+        :name: The input filename the foldings are named after.
+        :workspace: The WorkspacePool the directory belongs to, if any. The
+        directory is retained until this ResultSet and every Result taken
+        from it are deleted.
+        :cache_size: The number of parsed foldings to keep.
+        """
         self._name = name
         self._dir = base
-        files = os.listdir(self._dir)
-        pattern = '%s(_\d+)*\.ct' % self._name
-        valid = [n for n in files if re.match(pattern, n)]
-        if not valid:
+        self._workspace = None
+        self._foldings = None
+        self._cache = LRU(cache_size)
+        if workspace is not None and workspace.retain(base):
+            self._workspace = workspace
+        self._count = self.__count__()
+        if not self._count:
             raise FoldingFailedError("Could not find any generated foldings")
-        self._count = len(valid)
-        self._pairings = [None] * self._count
+
+    def __path__(self, index):
+        """The connect file of a folding, without its extension. The first
+        folding is in name.ct and the others in name_1.ct, name_2.ct and so on.
+        """
+        name = self._name
+        if index:
+            name = '%s_%s' % (name, index)
+        return os.path.join(self._dir, name)
+
+    def __count__(self):
+        count = 0
+        while os.path.exists(self.__path__(count) + '.ct'):
+            count += 1
+        return count
 
     def __getitem__(self, index):
-        if index >= self._count:
+        if isinstance(index, slice):
+            return [self[current]
+                    for current in xrange(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
             raise IndexError("Index out of bounds")
-        if not self._pairings[index]:
-            file_name = self._name
-            if index > 0:
-                file_name += "_%s" % index
-            full_name = os.path.join(self._dir, file_name)
-            self._pairings[index] = Result(full_name)
-        return self._pairings[index]
 
-    def __setitem__(self, index, value):
-        self._pairings = value
+        result = self._cache.get(index)
+        if result is None:
+            result = self.__load__(index)
+            self._cache.put(index, result)
+        return result
 
-    def __delitem__(self, index):
-        del self._pairings[index]
+    def __load__(self, index):
+        if self._foldings is not None:
+            return Result(None, lines=self._foldings[index])
+        return Result(self.__path__(index), owner=self)
 
-    def insert(self, index, value):
-        self._pairings.insert(index, value)
+    def __iter__(self):
+        for index in xrange(self._count):
+            yield self[index]
 
     def __len__(self):
         return self._count
 
+    def __getstate__(self):
+        """Parse all foldings before pickling, so the files they came from are
+        no longer needed.
+        """
+        state = dict(self.__dict__)
+        state['_foldings'] = [result.connect_file() for result in self]
+        state['_workspace'] = None
+        state['_cache'] = self._cache.size
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = LRU(state['_cache'])
+
+    def __del__(self):
+        if getattr(self, '_workspace', None) is not None:
+            self._workspace.release(self._dir)
+
 
 class Result(object):
-    def __init__(self, name):
-        self._name = name + ".%s"
+    def __init__(self, name, lines=None, owner=None):
+        """Create a new Result of the first folding in a connect file.
+
+        :name: The connect file without its extension.
+        :lines: The lines of the connect file, if it was already read.
+        :owner: The ResultSet this came from. Its directory is retained until
+        this Result is deleted, so the connect file can be read again.
+        """
+        self._name = None
+        if name is not None:
+            self._name = name + ".%s"
+        self._workspace = None
+        pool = getattr(owner, '_workspace', None)
+        if pool is not None and pool.retain(owner._dir):
+            self._workspace = (pool, owner._dir)
+        self._lines = lines
         self.parser = Connect(self.connect_file())
         self.sequence = self.parser.sequence
 
     def connect_file(self):
+        """Get the lines of the first folding in the connect file. These are
+        read again from the file each time, so only the parsed folding is
+        kept.
+        """
+        if self._lines is not None:
+            return list(self._lines)
+        # Only the first folding is read from files which hold several.
         with self.__file__('ct') as f:
-            return f.readlines()
+            first = next(iter(ConnectReader(f)), None)
+        if first is None:
+            raise FoldingFailedError("Empty connect file %s" %
+                                     (self._name % 'ct'))
+        return first[1]
 
     def indices(self, flanking=False):
         return self.parser.indices(flanking=flanking)
@@ -243,3 +539,15 @@ class Result(object):
     def __file__(self, extension):
         ext_file = self._name % extension
         return open(ext_file, 'r')
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self._lines is None:
+            state['_lines'] = self.connect_file()
+        state['_workspace'] = None
+        return state
+
+    def __del__(self):
+        if getattr(self, '_workspace', None) is not None:
+            pool, directory = self._workspace
+            pool.release(directory)
@@ -0,0 +1,322 @@
+"""This module computes the partition function of a sequence in process, with
+the simple energy model of primary.energy, in the way of McCaskill. From it
+come the probability of every base pair and structures sampled from the
+Boltzmann ensemble.
+
+Every structure is counted exactly once: a pair (i, j) either stacks on
+(i + 1, j - 1) or closes a loop in which i + 1 and j - 1 do not pair with each
+other. All tables are kept as logarithms, so long sequences neither overflow
+nor underflow, and like the folding tables they are stored by position and
+span and filled one anti-diagonal at a time.
+"""
+
+import heapq
+
+import numpy as np
+
+from rnastructure.primary import energy
+from rnastructure.secondary.basic import Parser
+from rnastructure.secondary.dot_plot import PairProbabilities
+
+GAS_CONSTANT = 0.0019872
+"""The gas constant in kcal/(mol K)."""
+
+
+def logsumexp(values, axis=-1):
+    """Compute log(sum(exp(values))) along an axis without overflowing. Rows
+    which are all -inf give -inf.
+    """
+    top = values.max(axis=axis)
+    shift = np.where(np.isfinite(top), top, 0.0)
+    with np.errstate(divide='ignore'):
+        total = np.log(np.exp(values - np.expand_dims(shift, axis))
+                       .sum(axis=axis))
+    return total + shift
+
+
+class Ensemble(object):
+    """The Boltzmann ensemble of the structures of a single sequence. The
+    partition function is computed when this is created, the pair
+    probabilities the first time they are asked for.
+    """
+
+    def __init__(self, sequence, model=None, span=None, temperature=37.0):
+        """Compute the partition function of a sequence.
+
+        :sequence: The sequence.
+        :model: The energy.Model to use, the stacking model if not given.
+        :span: The largest j - i of any pair (i, j), no limit if None.
+        :temperature: The temperature in degrees Celsius.
+        """
+        self.sequence = sequence
+        self.model = model or energy.Model()
+        self.codes = energy.encode(sequence)
+        self.length = len(self.codes)
+        self.kt = GAS_CONSTANT * (temperature + 273.15)
+        self.span = max(self.length - 1, 0)
+        if span is not None:
+            self.span = min(span, self.span)
+        self._outside = None
+
+        shape = (self.length + 1, self.span + 1)
+        self.lv = np.full(shape, -np.inf)
+        self.lx = np.zeros((self.length + 1, self.span + 2))
+        self.lw = np.zeros((self.length + 1, self.span + 2))
+        self.__inside__()
+        self.lz = self.__exterior__()
+
+    @property
+    def log_partition(self):
+        """The natural logarithm of the partition function."""
+        return float(self.lz[self.length])
+
+    @property
+    def energy(self):
+        """The free energy of the ensemble in kcal/mol."""
+        return -self.kt * self.log_partition
+
+    @property
+    def smallest(self):
+        return self.model.min_loop + 1
+
+    def __weights__(self, first, second):
+        """The log Boltzmann weights of stacking and of closing a loop for the
+        pairs (first, second).
+        """
+        stacked = -self.model.stack(self.codes, first, second) / self.kt
+        closed = -self.model.closing(self.codes, first, second) / self.kt
+        return stacked, closed
+
+    def __inside__(self):
+        """Fill the tables where lv[i, d] is the log of the partition function
+        of i..i + d given i pairs with i + d, lw[i, d + 1] that with any
+        structure and lx[i, d + 1] that without the pair (i, i + d).
+        """
+        lv, lx, lw = self.lv, self.lx, self.lw
+        for span in xrange(self.smallest, self.span + 1):
+            first = np.arange(self.length - span)
+            stacked, closed = self.__weights__(first, first + span)
+
+            value = lx[first + 1, span - 1] + closed
+            if span >= 2:
+                value = np.logaddexp(value, lv[first + 1, span - 2] + stacked)
+            lv[first, span] = value
+
+            without = lw[first + 1, span]
+            inner = np.arange(self.smallest, span)
+            if len(inner):
+                splits = lv[first[:, None], inner[None, :]] + \
+                    lw[first[:, None] + inner[None, :] + 1, span - inner]
+                without = np.logaddexp(without, logsumexp(splits, axis=1))
+            lx[first, span + 1] = without
+            lw[first, span + 1] = np.logaddexp(without, value)
+
+    def __window__(self, last):
+        """The positions which may pair with last in the exterior loop."""
+        return np.arange(max(last - self.span, 0),
+                         max(last - self.smallest + 1, 0))
+
+    def __exterior__(self):
+        """Compute lz where lz[k] is the log of the partition function of the
+        first k bases.
+        """
+        lz = np.zeros(self.length + 1)
+        for last in xrange(self.length):
+            value = lz[last]
+            starts = self.__window__(last)
+            if len(starts):
+                pairs = lz[starts] + self.lv[starts, last - starts]
+                value = np.logaddexp(value, logsumexp(pairs))
+            lz[last + 1] = value
+        return lz
+
+    def __outside__(self):
+        """Fill the outside tables, which hold the log of the partition
+        function of everything around each entry of the inside tables.
+        """
+        if self._outside is not None:
+            return self._outside
+        lv, lw = self.lv, self.lw
+        ov = np.full(lv.shape, -np.inf)
+        ox = np.full(lw.shape, -np.inf)
+        ow = np.full(lw.shape, -np.inf)
+        oz = np.full(self.length + 1, -np.inf)
+        oz[self.length] = 0.0
+
+        for last in xrange(self.length - 1, -1, -1):
+            oz[last] = np.logaddexp(oz[last], oz[last + 1])
+            starts = self.__window__(last)
+            if len(starts):
+                spans = last - starts
+                oz[starts] = np.logaddexp(oz[starts], oz[last + 1] +
+                                          lv[starts, spans])
+                ov[starts, spans] = np.logaddexp(ov[starts, spans],
+                                                 oz[last + 1] +
+                                                 self.lz[starts])
+
+        for span in xrange(self.span, self.smallest - 1, -1):
+            first = np.arange(self.length - span)
+            ox[first, span + 1] = np.logaddexp(ox[first, span + 1],
+                                               ow[first, span + 1])
+            ov[first, span] = np.logaddexp(ov[first, span],
+                                           ow[first, span + 1])
+
+            outer = ox[first, span + 1]
+            ow[first + 1, span] = np.logaddexp(ow[first + 1, span], outer)
+            inner = np.arange(self.smallest, span)
+            if len(inner):
+                rows = first[:, None]
+                ends = rows + inner[None, :] + 1
+                ov[rows, inner[None, :]] = np.logaddexp(
+                    ov[rows, inner[None, :]],
+                    outer[:, None] + lw[ends, span - inner])
+                ow[ends, span - inner] = np.logaddexp(
+                    ow[ends, span - inner],
+                    outer[:, None] + lv[rows, inner[None, :]])
+
+            stacked, closed = self.__weights__(first, first + span)
+            paired = ov[first, span]
+            if span >= 2:
+                ov[first + 1, span - 2] = np.logaddexp(
+                    ov[first + 1, span - 2], paired + stacked)
+            ox[first + 1, span - 1] = np.logaddexp(ox[first + 1, span - 1],
+                                                   paired + closed)
+
+        self._outside = ov
+        return ov
+
+    def probabilities(self, threshold=1e-5):
+        """Compute the probability of every pair.
+
+        :threshold: The smallest probability to keep.
+        :returns: A dot_plot.PairProbabilities.
+        """
+        ov = self.__outside__()
+        with np.errstate(invalid='ignore'):
+            log = self.lv + ov - self.log_partition
+        first, span = np.nonzero(log >= np.log(threshold))
+        return PairProbabilities(first, first + span, np.exp(log[first, span]),
+                                 length=self.length, sequence=self.sequence)
+
+    def sample_pairs(self, count, seed=None):
+        """Draw structures from the ensemble. Samples which reach the same
+        part of the tables are traced back together, so drawing many
+        structures costs little more than drawing a few.
+
+        :count: The number of structures to draw.
+        :seed: A seed or numpy RandomState to draw with.
+        :returns: An array with a row for each structure giving the partner of
+        every position, or -1 where it is unpaired.
+        """
+        random = seed
+        if not isinstance(random, np.random.RandomState):
+            random = np.random.RandomState(seed)
+        table = np.full((count, self.length), -1, dtype=np.int32)
+        pending = {}
+        order = []
+        self.__push__(pending, order, ('exterior', self.length, None),
+                      np.arange(count))
+
+        while order:
+            _, key = heapq.heappop(order)
+            samples = pending.pop(key)
+            kind, first, second = key
+            if kind == 'pair':
+                table[samples, first] = second
+                table[samples, second] = first
+            weights = self.__weights_of__(kind, first, second)
+            if weights is None:
+                continue
+            chosen = self.__choose__(random, weights, len(samples))
+            for index in np.unique(chosen):
+                selected = samples[chosen == index]
+                for child in self.__children__(kind, first, second, index):
+                    self.__push__(pending, order, child, selected)
+        return table
+
+    def __push__(self, pending, order, key, samples):
+        kind, first, second = key
+        if kind in ('any', 'open') and second - first < self.smallest:
+            return
+        if key in pending:
+            pending[key] = np.concatenate((pending[key], samples))
+            return
+        pending[key] = samples
+        # Every part of the tables is reached only from larger parts, so
+        # taking the largest first traces back each part once.
+        if kind == 'exterior':
+            priority = (0, -first, 0)
+        else:
+            priority = (1, first - second, 0 if kind == 'any' else 1)
+        heapq.heappush(order, (priority, key))
+
+    def __weights_of__(self, kind, first, second):
+        """The log weights of the ways to continue tracing back a part of the
+        tables, in the order of __children__, or None if it is done.
+        """
+        if kind == 'exterior':
+            if first == 0:
+                return None
+            last = first - 1
+            starts = self.__window__(last)
+            return np.concatenate(([self.lz[last]], self.lz[starts] +
+                                   self.lv[starts, last - starts]))
+
+        span = second - first
+        if kind == 'pair':
+            stacked, closed = self.__weights__(np.array([first]),
+                                               np.array([second]))
+            weights = [self.lx[first + 1, span - 1] + closed[0]]
+            if span >= 2:
+                weights.append(self.lv[first + 1, span - 2] + stacked[0])
+            return np.array(weights)
+
+        if kind == 'any':
+            return np.array([self.lx[first, span + 1], self.lv[first, span]])
+
+        inner = np.arange(self.smallest, span)
+        return np.concatenate(([self.lw[first + 1, span]],
+                               self.lv[first, inner] +
+                               self.lw[first + inner + 1, span - inner]))
+
+    def __children__(self, kind, first, second, index):
+        """The parts of the tables the chosen way to continue leads to."""
+        if kind == 'exterior':
+            last = first - 1
+            if index == 0:
+                return [('exterior', last, None)]
+            start = self.__window__(last)[index - 1]
+            return [('exterior', start, None), ('pair', start, last)]
+        if kind == 'pair':
+            if index == 0:
+                return [('open', first + 1, second - 1)]
+            return [('pair', first + 1, second - 1)]
+        if kind == 'any':
+            if index == 0:
+                return [('open', first, second)]
+            return [('pair', first, second)]
+        if index == 0:
+            return [('any', first + 1, second)]
+        end = first + self.smallest + index - 1
+        return [('pair', first, end), ('any', end + 1, second)]
+
+    def __choose__(self, random, weights, count):
+        weights = np.exp(weights - weights.max())
+        bounds = np.cumsum(weights)
+        chosen = np.searchsorted(bounds, random.random_sample(count) *
+                                 bounds[-1], side='right')
+        return np.minimum(chosen, len(weights) - 1)
+
+    def sample(self, count, seed=None):
+        """Draw structures from the ensemble.
+
+        :count: The number of structures to draw.
+        :seed: A seed or numpy RandomState to draw with.
+        :returns: A list of basic.Parser objects.
+        """
+        parsers = []
+        for row in self.sample_pairs(count, seed=seed):
+            pairs = [None if partner < 0 else partner
+                     for partner in row.tolist()]
+            parsers.append(Parser(pairs, sequence=self.sequence))
+        return parsers
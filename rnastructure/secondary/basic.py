@@ -43,6 +43,22 @@ class Parser(object):
         self.__as_tree()
         self.__find_indices(self._tree)
 
+    def __getstate__(self):
+        """The loop tree is left out when pickling, as it is deeply nested and
+        can be rebuilt from the pairs.
+        """
+        state = dict(self.__dict__)
+        del state['_tree']
+        del state['_loops']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tree = Node((None, len(self._pairs)))
+        self._loops = {}
+        self.__as_tree()
+        self.__find_indices(self._tree)
+
     def __as_tree(self):
         stack = []
         for i, pair in enumerate(self._pairs):
@@ -220,7 +236,7 @@ class Node(object):
         biggest = self.largest()
         while biggest > child:
             child.add_child(biggest)
-            self.children.remove(biggest)
+            self.children.pop()
             biggest = self.largest()
         self.add_child(child)
 
@@ -98,3 +98,44 @@ class Parser(basic.Parser):
             else:
                 raise InvalidConnectLine("Invalid line: %s" % line)
         return pairs
+
+
+class Reader(object):
+    """Read a stream of connect files one structure at a time. This is useful
+    for files with the structures of many sequences, like the ones written by
+    folding programs given several sequences, as only a single structure is
+    kept in memory at once.
+    """
+
+    header = re.compile('\A\s*(\d+)\s+(dG|Energy|ENERGY)\s*=\s*(\S*)\s*(.*)')
+
+    def __init__(self, stream):
+        """Create a new Reader.
+
+        :stream: An iterable of lines, like an open file.
+        """
+        self.stream = stream
+
+    def __iter__(self):
+        """Iterate over the structures.
+
+        :returns: A generator of (name, lines) tuples, where name is the text
+        after the energy in the header line, or '' if there is none, and
+        lines are the lines of the structure including the header.
+        """
+        name = None
+        lines = []
+        for line in self.stream:
+            match = self.header.match(line)
+            if match:
+                if lines:
+                    yield name, lines
+                name = match.group(4).strip()
+                lines = [line]
+            elif line.strip():
+                if not lines:
+                    raise InvalidConnectLine("Missing header: %s" % line)
+                lines.append(line)
+        if lines:
+            yield name, lines
+
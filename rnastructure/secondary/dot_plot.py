@@ -0,0 +1,207 @@
+"""This module reads the base pair probabilities that RNAfold -p and
+RNAalifold -p write to their dot plots, dot.ps and alidot.ps. Each probable
+pair is a line ending in ubox which gives the two 1 based positions and the
+square root of the probability of the pair, with RNAalifold also giving the
+colour of the pair first. Most of the L x L possible pairs of a long sequence
+are never formed, so the probabilities are kept as a sparse matrix of only the
+pairs in the plot instead of a dense one.
+"""
+
+import numpy as np
+
+from rnastructure.secondary.basic import Parser as BaseParser
+from rnastructure.secondary.pseudoknot import nested_subset
+
+
+class NoProbabilitiesError(Exception):
+    """This indicates that a file did not contain any base pair probabilities.
+    """
+    pass
+
+
+class PairProbabilities(object):
+    """A sparse, upper triangular matrix of base pair probabilities. The
+    pairs are stored in coordinate form as three arrays, left, right and
+    probability, ordered by the left and then the right position. All
+    positions are 0 based.
+    """
+
+    def __init__(self, left, right, probability, length=None, sequence=None):
+        """Create a new PairProbabilities.
+
+        :left: The left position of every pair.
+        :right: The right position of every pair, which must be larger than
+        the left one.
+        :probability: The probability of every pair.
+        :length: The length of the sequence, the largest position if not
+        given.
+        :sequence: The sequence the probabilities are of, if known.
+        """
+        left = np.asarray(left, dtype=np.int32)
+        right = np.asarray(right, dtype=np.int32)
+        probability = np.asarray(probability, dtype=float)
+        if np.any(left >= right):
+            raise ValueError("Pairs must have left < right")
+        if length is None:
+            length = len(sequence) if sequence else \
+                (int(right.max()) + 1 if len(right) else 0)
+        if len(right) and right.max() >= length:
+            raise ValueError("Pair outside of a sequence of length %s" %
+                             length)
+
+        order = np.lexsort((right, left))
+        self.left = left[order]
+        self.right = right[order]
+        self.probability = probability[order]
+        self.length = length
+        self.sequence = sequence
+
+    @classmethod
+    def from_postscript(cls, stream, threshold=0.0, chunk=65536):
+        """Read the probabilities from a dot plot. Lines are converted to
+        arrays a chunk at a time and pairs less probable than the threshold
+        are dropped as they are read, so memory use is bounded by the chunk
+        and the pairs kept.
+
+        :stream: A file like object of the dot plot.
+        :threshold: The smallest probability to keep.
+        :chunk: The number of lines to convert at once.
+        :returns: A PairProbabilities.
+        :raises: NoProbabilitiesError if the file has no ubox lines.
+        """
+        sequence = None
+        found = False
+        rows = []
+        parts = ([], [], [])
+
+        stream = iter(stream)
+        for line in stream:
+            if line.startswith('/sequence'):
+                sequence = cls.__sequence__(line, stream)
+            elif line[:1].isdigit() and line.rstrip().endswith(' ubox'):
+                found = True
+                rows.append(' '.join(line.rsplit(None, 4)[-4:-1]))
+                if len(rows) >= chunk:
+                    cls.__convert__(rows, threshold, parts)
+                    rows = []
+
+        if not found:
+            raise NoProbabilitiesError("No base pair probabilities found")
+        cls.__convert__(rows, threshold, parts)
+        left, right, probability = [np.concatenate(part) for part in parts]
+        return cls(left, right, probability, sequence=sequence)
+
+    @staticmethod
+    def __sequence__(line, stream):
+        """Read the sequence, which is written as a postscript string on one
+        or more lines ending in a backslash.
+        """
+        text = [line.split('(', 1)[1] if '(' in line else '']
+        while ')' not in text[-1]:
+            text.append(next(stream, ')'))
+        text[-1] = text[-1].split(')', 1)[0]
+        return ''.join(text).replace('\\', '').replace('\n', '').strip() or \
+            None
+
+    @staticmethod
+    def __convert__(rows, threshold, parts):
+        if not rows:
+            return
+        values = np.fromstring(' '.join(rows), sep=' ').reshape(-1, 3)
+        probability = values[:, 2] ** 2
+        keep = (probability >= threshold) & (probability > 0)
+        parts[0].append(values[keep, 0].astype(np.int32) - 1)
+        parts[1].append(values[keep, 1].astype(np.int32) - 1)
+        parts[2].append(probability[keep])
+
+    def __len__(self):
+        return len(self.probability)
+
+    def csr(self, symmetric=False):
+        """Get the matrix in compressed sparse row form.
+
+        :symmetric: If true then every pair is in both the row of its left
+        and of its right position, otherwise only in the row of its left one.
+        :returns: A tuple of the row pointers, column indices and
+        probabilities, as used by scipy.sparse.csr_matrix.
+        """
+        rows, columns, values = self.left, self.right, self.probability
+        if symmetric:
+            rows = np.concatenate((self.left, self.right))
+            columns = np.concatenate((self.right, self.left))
+            values = np.concatenate((values, values))
+            order = np.lexsort((columns, rows))
+            rows, columns, values = rows[order], columns[order], values[order]
+        pointers = np.zeros(self.length + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.length), out=pointers[1:])
+        return pointers, columns, values
+
+    def get(self, first, second):
+        """Get the probability that two positions pair.
+
+        :first: A 0 based position.
+        :second: Another 0 based position.
+        :returns: The probability, 0 if the pair is not in the matrix.
+        """
+        first, second = min(first, second), max(first, second)
+        start = np.searchsorted(self.left, first, side='left')
+        end = np.searchsorted(self.left, first, side='right')
+        index = start + np.searchsorted(self.right[start:end], second)
+        if index < end and self.right[index] == second:
+            return float(self.probability[index])
+        return 0.0
+
+    def dense(self):
+        """Get the full symmetric L x L matrix. This is only sensible for
+        short sequences.
+        """
+        matrix = np.zeros((self.length, self.length))
+        matrix[self.left, self.right] = self.probability
+        matrix[self.right, self.left] = self.probability
+        return matrix
+
+    def paired(self):
+        """Get the probability that each position is paired at all."""
+        return np.bincount(self.left, self.probability, self.length) + \
+            np.bincount(self.right, self.probability, self.length)
+
+    def unpaired(self):
+        """Get the probability that each position is unpaired."""
+        return np.clip(1.0 - self.paired(), 0.0, 1.0)
+
+    def pairs(self, threshold=0.5):
+        """Get the pairs which are at least as probable as a threshold.
+
+        :threshold: The smallest probability to include.
+        :returns: A list of (left, right, probability) tuples ordered by
+        position.
+        """
+        keep = self.probability >= threshold
+        return zip(self.left[keep].tolist(), self.right[keep].tolist(),
+                   self.probability[keep].tolist())
+
+    def mea(self, gamma=1.0):
+        """Find the maximum expected accuracy structure, the nested structure
+        which maximizes the sum of 2 * gamma * p(i, j) over its pairs plus
+        the unpaired probability of its unpaired positions. Only pairs which
+        gain more than the unpaired probability they give up can be part of
+        it, so the dynamic program of pseudoknot.nested_subset runs over those
+        alone.
+
+        :gamma: The weight of pairs, larger values give more pairs.
+        :returns: A basic.Parser of the structure, with the sequence if it is
+        known.
+        """
+        unpaired = self.unpaired()
+        weights = 2 * gamma * self.probability - unpaired[self.left] - \
+            unpaired[self.right]
+        useful = weights > 0
+        left, right = self.left[useful], self.right[useful]
+        selected = nested_subset(left, right, weights[useful])
+
+        pairs = [None] * self.length
+        for first, second in zip(left[selected].tolist(),
+                                 right[selected].tolist()):
+            pairs[first] = second
+            pairs[second] = first
+        return BaseParser(pairs, sequence=self.sequence)
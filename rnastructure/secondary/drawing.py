@@ -0,0 +1,313 @@
+"""This module computes 2D drawings of secondary structures without calling
+RNAplot. The drawings provide the same interface as the parsers in
+rnastructure.secondary.rnaplot, a locations list, a layout and a bounding box,
+so they can be used anywhere a drawing from RNAplot is used.
+
+Two layouts are provided. Radial is a port of the simple radial layout RNAplot
+uses for layout_type 0, where every loop is drawn as a regular polygon. Loops
+places the nucleotides of each loop on a circle sized to fit them, in the
+spirit of NAView, and is computed from the tree of basic.Node objects. Only
+nested pairs can be drawn, any pairs which cross are drawn as unpaired.
+"""
+
+from __future__ import division
+
+import abc
+import math
+
+import numpy as np
+
+import rnastructure.secondary.basic as basic
+import rnastructure.secondary.rnaplot as rnaplot
+
+
+def nested_pairs(pairs):
+    """Remove all crossing pairs from a pair table. When two pairs cross the
+    one which closes first is kept.
+
+    :pairs: A list of pairs as used by basic.Parser.
+    :returns: A new list of pairs without any crossing pairs.
+    """
+    nested = [None] * len(pairs)
+    stack = []
+    for index, partner in enumerate(pairs):
+        if partner is None or partner == index:
+            continue
+        if index < partner:
+            stack.append(index)
+        elif partner in stack:
+            while stack[-1] != partner:
+                stack.pop()
+            stack.pop()
+            nested[partner] = index
+            nested[index] = partner
+    return nested
+
+
+def as_tree(pairs):
+    """Build a tree of basic.Node objects from a nested pair table. Each pair
+    is one node and the root node spans the whole structure.
+
+    :pairs: A list of nested pairs.
+    :returns: The root Node.
+    """
+    root = basic.Node((None, len(pairs)))
+    stack = [root]
+    for index, partner in enumerate(pairs):
+        if partner is None:
+            continue
+        if index < partner:
+            node = basic.Node((index, partner))
+            stack[-1].add_child(node)
+            stack.append(node)
+        else:
+            stack.pop()
+    return root
+
+
+class Drawing(rnaplot.Parser):
+    """The base class of all computed drawings. Subclasses must implement
+    coordinates, which computes an (N, 2) array of positions for the nested
+    pairs it is given.
+    """
+
+    backbone = 15.0
+    """Distance between consecutive nucleotides."""
+
+    margin = 10.0
+    """Space around the drawing which is included in the box."""
+
+    def load_data(self, structure):
+        pairs = nested_pairs(structure._pairs)
+        coordinates = self.coordinates(pairs)
+        self.locations = coordinates
+        low = np.floor(coordinates.min(axis=0) - self.margin)
+        high = np.ceil(coordinates.max(axis=0) + self.margin)
+        self.box = (int(low[0]), int(low[1]), int(high[0]), int(high[1]))
+        return structure.sequence, list(structure._pairs)
+
+    @abc.abstractmethod
+    def coordinates(self, pairs):
+        """Compute the position of every nucleotide.
+
+        :pairs: The nested pairs to draw.
+        :returns: An (N, 2) array of positions.
+        """
+        pass
+
+
+class Radial(Drawing):
+    """The simple radial layout used by RNAplot. Each loop is drawn as a
+    regular polygon and helices as straight ladders.
+    """
+
+    def coordinates(self, pairs):
+        length = len(pairs)
+        table = [0] * (length + 3)
+        table[0] = length
+        for index, partner in enumerate(pairs):
+            if partner is not None:
+                table[index + 1] = partner + 1
+
+        angle = np.zeros(length + 5)
+        loops = [(0, length + 1)]
+        while loops:
+            i, j = loops.pop()
+            self.__loop__(table, angle, i, j, loops)
+
+        if length == 1:
+            return np.array([[100.0, 100.0]])
+
+        turns = math.pi - angle[2:length]
+        alpha = np.concatenate(([0.0], np.cumsum(turns)))
+        steps = self.backbone * np.column_stack((np.cos(alpha),
+                                                 np.sin(alpha)))
+        coordinates = np.vstack(([0.0, 0.0], np.cumsum(steps, axis=0)))
+        return coordinates + [100.0, 100.0]
+
+    def __loop__(self, table, angle, i, j, loops):
+        """Add the angles of a single loop, pushing the loops closed by the
+        helices leaving this loop onto loops. This follows loop() in the
+        RNAplot sources, but works on an explicit stack of loops.
+        """
+        count = 2
+        remember = []
+        i_old = i - 1
+        j += 1
+        while i != j:
+            partner = table[i]
+            if not partner or i == 0:
+                i += 1
+                count += 1
+                continue
+
+            count += 2
+            k, l = i, partner
+            remember.extend((k, l))
+            i = partner + 1
+
+            start_k, start_l = k, l
+            ladder = 0
+            while True:
+                k += 1
+                l -= 1
+                ladder += 1
+                # A helix closing an empty hairpin ends when its sides meet.
+                if k >= l or table[k] != l:
+                    break
+
+            fill = ladder - 2
+            if ladder >= 2:
+                angle[start_k + 1 + fill] += math.pi / 2
+                angle[start_l - 1 - fill] += math.pi / 2
+                angle[start_k] += math.pi / 2
+                angle[start_l] += math.pi / 2
+                if ladder > 2:
+                    angle[start_k + 1:start_k + fill + 1] = math.pi
+                    angle[start_l - fill:start_l] = math.pi
+            loops.append((k, l))
+
+        polygon = math.pi * (count - 2) / count
+        remember.append(j)
+        begin = max(i_old, 0)
+        for index in xrange(0, len(remember), 2):
+            angle[begin:remember[index] + 1] += polygon
+            if index + 1 < len(remember):
+                begin = remember[index + 1]
+
+
+class Loops(Drawing):
+    """A loop based layout. The nucleotides of every loop are placed on a
+    circle whose radius is chosen so that consecutive nucleotides are a
+    backbone apart and paired nucleotides are a pair width apart. Helices
+    leave their loop perpendicular to the circle.
+    """
+
+    pair = 22.0
+    """Distance between paired nucleotides."""
+
+    def coordinates(self, pairs):
+        coordinates = np.zeros((len(pairs), 2))
+        root = as_tree(pairs)
+
+        # The exterior loop is drawn as a straight line with all helices
+        # pointing up.
+        x = 0.0
+        helices = []
+        position = 0
+        for child in root.children:
+            first, last = child.value
+            for index in xrange(position, first):
+                coordinates[index] = (x, 0.0)
+                x += self.backbone
+            coordinates[first] = (x, 0.0)
+            coordinates[last] = (x + self.pair, 0.0)
+            helices.append(child)
+            x += self.pair + self.backbone
+            position = last + 1
+        for index in xrange(position, len(pairs)):
+            coordinates[index] = (x, 0.0)
+            x += self.backbone
+
+        while helices:
+            node = self.__helix__(helices.pop(), coordinates)
+            helices.extend(self.__loop__(node, coordinates))
+        return coordinates
+
+    def __direction__(self, coordinates, node):
+        first, last = node.value
+        across = coordinates[last] - coordinates[first]
+        normal = np.array([-across[1], across[0]])
+        return normal / np.hypot(*normal)
+
+    def __helix__(self, node, coordinates):
+        """Place all pairs stacked on top of the given one. This returns the
+        last pair of the helix, which closes a loop.
+        """
+        step = self.__direction__(coordinates, node) * self.backbone
+        while len(node.children) == 1 and not node.unpaired():
+            child = node.children[0]
+            coordinates[child.value[0]] = coordinates[node.value[0]] + step
+            coordinates[child.value[1]] = coordinates[node.value[1]] + step
+            node = child
+        return node
+
+    def __radius__(self, chords):
+        """Find the radius of the circle on which the given chords, placed end
+        to end, go around exactly once.
+        """
+        chords = np.asarray(chords) / 2.0
+        low = chords.max()
+        if 2 * np.arcsin(chords / low).sum() <= 2 * math.pi:
+            return low
+
+        # The total angle is a convex, decreasing function of the radius and
+        # is too large at this starting point, so Newton's method approaches
+        # the root from below without overshooting.
+        radius = max(chords.sum() / math.pi, low * (1 + 1e-9))
+        for _ in xrange(100):
+            ratio = chords / radius
+            excess = 2 * np.arcsin(ratio).sum() - 2 * math.pi
+            slope = -2 * (ratio / np.sqrt(1 - ratio ** 2)).sum() / radius
+            step = excess / slope
+            radius -= step
+            if abs(step) < 1e-9 * radius:
+                break
+        return radius
+
+    def __loop__(self, node, coordinates):
+        """Place the nucleotides of the loop closed by the given node. This
+        returns the nodes of the helices which leave this loop.
+        """
+        first, last = node.value
+        # Walk the loop to find the vertices and the chords between them.
+        vertices = [first]
+        chords = []
+        position = first + 1
+        for child in node.children:
+            for index in xrange(position, child.value[0]):
+                vertices.append(index)
+                chords.append(self.backbone)
+            vertices.extend(child.value)
+            chords.extend((self.backbone, self.pair))
+            position = child.value[1] + 1
+        for index in xrange(position, last):
+            vertices.append(index)
+            chords.append(self.backbone)
+        vertices.append(last)
+        chords.append(self.backbone)
+        chords = np.array(chords)
+
+        radius = self.__radius__(np.append(chords, self.pair))
+        start = coordinates[first]
+        middle = (start + coordinates[last]) / 2.0
+        height = math.sqrt(max(radius ** 2 - (self.pair / 2.0) ** 2, 0.0))
+        center = middle + self.__direction__(coordinates, node) * height
+
+        offset = start - center
+        phi = math.atan2(offset[1], offset[0])
+        steps = 2 * np.arcsin(np.minimum(chords / (2 * radius), 1))
+        angles = phi - np.cumsum(steps[:-1])
+        placed = np.column_stack((np.cos(angles), np.sin(angles)))
+        coordinates[vertices[1:-1]] = center + radius * placed
+        return list(node.children)
+
+
+class Drawer(object):
+    """This draws structures in process. It is called like the
+    rnaplot.RNAplot wrapper and returns a Drawing.
+    """
+
+    layouts = {0: Radial, 1: Loops}
+
+    def __call__(self, secondary, layout_type=0):
+        """Create a drawing of the given secondary structure.
+
+        :secondary: A parsed secondary structure.
+        :layout_type: One of 0, 1 to indicate the type of layout, radial or
+        loop based.
+        :returns: A Drawing of the structure.
+        """
+        if layout_type not in self.layouts:
+            raise ValueError("Unknown layout type %s" % layout_type)
+        return self.layouts[layout_type](secondary)
@@ -0,0 +1,240 @@
+"""This module provides a container for the drawing coordinates of a secondary
+structure. Coordinates are stored as a single (N, 2) array so that transforms
+can be applied to the whole drawing at once. A simple uniform grid is used to
+index the coordinates, which makes hit testing, finding the nucleotide nearest
+to a point and finding all nucleotides inside a rectangle, fast even for very
+large drawings.
+"""
+
+from __future__ import division
+
+import math
+
+import numpy as np
+
+
+class EmptyLayoutError(Exception):
+    """This is raised when trying to create a layout with no coordinates.
+    """
+    pass
+
+
+class GridIndex(object):
+    """A uniform grid over a set of points. Points are sorted by the cell they
+    fall into so that the points of any run of cells in a single row of the
+    grid form one contiguous slice of the sorted points.
+    """
+
+    def __init__(self, coordinates, cell=None):
+        """Build a new index.
+
+        :coordinates: An (N, 2) array of points to index.
+        :cell: The size of each cell. If not given one is picked so that
+        there is roughly one point per cell.
+        """
+        self._coordinates = coordinates
+        self._origin = coordinates.min(axis=0)
+        extent = coordinates.max(axis=0) - self._origin
+
+        if cell is None:
+            area = max(extent[0], 1.0) * max(extent[1], 1.0)
+            cell = math.sqrt(area / len(coordinates))
+        self.cell = max(float(cell), 1e-9)
+
+        self._shape = (np.floor(extent / self.cell).astype(int) + 1)
+        cells = self.__cells__(coordinates)
+        keys = cells[:, 1] * self._shape[0] + cells[:, 0]
+        self._order = np.argsort(keys, kind='mergesort')
+        self._keys = keys[self._order]
+
+    def __cells__(self, points):
+        cells = np.floor((points - self._origin) / self.cell).astype(int)
+        return np.clip(cells, 0, self._shape - 1)
+
+    def __candidates__(self, low, high):
+        """Get the indices of all points in the cells between the low and high
+        cell coordinates, inclusive.
+        """
+        width = self._shape[0]
+        rows = np.arange(low[1], high[1] + 1)
+        starts = np.searchsorted(self._keys, rows * width + low[0], 'left')
+        stops = np.searchsorted(self._keys, rows * width + high[0], 'right')
+        chunks = [self._order[a:b] for a, b in zip(starts, stops) if b > a]
+        if not chunks:
+            return np.empty(0, dtype=int)
+        return np.concatenate(chunks)
+
+    def within(self, x0, y0, x1, y1):
+        """Find all points inside the given rectangle, edges included.
+
+        :returns: A sorted array of the indices of the points.
+        """
+        low = np.array([min(x0, x1), min(y0, y1)], dtype=float)
+        high = np.array([max(x0, x1), max(y0, y1)], dtype=float)
+        if np.any(high < self._origin) or \
+                np.any(low > self._origin + self._shape * self.cell):
+            return np.empty(0, dtype=int)
+
+        found = self.__candidates__(self.__cells__(low), self.__cells__(high))
+        points = self._coordinates[found]
+        inside = np.all((points >= low) & (points <= high), axis=1)
+        return np.sort(found[inside])
+
+    def nearest(self, x, y, radius=None):
+        """Find the point closest to the given position.
+
+        :x: The x coordinate to search from.
+        :y: The y coordinate to search from.
+        :radius: If given, only points at most this far away are considered.
+        :returns: The index of the closest point, or None if there is none.
+        """
+        target = np.array([x, y], dtype=float)
+        center = self.__cells__(target)
+        rings = int(self._shape.max())
+        if radius is not None:
+            rings = min(rings, int(math.ceil(radius / self.cell)) + 1)
+
+        best = None
+        for ring in range(rings + 1):
+            low = np.maximum(center - ring, 0)
+            high = np.minimum(center + ring, self._shape - 1)
+            found = self.__candidates__(low, high)
+            if not len(found):
+                continue
+            distances = np.hypot(*(self._coordinates[found] - target).T)
+            best = found[np.argmin(distances)]
+            # Any point outside of the searched cells is at least this far
+            # away, so one more pass at the right size settles it.
+            reach = int(math.ceil(distances.min() / self.cell))
+            if reach > ring:
+                low = np.maximum(center - reach, 0)
+                high = np.minimum(center + reach, self._shape - 1)
+                found = self.__candidates__(low, high)
+                distances = np.hypot(*(self._coordinates[found] - target).T)
+                best = found[np.argmin(distances)]
+            break
+
+        if best is None:
+            return None
+        if radius is not None and \
+                np.hypot(*(self._coordinates[best] - target)) > radius:
+            return None
+        return int(best)
+
+
+class Layout(object):
+    """The drawing coordinates of a structure. Transforms return a new Layout
+    and never modify the coordinates in place.
+    """
+
+    def __init__(self, locations, cell=None):
+        """Create a new Layout.
+
+        :locations: An iterable of (x, y) pairs or an (N, 2) array.
+        :cell: The cell size of the spatial index, see GridIndex.
+        """
+        self.coordinates = np.array(locations, dtype=float).reshape(-1, 2)
+        if not len(self.coordinates):
+            raise EmptyLayoutError("Must give coordinates for a layout")
+        self._cell = cell
+        self._index = None
+
+    def locations(self):
+        """Get the coordinates as a list of (x, y) tuples.
+        """
+        return [tuple(point) for point in self.coordinates.tolist()]
+
+    def bounds(self):
+        """Get the bounding box of the coordinates as (xmin, ymin, xmax,
+        ymax).
+        """
+        low = self.coordinates.min(axis=0)
+        high = self.coordinates.max(axis=0)
+        return (low[0], low[1], high[0], high[1])
+
+    def center(self):
+        """Get the center of the bounding box.
+        """
+        x0, y0, x1, y1 = self.bounds()
+        return ((x0 + x1) / 2.0, (y0 + y1) / 2.0)
+
+    def translate(self, dx, dy):
+        """Move all coordinates by the given offset.
+        """
+        return self.__derived__(self.coordinates + [dx, dy])
+
+    def scale(self, sx, sy=None, origin=None):
+        """Scale all coordinates around some origin.
+
+        :sx: Scale factor along x.
+        :sy: Scale factor along y, defaults to sx.
+        :origin: Point to scale around, defaults to the center.
+        """
+        if sy is None:
+            sy = sx
+        origin = np.array(self.center() if origin is None else origin,
+                          dtype=float)
+        scaled = (self.coordinates - origin) * [sx, sy] + origin
+        return self.__derived__(scaled)
+
+    def rotate(self, angle, origin=None):
+        """Rotate all coordinates counterclockwise around some origin.
+
+        :angle: The angle to rotate by in degrees.
+        :origin: Point to rotate around, defaults to the center.
+        """
+        theta = math.radians(angle)
+        rotation = np.array([[math.cos(theta), math.sin(theta)],
+                             [-math.sin(theta), math.cos(theta)]])
+        origin = np.array(self.center() if origin is None else origin,
+                          dtype=float)
+        rotated = np.dot(self.coordinates - origin, rotation) + origin
+        return self.__derived__(rotated)
+
+    def fit(self, box, margin=0.0):
+        """Uniformly scale and move the coordinates so they are centered in
+        the given box, keeping the aspect ratio.
+
+        :box: The box to fit into as (xmin, ymin, xmax, ymax).
+        :margin: Space to leave free on every side of the box.
+        """
+        x0, y0, x1, y1 = [float(v) for v in box]
+        width = (x1 - x0) - 2 * margin
+        height = (y1 - y0) - 2 * margin
+        if width < 0 or height < 0:
+            raise ValueError("Margin is larger than the box")
+
+        low = self.coordinates.min(axis=0)
+        extent = self.coordinates.max(axis=0) - low
+        factors = [s / e for e, s in zip(extent, (width, height)) if e]
+        factor = min(factors) if factors else 1.0
+
+        fitted = (self.coordinates - low) * factor
+        offset = np.array([(x0 + x1) / 2.0, (y0 + y1) / 2.0]) - \
+            extent * factor / 2.0
+        return self.__derived__(fitted + offset)
+
+    def index(self):
+        """Get the spatial index of this layout, building it if needed.
+        """
+        if self._index is None:
+            self._index = GridIndex(self.coordinates, cell=self._cell)
+        return self._index
+
+    def nearest(self, x, y, radius=None):
+        """Find the index of the nucleotide nearest to a point. See
+        GridIndex.nearest.
+        """
+        return self.index().nearest(x, y, radius=radius)
+
+    def within(self, x0, y0, x1, y1):
+        """Find the indices of all nucleotides inside a rectangle. See
+        GridIndex.within.
+        """
+        return self.index().within(x0, y0, x1, y1)
+
+    def __derived__(self, coordinates):
+        return Layout(coordinates, cell=self._cell)
+
+    def __len__(self):
+        return len(self.coordinates)
@@ -2,6 +2,8 @@ from __future__ import with_statement
 
 from os import path
 
+import numpy as np
+
 from rnastructure.util.wrapper import is_true
 from rnastructure.util.wrapper import is_number
 from rnastructure.util.wrapper import Wrapper as Base
@@ -10,6 +12,187 @@ from rnastructure.secondary.connect import Parser as CtParser
 from rnastructure.secondary.connect import Writer as CtWriter
 
 
+def arcs(pairs):
+    """Get the pairs of a pair table as two arrays of the left and right
+    position of every pair, ordered by the left position.
+
+    :pairs: A list of pairs as used by basic.Parser.
+    :returns: A tuple of two integer arrays.
+    """
+    table = np.array([-1 if pair is None else pair for pair in pairs],
+                     dtype=np.int64)
+    left = np.flatnonzero(table > np.arange(len(table)))
+    return left, table[left]
+
+
+def crossing(pairs):
+    """Find which pairs cross some other pair. A pair (i, j) crosses another
+    if any position between i and j pairs with a position outside of them.
+
+    :pairs: A list of pairs as used by basic.Parser.
+    :returns: A tuple of the left and right positions of all pairs, as from
+    arcs, and a boolean array that is true for every pair that crosses.
+    """
+    left, right = arcs(pairs)
+    crosses = np.zeros(len(left), dtype=bool)
+    inside = right - left > 1
+    if not inside.any():
+        return left, right, crosses
+
+    # Unpaired positions are treated as pairing with themselves so they never
+    # reach outside of any pair.
+    partners = np.arange(len(pairs))
+    partners[left] = right
+    partners[right] = left
+
+    # reduceat reduces over [bounds[k], bounds[k + 1]), so interleaving the
+    # starts and ends gives the interior of every pair at the even entries.
+    bounds = np.empty(2 * inside.sum(), dtype=np.int64)
+    bounds[0::2] = left[inside] + 1
+    bounds[1::2] = right[inside]
+    lowest = np.minimum.reduceat(partners, bounds)[0::2]
+    highest = np.maximum.reduceat(partners, bounds)[0::2]
+    crosses[inside] = (lowest < left[inside]) | (highest > right[inside])
+    return left, right, crosses
+
+
+def nested_subset(left, right, weights):
+    """Find the subset of pairs with the largest total weight where no two
+    pairs cross or share a position. This uses the usual interval dynamic
+    program, but only over the positions that are part of some pair, and
+    computes each row of the table with vectorized operations. When there is
+    a tie, pairs that start further left are preferred.
+
+    :left: The left position of every pair.
+    :right: The right position of every pair.
+    :weights: The weight of every pair.
+    :returns: A boolean array that is true for the selected pairs.
+    """
+    left = np.asarray(left)
+    right = np.asarray(right)
+    weights = np.asarray(weights, dtype=float)
+    selected = np.zeros(len(left), dtype=bool)
+    if not len(left):
+        return selected
+
+    positions = np.unique(np.concatenate((left, right)))
+    first = np.searchsorted(positions, left)
+    last = np.searchsorted(positions, right)
+    size = len(positions)
+    starting = [[] for _ in xrange(size)]
+    for index in np.argsort(first, kind='mergesort'):
+        starting[first[index]].append(index)
+
+    # best[x, y] is the best weight using only positions x..y. The extra row
+    # and column hold the empty intervals so no bounds checks are needed.
+    best = np.zeros((size + 2, size + 1))
+    for x in xrange(size - 1, -1, -1):
+        row = best[x + 1].copy()
+        for index in starting[x]:
+            y = last[index]
+            inner = best[x + 1, y - 1] if y - 1 > x else 0.0
+            value = weights[index] + inner + best[y + 1, y:]
+            row[y:] = np.maximum(row[y:], value)
+        best[x] = row
+
+    intervals = [(0, size - 1)]
+    while intervals:
+        x, y = intervals.pop()
+        if y <= x:
+            continue
+        for index in starting[x]:
+            end = last[index]
+            if end > y:
+                continue
+            inner = best[x + 1, end - 1] if end - 1 > x else 0.0
+            if np.isclose(best[x, y], weights[index] + inner +
+                          best[end + 1, y]):
+                selected[index] = True
+                intervals.append((x + 1, end - 1))
+                intervals.append((end + 1, y))
+                break
+        else:
+            intervals.append((x + 1, y))
+    return selected
+
+
+class MaximumNestedSubset(object):
+    """This removes pseudoknots in process, without RemovePseudoknots. It
+    keeps the subset of pairs with the largest total weight that contains no
+    crossing pairs. Pairs which do not cross any other pair are always kept,
+    so only the knotted pairs go through the dynamic program and structures
+    without pseudoknots are returned right away.
+
+    Pairs may be weighted in several ways. With 'pairs' every pair counts
+    the same, so the largest nested subset is kept. With 'stems' every pair
+    counts as the length of the helix it is part of, which prefers keeping
+    long helices intact. With 'energy' every pair counts as the number of
+    hydrogen bonds it forms, 3 for GC, 2 for AU and 1 for GU or any other
+    pair, as a rough approximation of its stability. A callable may also be
+    given, which is called with the structure, the left and the right
+    positions of the pairs and must return an array of weights.
+    """
+
+    bonds = {'GC': 3, 'CG': 3, 'AU': 2, 'UA': 2, 'GU': 1, 'UG': 1}
+
+    def __init__(self, weight='pairs'):
+        """Create a new MaximumNestedSubset.
+
+        :weight: One of 'pairs', 'stems' or 'energy' or a callable.
+        """
+        if not callable(weight) and weight not in ('pairs', 'stems',
+                                                   'energy'):
+            raise ValueError("Unknown weighting %s" % weight)
+        self.weight = weight
+
+    def weights(self, structure, left, right):
+        """Compute the weight of the given pairs.
+
+        :structure: The structure the pairs come from.
+        :left: The left position of every pair, in increasing order.
+        :right: The right position of every pair.
+        """
+        if callable(self.weight):
+            return self.weight(structure, left, right)
+
+        if self.weight == 'stems':
+            all_left, all_right = arcs(structure._pairs)
+            stacked = np.zeros(len(all_left), dtype=bool)
+            stacked[1:] = (all_left[1:] == all_left[:-1] + 1) & \
+                (all_right[1:] == all_right[:-1] - 1)
+            stems = np.cumsum(~stacked) - 1
+            lengths = np.bincount(stems)
+            return lengths[stems[np.searchsorted(all_left, left)]]
+
+        if self.weight == 'energy':
+            sequence = structure.sequence
+            weights = []
+            for first, second in zip(left, right):
+                pair = ('%s%s' % (sequence[first], sequence[second])).upper()
+                weights.append(self.bonds.get(pair.replace('T', 'U'), 1))
+            return np.array(weights)
+
+        return np.ones(len(left))
+
+    def __call__(self, structure):
+        """Remove the pseudoknots from the given structure.
+
+        :structure: A parsed secondary structure.
+        :returns: A new basic.Parser without pseudoknots.
+        """
+        pairs = list(structure._pairs)
+        left, right, crosses = crossing(pairs)
+        if crosses.any():
+            weights = np.asarray(self.weights(structure, left, right))
+            knotted = np.flatnonzero(crosses)
+            keep = nested_subset(left[knotted], right[knotted],
+                                 weights[knotted])
+            for index in knotted[~keep]:
+                pairs[left[index]] = None
+                pairs[right[index]] = None
+        return BaseParser(pairs, sequence=structure.sequence)
+
+
 class RemovePseudoknots(Base):
     """This is a class which wraps RemovePseudoknots. It is intended to remove
     the pseudoknots of an already parsed structure and return a newly parsed
@@ -17,6 +200,8 @@ class RemovePseudoknots(Base):
     """
     program = "RemovePseudoknots"
 
+    reuse_directory = True
+
     options = {
         'd': is_true,
         'D': is_true,
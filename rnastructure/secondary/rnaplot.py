@@ -2,14 +2,25 @@
 This package provides a parser for the postscript files generated by RNAplot.
 """
 
+from __future__ import with_statement
+
 import os
 import re
 import abc
+import select
+import threading
 import xml.etree.ElementTree as ET
+from StringIO import StringIO
+from subprocess import Popen, PIPE
+
+import numpy as np
 
 import rnastructure.secondary.basic as basic
+import rnastructure.secondary.layout as layout
 import rnastructure.secondary.dot_bracket as db
+import rnastructure.util.cache as cache
 import rnastructure.util.wrapper as wrapper
+import rnastructure.util.workspace as workspace
 
 
 class NoLocationAnnotations(Exception):
@@ -53,8 +64,8 @@ class Parser(basic.Parser):
 
     def __init__(self, stream):
         sequence = None
-        self.locations = []
-        """The locations of coordinates to draw."""
+        self.layout = None
+        """The layout.Layout holding the coordinates to draw."""
         self.box = ()
         """The bounding box of the drawing."""
 
@@ -66,11 +77,26 @@ class Parser(basic.Parser):
         if sequence is None:
             raise NoSequenceAnnotation("Did not find the sequence")
 
-        if not self.locations:
+        if self.layout is None:
             raise NoLocationAnnotations("Did not find drawing coordinates")
 
         super(Parser, self).__init__(pairs, sequence=sequence)
 
+    @property
+    def locations(self):
+        """The locations of coordinates to draw, as a list of (x, y) tuples.
+        The coordinates themselves are stored in self.layout.
+        """
+        if self.layout is None:
+            return []
+        return self.layout.locations()
+
+    @locations.setter
+    def locations(self, locations):
+        self.layout = None
+        if len(locations):
+            self.layout = layout.Layout(locations)
+
     @abc.abstractmethod
     def load_data(self, stream):
         """This method should load all data from the stream. It should return
@@ -139,10 +165,10 @@ class PostScriptParser(Parser):
         return locations
 
     def __pairs__(self, stream):
-        if not self.locations:
+        if self.layout is None:
             raise NoLocationAnnotations("Locations must come before pairs")
 
-        pairs = [None] * len(self.locations)
+        pairs = [None] * len(self.layout)
         for line in stream:
             if self.end_pairs_pattern.match(line):
                 break
@@ -238,6 +264,35 @@ class SVGParser(Parser):
         return ''.join(sequence), locations
 
 
+class BinaryParser(Parser):
+    """This parses drawings stored in the compact binary form produced by
+    BinaryWriter. This is much faster than parsing the files RNAplot produces
+    and is used to store drawings in a LayoutCache.
+    """
+
+    def load_data(self, stream):
+        data = np.load(stream)
+        self.locations = data['coordinates']
+        self.box = tuple(int(value) for value in data['box'])
+        pairs = [None if pair < 0 else int(pair) for pair in data['pairs']]
+        return str(data['sequence']), pairs
+
+
+class BinaryWriter(basic.Writer):
+    """Format a drawing in a compact binary form, the NumPy npz format, which
+    can be read with BinaryParser.
+    """
+
+    def format(self, parser):
+        pairs = [-1 if pair is None else pair for pair in parser._pairs]
+        out = StringIO()
+        np.savez(out, coordinates=parser.layout.coordinates,
+                 pairs=np.array(pairs, dtype=np.int32),
+                 box=np.array(parser.box, dtype=np.int64),
+                 sequence=np.array(''.join(parser.sequence)))
+        return out.getvalue()
+
+
 class RNAplot(wrapper.Wrapper):
     """This is a wrapper around RNAplot so we an generate 2D diagrams from a
     known 2D. This will not fold things, instead it will simply draw them. It
@@ -253,24 +308,24 @@ class RNAplot(wrapper.Wrapper):
     }
     accepted_files = [('rna.ps', PostScriptParser),
                       ('rna.svg', SVGParser)]
+    extensions = {'ps': 'ps', 'svg': 'svg', 'gml': 'gml', 'xrna': 'ss'}
+    parsers = {'ps': PostScriptParser, 'svg': SVGParser}
 
-    def __init__(self):
-        super(RNAplot, self).__init__(None)
+    def __init__(self, directory=None, time=120):
+        """Create a new RNAplot.
 
-    def results(self, process, temp_dir, filename):
-        import glob
-        print(glob.glob(temp_dir + '/*'))
+        :directory: Directory to work in. If not given then a temp dir is used.
+        :time: Maximum time to wait for each drawing.
+        """
+        super(RNAplot, self).__init__(None, directory=directory, time=time)
 
+    def results(self, process, temp_dir, filename):
         for name, klass in self.accepted_files:
             filename = os.path.join(temp_dir, name)
-            print(filename, os.path.isfile(filename))
-
             if os.path.isfile(filename):
                 with open(filename, 'rb') as raw:
                     return klass(raw)
 
-        # os.rmdir(temp_dir)
-
         raise UnimplementedParser("Don't yet have required parser.")
 
     def input_file(self, input_file, raw):
@@ -279,13 +334,147 @@ class RNAplot(wrapper.Wrapper):
     def generate_arguments(self, filename, options):
         return []
 
+    def generate_options(self, filename, options):
+        """RNAplot does not use the generic option names, so we translate
+        ours into the ones it expects.
+        """
+        opts = []
+        if 'layout_type' in options:
+            opts.extend(['-t', str(options['layout_type'])])
+        if 'output_format' in options:
+            opts.append('--output-format=%s' % options['output_format'])
+        return opts
+
     def validate_input(self, raw):
         return isinstance(raw, basic.Parser) and raw.sequence and \
             len(filter(None, raw.sequence)) == len(raw.sequence)
 
-    def stdin(self, temp_dir, raw, options):
+    def record(self, raw, name=None):
+        """Format a single structure as a record RNAplot can read. If a name
+        is given a header is written, which RNAplot uses to name the drawing
+        it creates.
+
+        :raw: The structure to format.
+        :name: The name of the record.
+        """
         data = (raw.sequence, db.Writer().format(raw))
-        return "%s\n%s\n@\n" % data
+        if name is None:
+            return "%s\n%s\n" % data
+        return ">%s\n%s\n%s\n" % ((name,) + data)
+
+    def stdin(self, temp_dir, raw, options):
+        return self.record(raw) + "@\n"
+
+    def batch(self, structures, **kwargs):
+        """Draw many structures using a single RNAplot process. All structures
+        are streamed into RNAplot as named records and each drawing is parsed
+        as soon as RNAplot has moved on to the next one. This accepts the same
+        options as calling this object. The structures and options are
+        validated before this returns, RNAplot is only started once the first
+        drawing is requested.
+
+        :structures: An iterable of parsed secondary structures.
+        :returns: A generator of RNAplot.Parser objects, one per structure and
+        in the same order.
+        """
+        structures = list(structures)
+        for index, structure in enumerate(structures):
+            if not self.validate_input(structure):
+                msg = "Structure %s did not validate" % index
+                raise wrapper.InvalidInputError(msg)
+        self.validate_options(kwargs)
+
+        output_format = kwargs.get('output_format', 'ps')
+        if output_format not in self.parsers:
+            raise UnimplementedParser("Don't yet have required parser.")
+        return self.__drawings__(structures, kwargs, output_format)
+
+    def __drawings__(self, structures, options, output_format):
+        klass = self.parsers[output_format]
+        pattern = 'structure-%s_ss.' + self.extensions[output_format]
+
+        executable = self.executable()
+        pool = None
+        temp_dir = self._base
+        if not temp_dir:
+            pool = self.workspaces or workspace.default_pool()
+            temp_dir = pool.acquire()
+        arguments = [executable]
+        arguments.extend(self.generate_program_arguments(None, options))
+
+        with open(os.devnull, 'wb') as devnull:
+            process = Popen(arguments, stdin=PIPE, stdout=PIPE,
+                            stderr=devnull, cwd=temp_dir, close_fds=True)
+
+        def feed():
+            try:
+                for index, structure in enumerate(structures):
+                    name = 'structure-%s' % index
+                    process.stdin.write(self.record(structure, name=name))
+            except IOError:
+                pass
+            finally:
+                process.stdin.close()
+
+        writer = threading.Thread(target=feed)
+        writer.daemon = True
+        writer.start()
+
+        try:
+            headers = self.__headers__(process)
+            for index in xrange(len(structures)):
+                current = os.path.join(temp_dir, pattern % index)
+                following = 'structure-%s' % (index + 1)
+                self.__wait_for__(process, headers, current, following)
+                with open(current, 'rb') as raw:
+                    drawing = klass(raw)
+                os.remove(current)
+                yield drawing
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            writer.join()
+            if pool:
+                pool.release(temp_dir)
+
+    def __headers__(self, process):
+        """Generate the names of the records RNAplot starts on. RNAplot echoes
+        the header of each record to stdout as it reads it, so this blocks
+        until RNAplot has moved on to another record or has exited.
+        """
+        fd = process.stdout.fileno()
+        pending = ''
+        while True:
+            ready, _, _ = select.select([fd], [], [], self._time)
+            if not ready:
+                raise wrapper.ProgramTimeOutError("Program %s timed out" %
+                                                  self.program)
+            data = os.read(fd, 4096)
+            if not data:
+                return
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.startswith('>'):
+                    yield line[1:].split()[0]
+
+    def __wait_for__(self, process, headers, current, following):
+        """Wait until the drawing in current is complete. A drawing is
+        complete once RNAplot starts on the record named following or has
+        exited.
+        """
+        for name in headers:
+            if name == following:
+                break
+        else:
+            process.wait()
+        if not os.path.isfile(current):
+            msg = "Program %s failed. Status: %s. Message: %s."
+            data = (self.program, process.poll(),
+                    "No drawing %s" % os.path.basename(current))
+            raise wrapper.ProgramFailedError(msg % data)
 
     def __call__(self, secondary, **kwargs):
         """Create a drawing of the given secondary structure.
@@ -297,4 +486,101 @@ class RNAplot(wrapper.Wrapper):
         output format.
         :returns: A RNAplot.Parser object representing the diagram.
         """
-        super(RNAplot, self).__call__(secondary, options=kwargs)
+        return super(RNAplot, self).__call__(secondary, options=kwargs)
+
+
+class LayoutCache(object):
+    """A persistent cache of drawings in front of a plotter, usually a
+    RNAplot. Drawings are stored in binary form under a hash of the plotter
+    and its version, the sequence, the pairs and the drawing options, so
+    repeat requests skip both running RNAplot and parsing its output and
+    upgrading RNAplot never returns old drawings. The cache is size bounded,
+    evicting the least recently used drawings, and can be shared between
+    processes.
+    """
+
+    def __init__(self, plotter=None, directory=None,
+                 max_size=256 * 1024 * 1024):
+        """Create a new LayoutCache.
+
+        :plotter: The object to create drawings with, defaults to RNAplot().
+        :directory: Directory to store drawings in. Defaults to a
+        directory in the users cache.
+        :max_size: The maximum size of the cache in bytes.
+        """
+        self.plotter = plotter or RNAplot()
+        directory = directory or cache.default_directory('layouts')
+        self.cache = cache.DiskCache(directory, max_size=max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, secondary, options):
+        """Compute the cache key of a structure drawn with some options.
+        """
+        options = dict(options)
+        options.setdefault('output_format', 'ps')
+        program = getattr(self.plotter, 'program', None) or \
+            type(self.plotter).__name__
+        version = getattr(self.plotter, 'version', None)
+        version = version() if version else ''
+        sequence = ''.join(char or '?' for char in secondary.sequence)
+        pairs = ','.join('-' if pair is None else str(pair)
+                         for pair in secondary._pairs)
+        options = ','.join('%s=%s' % item for item in sorted(options.items()))
+        return cache.digest(program, version, sequence, pairs, options)
+
+    def __load__(self, key):
+        data = self.cache.get(key)
+        if data is not None:
+            try:
+                drawing = BinaryParser(StringIO(data))
+                self.hits += 1
+                return drawing
+            except Exception:
+                self.cache.discard(key)
+        return None
+
+    def __store__(self, key, drawing):
+        self.misses += 1
+        self.cache.put(key, BinaryWriter().format(drawing))
+
+    def batch(self, structures, **kwargs):
+        """Draw many structures, drawing only those which are not already
+        cached with a single call to the batch method of the plotter.
+
+        :structures: An iterable of parsed secondary structures.
+        :returns: A generator of drawings in the same order as the structures.
+        """
+        structures = list(structures)
+        keys = [self.key(structure, kwargs) for structure in structures]
+        cached = [key in self.cache for key in keys]
+        missing = [s for s, hit in zip(structures, cached) if not hit]
+        drawn = iter([])
+        if missing:
+            drawn = iter(self.plotter.batch(missing, **kwargs))
+
+        for structure, key, hit in zip(structures, keys, cached):
+            drawing = None
+            if hit:
+                drawing = self.__load__(key)
+                if drawing is None:
+                    drawing = self.plotter(structure, **kwargs)
+                    self.__store__(key, drawing)
+            else:
+                drawing = next(drawn)
+                self.__store__(key, drawing)
+            yield drawing
+
+    def __call__(self, secondary, **kwargs):
+        """Get a drawing of the given secondary structure, from the cache if
+        possible. This accepts the same options as the plotter.
+
+        :secondary: A parsed secondary structure.
+        :returns: A Parser object representing the diagram.
+        """
+        key = self.key(secondary, kwargs)
+        drawing = self.__load__(key)
+        if drawing is None:
+            drawing = self.plotter(secondary, **kwargs)
+            self.__store__(key, drawing)
+        return drawing
@@ -0,0 +1,377 @@
+"""This module runs a wrapper over very many inputs in a way that survives
+crashes. Every finished input is recorded in an append-only journal along
+with a hash of the input, and its result is appended to one of several
+sharded result files. Running the same batch again skips every input the
+journal records as done with the same hash, so a crashed run resumes where it
+stopped and an input that changed is run again.
+
+The journal has one line per finished input with the escaped name, the input
+hash, the status and the shard its result is in, separated by tabs. Each shard
+is a file of consecutive pickled (name, hash, result) tuples. A result is
+always written to its shard before its journal line, so the journal never
+refers to a result which was lost.
+"""
+
+from __future__ import with_statement
+
+import os
+import copy
+import Queue
+import shutil
+import cPickle
+import tempfile
+import threading
+from collections import deque
+
+from rnastructure.util import metrics
+from rnastructure.util.cache import digest
+from rnastructure.util.cache import normalize
+
+
+def input_hash(wrapper, raw, options=None):
+    """Compute the hash of running a wrapper on an input.
+
+    :wrapper: The Wrapper to run.
+    :raw: The raw input.
+    :options: The options hash.
+    """
+    options = ','.join('%s=%r' % item for item in sorted((options or {})
+                                                         .items()))
+    return digest(type(wrapper).__name__, wrapper.program or '',
+                  normalize(raw), options)
+
+
+class Progress(object):
+    """The progress of a running batch.
+    """
+
+    def __init__(self, skipped=0):
+        self.started = metrics.monotonic()
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self._recent = deque()
+
+    def add(self, failed):
+        now = metrics.monotonic()
+        if failed:
+            self.failed += 1
+        else:
+            self.done += 1
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - 60:
+            self._recent.popleft()
+
+    def elapsed(self):
+        """Seconds since the batch started."""
+        return metrics.monotonic() - self.started
+
+    def rate(self):
+        """Inputs finished per second since the batch started."""
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return (self.done + self.failed) / elapsed
+
+    def recent_rate(self):
+        """Inputs finished per second over the last minute."""
+        window = min(self.elapsed(), 60)
+        if not window:
+            return 0.0
+        return len(self._recent) / window
+
+    def __str__(self):
+        return '%s done, %s failed, %s skipped, %.1f/s (%.1f/s recent)' % (
+            self.done, self.failed, self.skipped, self.rate(),
+            self.recent_rate())
+
+
+class Batch(object):
+    """Runs a wrapper over named inputs, recording the results in a
+    directory. Results which are not picklable can not be stored, so wrappers
+    whose results refer to files must materialize them when pickled.
+    """
+
+    journal_name = 'journal'
+
+    shard_pattern = 'shard-%05d.pickle'
+
+    def __init__(self, wrapper, directory, options=None, workers=4,
+                 shard_size=1000, sync_every=100, retry_failed=False):
+        """Create a new Batch.
+
+        :wrapper: The Wrapper to run.
+        :directory: The directory to store the journal and shards in. It is
+        created if needed.
+        :options: Options to run every input with.
+        :workers: The number of inputs to run at once.
+        :shard_size: The number of results to store in each shard.
+        :sync_every: How many results to write between forcing the journal
+        and shards to disk.
+        :retry_failed: If true inputs which failed in an earlier run are run
+        again.
+        """
+        self.wrapper = wrapper
+        self.directory = directory
+        self.options = options
+        self.workers = workers
+        self.shard_size = shard_size
+        self.sync_every = sync_every
+        self.retry_failed = retry_failed
+        self.progress = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def journal(self):
+        return os.path.join(self.directory, self.journal_name)
+
+    def entries(self):
+        """Read the journal.
+
+        :returns: A dict from input name to a (hash, status, shard) tuple for
+        the last time the input was recorded.
+        """
+        entries = {}
+        if not os.path.exists(self.journal):
+            return entries
+        with open(self.journal, 'rb') as raw:
+            for line in raw:
+                # A line without a newline was cut short by a crash
+                if not line.endswith('\n'):
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 4:
+                    continue
+                name, key, status, shard = parts
+                entries[name.decode('string_escape')] = (key, status,
+                                                         int(shard))
+        return entries
+
+    def shards(self):
+        """Get the numbers of all shards, in order."""
+        prefix, suffix = self.shard_pattern.split('%05d')
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                number = name[len(prefix):len(name) - len(suffix)]
+                if number.isdigit():
+                    numbers.append(int(number))
+        return sorted(numbers)
+
+    def results(self):
+        """Iterate over the stored results of all inputs the journal records
+        as done.
+
+        :returns: A generator of (name, result) tuples.
+        """
+        entries = self.entries()
+        seen = set()
+        for number in self.shards():
+            filename = os.path.join(self.directory,
+                                    self.shard_pattern % number)
+            with open(filename, 'rb') as raw:
+                while True:
+                    try:
+                        name, key, result = cPickle.load(raw)
+                    except Exception:
+                        # The last result may have been cut short
+                        break
+                    entry = entries.get(name)
+                    if entry is None or entry[:2] != (key, 'ok') or \
+                            entry[2] != number or name in seen:
+                        continue
+                    seen.add(name)
+                    yield name, result
+
+    def failures(self):
+        """Get the names of all inputs which failed."""
+        return sorted(name for name, entry in self.entries().iteritems()
+                      if entry[1] != 'ok')
+
+    def __pending__(self, inputs, entries, progress):
+        for name, raw in inputs:
+            key = input_hash(self.wrapper, raw, self.options)
+            entry = entries.get(name)
+            if entry is not None and entry[0] == key and \
+                    (entry[1] == 'ok' or not self.retry_failed):
+                progress.skipped += 1
+                continue
+            yield name, key, raw
+
+    def __work__(self, tasks, finished):
+        wrapper = self.wrapper
+        root = None
+        if getattr(wrapper, '_base', None):
+            root = tempfile.mkdtemp(dir=wrapper._base)
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                name, key, raw = task
+                worker = wrapper
+                if root:
+                    worker = copy.copy(wrapper)
+                    worker._base = tempfile.mkdtemp(dir=root)
+                try:
+                    if self.options is None:
+                        result = worker(raw)
+                    else:
+                        result = worker(raw, self.options)
+                except Exception, err:
+                    finished.put((name, key, 'failed', err))
+                else:
+                    # Results may still read from the directory of the call,
+                    # so they are pickled before it is removed.
+                    try:
+                        data = cPickle.dumps((name, key, result),
+                                             cPickle.HIGHEST_PROTOCOL)
+                    except Exception:
+                        finished.put((name, key, 'unpicklable', None))
+                    else:
+                        finished.put((name, key, 'ok', data))
+                if root:
+                    shutil.rmtree(worker._base, ignore_errors=True)
+        finally:
+            if root:
+                shutil.rmtree(root, ignore_errors=True)
+
+    def run(self, inputs, report=None, interval=10):
+        """Run the wrapper over all inputs which are not already done. Inputs
+        are read from the iterable as workers become free, so it may be a
+        generator over more inputs than fit in memory.
+
+        :inputs: An iterable of (name, raw) tuples. Names must be unique
+        strings.
+        :report: A callable which is given the Progress every interval
+        seconds and once the batch is done.
+        :interval: Seconds between reports.
+        :returns: The Progress of the run.
+        """
+        entries = self.entries()
+        progress = Progress()
+        self.progress = progress
+        tasks = Queue.Queue(maxsize=self.workers * 2)
+        finished = Queue.Queue()
+        threads = []
+        for _ in xrange(self.workers):
+            thread = threading.Thread(target=self.__work__,
+                                      args=(tasks, finished))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        state = {'submitted': 0, 'fed': False, 'error': None}
+
+        def feed():
+            try:
+                for task in self.__pending__(inputs, entries, progress):
+                    tasks.put(task)
+                    state['submitted'] += 1
+            except Exception, err:
+                state['error'] = err
+            finally:
+                state['fed'] = True
+                for _ in threads:
+                    tasks.put(None)
+
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        writer = _Writer(self)
+        received = 0
+        last_report = metrics.monotonic()
+        try:
+            while not state['fed'] or received < state['submitted']:
+                try:
+                    name, key, status, data = finished.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+                else:
+                    received += 1
+                    writer.write(name, key, status, data)
+                    progress.add(status != 'ok')
+
+                if report and metrics.monotonic() - last_report >= interval:
+                    last_report = metrics.monotonic()
+                    report(progress)
+        finally:
+            writer.close()
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        if state['error'] is not None:
+            raise state['error']
+        if report:
+            report(progress)
+        return progress
+
+
+class _Writer(object):
+    """Appends results to shards and records them in the journal."""
+
+    def __init__(self, batch):
+        self.batch = batch
+        shards = batch.shards()
+        # Always start a new shard, as the last one may end in a partial
+        # result.
+        self.number = shards[-1] + 1 if shards else 0
+        self.count = 0
+        self.unsynced = 0
+        self.shard = None
+        self.journal = open(batch.journal, 'ab')
+        # End a line cut short by a crash so it is not joined with the next
+        if os.path.getsize(batch.journal):
+            with open(batch.journal, 'rb') as raw:
+                raw.seek(-1, os.SEEK_END)
+                if raw.read(1) != '\n':
+                    self.journal.write('\n')
+
+    def __shard__(self):
+        if self.shard is not None and self.count < self.batch.shard_size:
+            return self.shard
+        if self.shard is not None:
+            self.__sync__(self.shard)
+            self.shard.close()
+            self.number += 1
+        filename = os.path.join(self.batch.directory,
+                                self.batch.shard_pattern % self.number)
+        self.shard = open(filename, 'ab')
+        self.count = 0
+        return self.shard
+
+    def __sync__(self, stream):
+        stream.flush()
+        os.fsync(stream.fileno())
+
+    def write(self, name, key, status, data):
+        shard = None
+        if status == 'ok':
+            shard = self.__shard__()
+            shard.write(data)
+            shard.flush()
+            self.count += 1
+
+        line = '\t'.join([name.encode('string_escape'), key, status,
+                          str(self.number if shard else -1)])
+        self.journal.write(line + '\n')
+        self.journal.flush()
+
+        self.unsynced += 1
+        if self.unsynced >= self.batch.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self.shard is not None:
+            self.__sync__(self.shard)
+        self.__sync__(self.journal)
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        if self.shard is not None:
+            self.shard.close()
+        self.journal.close()
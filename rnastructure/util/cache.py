@@ -0,0 +1,368 @@
+"""This module provides a simple persistent cache of binary data. Entries are
+stored as individual files named by a hash of their contents' key, which makes
+the cache safe to share between processes. Writes go to a temporary file that
+is renamed into place, so readers never see partial entries, and eviction is
+done under a file lock. When the cache grows beyond its maximum size the least
+recently used entries are removed.
+
+ResultCache builds on this to cache the results of any Wrapper, keeping
+recently used results in memory as well, in an LRU.
+"""
+
+from __future__ import with_statement
+
+import os
+import errno
+import fcntl
+import hashlib
+import cPickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def digest(*parts):
+    """Compute a key from some number of strings.
+
+    :parts: The strings to hash.
+    :returns: A hex string that can be used as a key.
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        sha.update(str(len(part)))
+        sha.update(':')
+        sha.update(part)
+    return sha.hexdigest()
+
+
+def default_directory(name):
+    """Get the default directory for a named cache. This respects
+    XDG_CACHE_HOME if it is set.
+    """
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'rnastructure', name)
+
+
+class DiskCache(object):
+    """A size bounded cache of binary data on disk.
+    """
+
+    suffix = '.entry'
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """Create a new DiskCache.
+
+        :directory: Directory to store entries in. It is created if needed.
+        :max_size: The maximum total size of all entries in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._written = None
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def path(self, key):
+        """Get the filename an entry with the given key is stored at.
+        """
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        """Get the data stored under some key. Reading an entry marks it as
+        recently used.
+
+        :key: The key to look up.
+        :returns: The stored data, or None if there is no such entry.
+        """
+        filename = self.path(key)
+        try:
+            with open(filename, 'rb') as raw:
+                data = raw.read()
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, data):
+        """Store some data under the given key, replacing any existing entry.
+
+        :key: The key to store under.
+        :data: The data to store.
+        """
+        filename = self.path(key)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as out:
+                out.write(data)
+            os.rename(temp, filename)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        # Scanning the whole cache is expensive, so only do it once enough
+        # new data may have pushed us over the limit.
+        if self._written is None or \
+                self._written + len(data) > self.max_size / 10:
+            self._written = 0
+            self.evict()
+        else:
+            self._written += len(data)
+
+    def discard(self, key):
+        """Remove the entry with the given key if it exists.
+        """
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """Get a list of (mtime, size, filename) for all entries.
+        """
+        found = []
+        for base, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(self.suffix):
+                    continue
+                filename = os.path.join(base, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, filename))
+        return found
+
+    def size(self):
+        """Get the total size of all entries in bytes.
+        """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is no larger
+        than its maximum size.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = sorted(self.entries())
+                total = sum(entry[1] for entry in entries)
+                for _, size, filename in entries:
+                    if total <= self.max_size:
+                        break
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                    total -= size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def clear(self):
+        """Remove all entries.
+        """
+        for _, _, filename in self.entries():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+
+def normalize(raw):
+    """Turn the input of a program into a string for use in a key. Strings
+    have surrounding whitespace removed, sequences of inputs are normalized
+    item by item and parsed structures are represented by their sequence and
+    pairs. Anything else is represented by its repr.
+
+    :raw: The input to normalize.
+    """
+    if isinstance(raw, basestring):
+        return raw.strip()
+    if isinstance(raw, (list, tuple)):
+        return '[%s]' % '\n'.join(normalize(item) for item in raw)
+    if hasattr(raw, '_pairs'):
+        sequence = ''.join(char or '?' for char in (raw.sequence or ''))
+        pairs = ','.join('-' if pair is None else str(pair)
+                         for pair in raw._pairs)
+        return '%s|%s' % (sequence, pairs)
+    return repr(raw)
+
+
+class LRU(object):
+    """A mapping of bounded size which forgets the least recently used
+    entries first. It is safe to use from several threads.
+    """
+
+    def __init__(self, size):
+        """Create a new LRU.
+
+        :size: The maximum number of entries to keep.
+        """
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Look up an entry, marking it as recently used.
+
+        :key: The key to look up.
+        :default: The value to return if there is no such entry.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        """Store an entry, forgetting the least recently used entries if
+        there are too many.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.size <= 0:
+                return
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forget an entry if it exists."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Forget all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class ResultCache(object):
+    """A cache of the results of wrapped programs. Results are pickled and
+    stored in a DiskCache, with the most recently used ones also kept in
+    memory. Entries are keyed by the program, its version, the normalized
+    input and the options, so upgrading a program never returns old results.
+    A cache is used by setting it as the cache attribute of a Wrapper.
+    """
+
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024,
+                 memory_size=256):
+        """Create a new ResultCache.
+
+        :directory: Directory to store results in. Defaults to a directory in
+        the users cache.
+        :max_size: The maximum size of the results on disk in bytes.
+        :memory_size: The number of results to keep in memory.
+        """
+        directory = directory or default_directory('results')
+        self.disk = DiskCache(directory, max_size=max_size)
+        self.memory_size = memory_size
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._memory = LRU(memory_size)
+        self._lock = threading.Lock()
+
+    def key(self, wrapper, raw, options):
+        """Compute the key of running a wrapper on some input.
+
+        :wrapper: The Wrapper to run.
+        :raw: The raw input.
+        :options: The options hash.
+        """
+        options = ','.join('%s=%r' % item for item in sorted(options.items()))
+        return digest(type(wrapper).__name__, wrapper.program or '',
+                      wrapper.version(), normalize(raw), options)
+
+    def get(self, key):
+        """Look up a result.
+
+        :key: The key to look up.
+        :returns: A tuple of True and the result if it was found, otherwise
+        False and None.
+        """
+        data = self._memory.get(key)
+        if data is not None:
+            with self._lock:
+                self.memory_hits += 1
+        else:
+            data = self.disk.get(key)
+            if data is not None:
+                self._memory.put(key, data)
+                with self._lock:
+                    self.disk_hits += 1
+        if data is not None:
+            try:
+                return True, cPickle.loads(data)
+            except Exception:
+                self.discard(key)
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, result):
+        """Store a result. Results which can not be pickled are not stored.
+
+        :key: The key to store under.
+        :result: The result to store.
+        :returns: True if the result was stored.
+        """
+        try:
+            data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+        self.disk.put(key, data)
+        self._memory.put(key, data)
+        with self._lock:
+            self.stores += 1
+        return True
+
+    def discard(self, key):
+        """Remove a result from both memory and disk."""
+        self._memory.discard(key)
+        self.disk.discard(key)
+
+    def stats(self):
+        """Get the hit and miss counts of this cache.
+
+        :returns: A dict of the counts and the hit ratio.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'hit_ratio': float(hits) / total if total else 0.0,
+            }
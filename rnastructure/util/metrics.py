@@ -0,0 +1,244 @@
+"""This module records how long each part of running an external program
+takes. Every call made through a Wrapper produces a CallRecord with the time
+spent validating the input, writing the input file, starting the process,
+waiting for the program and parsing its results, along with the number of
+bytes written and read and how the call ended. Records are passed to every
+registered hook. The Stats hook, which is registered by default, aggregates
+them per program.
+"""
+
+from __future__ import with_statement
+
+import os
+import time
+import ctypes
+import ctypes.util
+import threading
+from collections import deque
+
+
+def _clock():
+    """Find a monotonic clock, falling back to the wall clock if there is
+    none.
+    """
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        name = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+        library = ctypes.CDLL(name, use_errno=True)
+        clock_gettime = library.clock_gettime
+    except (OSError, AttributeError, TypeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    monotonic_id = 1  # CLOCK_MONOTONIC on Linux
+    if os.uname()[0] == 'Darwin':
+        monotonic_id = 6
+
+    def clock():
+        spec = timespec()
+        if clock_gettime(monotonic_id, ctypes.byref(spec)) != 0:
+            return time.time()
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+
+    return clock
+
+monotonic = _clock()
+"""Get the time in seconds from a clock that never goes backwards."""
+
+
+PHASES = ('validate', 'input', 'spawn', 'run', 'results')
+"""The phases of a call, in the order they happen."""
+
+
+class Phase(object):
+    """Times a single phase of a call, used as a context manager."""
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.record.begin(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.record.end(self.name)
+
+
+class CallRecord(object):
+    """The measurements of a single call to a program.
+    """
+
+    def __init__(self, program):
+        """Create a new CallRecord.
+
+        :program: The name of the program being called.
+        """
+        self.program = program
+        self.phases = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.returncode = None
+        self.status = None
+        self.started = time.time()
+        self._begun = {}
+
+    def phase(self, name):
+        """Time a phase with a with statement."""
+        return Phase(self, name)
+
+    def begin(self, name):
+        """Mark the start of a phase."""
+        self._begun[name] = monotonic()
+
+    def end(self, name):
+        """Mark the end of a phase. Ending a phase that has not begun or has
+        already ended does nothing.
+        """
+        start = self._begun.pop(name, None)
+        if start is not None:
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                monotonic() - start
+
+    def total(self):
+        """The time spent in all phases."""
+        return sum(self.phases.values())
+
+    def finish(self, status, returncode=None):
+        """Mark the call as finished and pass this record to all hooks. Only
+        the first call of this has any effect.
+
+        :status: How the call ended, one of ok, failed, timeout, cancelled,
+        invalid or error.
+        :returncode: The exit status of the program, if it was run.
+        """
+        if self.status is not None:
+            return
+        for name in self._begun.keys():
+            self.end(name)
+        self.status = status
+        self.returncode = returncode
+        emit(self)
+
+    def __repr__(self):
+        phases = ', '.join('%s=%.4f' % (name, self.phases[name])
+                           for name in PHASES if name in self.phases)
+        return '<CallRecord %s %s %s>' % (self.program, self.status, phases)
+
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Register a callable that is given every finished CallRecord."""
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Unregister a hook added with add_hook."""
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def emit(record):
+    """Pass a record to all hooks. Errors in hooks are ignored so they can
+    never break a call.
+    """
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(record)
+        except Exception:
+            pass
+
+
+def percentile(values, fraction):
+    """Get a percentile of some values using the nearest rank.
+
+    :values: A sorted list of values.
+    :fraction: The percentile as a number between 0 and 1.
+    """
+    if not values:
+        return None
+    rank = int(round(fraction * (len(values) - 1)))
+    return values[rank]
+
+
+class Stats(object):
+    """A hook which aggregates call records per program. Only the most recent
+    samples records of each program are used for the percentiles.
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self._programs = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            program = self._programs.get(record.program)
+            if program is None:
+                program = {'count': 0, 'statuses': {}, 'bytes_in': 0,
+                           'bytes_out': 0, 'recent': deque()}
+                self._programs[record.program] = program
+            program['count'] += 1
+            statuses = program['statuses']
+            statuses[record.status] = statuses.get(record.status, 0) + 1
+            program['bytes_in'] += record.bytes_in
+            program['bytes_out'] += record.bytes_out
+            recent = program['recent']
+            recent.append(dict(record.phases, total=record.total()))
+            if len(recent) > self.samples:
+                recent.popleft()
+
+    def snapshot(self):
+        """Get the aggregated statistics.
+
+        :returns: A dict from program name to a dict with the number of calls,
+        the number of calls with each status, the total bytes written and read
+        and for each phase, and the total, the mean, p50, p95 and p99 times.
+        """
+        with self._lock:
+            programs = dict((name, dict(data, recent=list(data['recent']),
+                                        statuses=dict(data['statuses'])))
+                            for name, data in self._programs.iteritems())
+
+        snapshot = {}
+        for name, data in programs.iteritems():
+            timings = {}
+            for phase in PHASES + ('total',):
+                values = sorted(sample[phase] for sample in data['recent']
+                                if phase in sample)
+                if not values:
+                    continue
+                timings[phase] = {
+                    'mean': sum(values) / len(values),
+                    'p50': percentile(values, 0.50),
+                    'p95': percentile(values, 0.95),
+                    'p99': percentile(values, 0.99),
+                }
+            snapshot[name] = {
+                'count': data['count'],
+                'statuses': data['statuses'],
+                'bytes_in': data['bytes_in'],
+                'bytes_out': data['bytes_out'],
+                'timings': timings,
+            }
+        return snapshot
+
+    def reset(self):
+        """Forget all records."""
+        with self._lock:
+            self._programs = {}
+
+
+stats = Stats()
+"""The Stats of all calls made in this process."""
+
+add_hook(stats)
@@ -0,0 +1,191 @@
+"""This module finds the external programs that wrappers run. Each program is
+looked up on the PATH once, instead of being searched for every time it is
+run, and a missing program is reported with a clear error before any input is
+written. The version each program reports is probed once and stored on disk,
+keyed by the path and modification time of the program, so a version is only
+probed again after the program is replaced.
+"""
+
+from __future__ import with_statement
+
+import os
+import time
+import select
+import threading
+from subprocess import Popen, PIPE
+
+from rnastructure.util.cache import digest
+from rnastructure.util.cache import DiskCache
+from rnastructure.util.cache import default_directory
+
+
+class ProgramNotFoundError(OSError):
+    """This indicates that a program could not be found on the PATH or is not
+    executable.
+    """
+    pass
+
+
+def which(name, path=None):
+    """Find an executable on the PATH.
+
+    :name: The name of the program. Names with a directory in them are
+    checked as is.
+    :path: The search path to use, the PATH environment variable if not given.
+    :returns: The absolute path to the program or None if it was not found.
+    """
+    if os.path.dirname(name):
+        candidates = [name]
+    else:
+        if path is None:
+            path = os.environ.get('PATH', os.defpath)
+        candidates = [os.path.join(part or os.curdir, name)
+                      for part in path.split(os.pathsep)]
+
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.abspath(candidate)
+    return None
+
+
+class Registry(object):
+    """Resolves program names to paths and probes their versions. Lookups are
+    remembered per PATH, so changing the PATH finds programs again.
+    """
+
+    def __init__(self, directory=None, timeout=10):
+        """Create a new Registry.
+
+        :directory: Directory to store versions in. Defaults to a directory
+        in the users cache.
+        :timeout: Seconds to wait for a program to report its version.
+        """
+        self.directory = directory
+        self.timeout = timeout
+        self._paths = {}
+        self._versions = {}
+        self._disk = None
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        """Find a program.
+
+        :name: The name of the program.
+        :returns: The absolute path to the program.
+        :raises: ProgramNotFoundError if the program can not be found.
+        """
+        key = (name, os.environ.get('PATH', os.defpath))
+        with self._lock:
+            path = self._paths.get(key)
+        if path is not None and os.access(path, os.X_OK):
+            return path
+
+        path = which(name, key[1])
+        if path is None:
+            raise ProgramNotFoundError("Could not find program %s on the "
+                                       "PATH" % name)
+        with self._lock:
+            self._paths[key] = path
+        return path
+
+    def __disk__(self):
+        with self._lock:
+            if self._disk is None:
+                directory = self.directory or default_directory('programs')
+                try:
+                    self._disk = DiskCache(directory, max_size=1024 * 1024)
+                except OSError:
+                    self._disk = False
+            return self._disk
+
+    def version(self, name, arguments=('--version',)):
+        """Get the version a program reports.
+
+        :name: The name of the program.
+        :arguments: Arguments that make the program print its version.
+        :returns: The first line the program prints when given the arguments,
+        or 'unknown' if it printed nothing or could not be run.
+        :raises: ProgramNotFoundError if the program can not be found.
+        """
+        path = self.resolve(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise ProgramNotFoundError("Could not find program %s" % path)
+        key = digest(path, repr(stat.st_mtime), str(stat.st_size),
+                     *arguments)
+
+        with self._lock:
+            version = self._versions.get(key)
+        if version is not None:
+            return version
+
+        disk = self.__disk__()
+        if disk:
+            version = disk.get(key)
+        if version is None:
+            version = self.probe(path, arguments)
+            if disk:
+                try:
+                    disk.put(key, version)
+                except (IOError, OSError):
+                    pass
+
+        with self._lock:
+            self._versions[key] = version
+        return version
+
+    def probe(self, path, arguments):
+        """Run a program to find its version.
+
+        :path: The path to the program.
+        :arguments: Arguments that make the program print its version.
+        :returns: The first line the program prints, or 'unknown' if it
+        printed nothing, could not be run or printed nothing before the
+        timeout. A program still running at the timeout is killed.
+        """
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                process = Popen([path] + list(arguments), stdin=devnull,
+                                stdout=PIPE, stderr=PIPE, close_fds=True)
+        except OSError:
+            return 'unknown'
+
+        fds = (process.stdout.fileno(), process.stderr.fileno())
+        output = dict((fd, []) for fd in fds)
+        reading = list(fds)
+        deadline = time.time() + self.timeout
+        try:
+            while reading:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                readable, _, _ = select.select(reading, [], [], wait)
+                for fd in readable:
+                    data = os.read(fd, 4096)
+                    if data:
+                        output[fd].append(data)
+                    else:
+                        reading.remove(fd)
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+        out, err = [''.join(output[fd]) for fd in fds]
+        lines = (out or err).strip().splitlines()
+        if not lines:
+            return 'unknown'
+        return lines[0].strip()
+
+    def forget(self):
+        """Forget all resolved paths and versions kept in memory."""
+        with self._lock:
+            self._paths = {}
+            self._versions = {}
+
+
+registry = Registry()
+"""The Registry used by all wrappers."""
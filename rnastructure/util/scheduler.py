@@ -0,0 +1,302 @@
+"""This module schedules calls to external programs on a shared machine. Jobs
+wait in a priority queue and are run by a fixed number of threads, subject to
+a cap on how many of each program may run at once and to a separate, smaller,
+number of slots for large inputs so they can not starve small ones. Every
+program is run with CPU and memory limits. The time jobs spend waiting is
+reported separately from the time they spend running.
+"""
+
+from __future__ import with_statement
+
+import copy
+import heapq
+import collections
+import resource
+import threading
+
+from rnastructure.util.metrics import monotonic
+from rnastructure.util.metrics import percentile
+from rnastructure.util.wrapper import InvalidInputError
+
+
+class SchedulerClosedError(Exception):
+    """This indicates that a job was submitted to a scheduler which has been
+    shut down.
+    """
+    pass
+
+
+def input_length(raw):
+    """Get the length used for admission control. This is the length of a
+    sequence or structure, or of the longest one in a list of them.
+    """
+    if isinstance(raw, (list, tuple)):
+        return max([input_length(item) for item in raw] or [0])
+    try:
+        return len(raw)
+    except TypeError:
+        return 0
+
+
+class Job(object):
+    """A single call waiting for, or done by, a Scheduler.
+    """
+
+    def __init__(self, wrapper, raw, options, priority, length):
+        self.wrapper = wrapper
+        self.raw = raw
+        self.options = options
+        self.priority = priority
+        self.length = length
+        self.program = wrapper.program
+        self.submitted = monotonic()
+        self.started = None
+        self.finished = None
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+
+    @property
+    def queue_wait(self):
+        """Seconds the job waited before it started, so far."""
+        end = self.started if self.started is not None else monotonic()
+        return end - self.submitted
+
+    @property
+    def run_time(self):
+        """Seconds the job has run, or None if it has not started."""
+        if self.started is None:
+            return None
+        end = self.finished if self.finished is not None else monotonic()
+        return end - self.started
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job and get its result, raising the error the call
+        raised if it failed.
+
+        :timeout: The longest time to wait, forever if None.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Job is not done")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def __finish__(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self.finished = monotonic()
+        self._done.set()
+
+
+class Scheduler(object):
+    """Runs jobs from a priority queue on a fixed number of threads. Jobs with
+    a higher priority run first and jobs of equal priority run in the order
+    they were submitted. A job is skipped over, not blocked on, while its
+    program is at its cap or while all large slots are taken.
+
+    Jobs are kept in one heap for each program and size, large or not, as
+    every job in such a heap is blocked or allowed alike. Taking a job only
+    compares the heads of the heaps which may run and pops from one of them,
+    so it never walks over the blocked jobs.
+    """
+
+    def __init__(self, workers=4, caps=None, cpu=None, memory=None,
+                 large=1000, large_slots=1):
+        """Create a new Scheduler.
+
+        :workers: The number of jobs to run at once.
+        :caps: A dict from program name to the most calls of it to run at
+        once.
+        :cpu: Seconds of CPU time each program may use.
+        :memory: Bytes of address space each program may use.
+        :large: The input length from which a job is considered large.
+        :large_slots: The number of large jobs to run at once.
+        """
+        self.caps = dict(caps or {})
+        self.large = large
+        self.large_slots = large_slots
+        self.rlimits = {}
+        if cpu is not None:
+            self.rlimits[resource.RLIMIT_CPU] = (cpu, cpu + 1)
+        if memory is not None:
+            self.rlimits[resource.RLIMIT_AS] = memory
+
+        self._queues = {}
+        self._pending = 0
+        self._count = 0
+        self._running = {}
+        self._large_running = 0
+        self._closed = False
+        self._finished = collections.deque(maxlen=1000)
+        self._lock = threading.Condition()
+        self._threads = []
+        for _ in xrange(workers):
+            thread = threading.Thread(target=self.__work__)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, wrapper, raw, options=None, priority=0):
+        """Add a job. Inputs longer than the wrapper allows, as given by its
+        _length, are rejected right away instead of waiting in the queue.
+
+        :wrapper: The Wrapper to run the job with.
+        :raw: The raw input.
+        :options: The options hash.
+        :priority: Higher priority jobs are run first.
+        :returns: The Job.
+        """
+        length = input_length(raw)
+        limit = getattr(wrapper, '_length', None)
+        if limit is not None and length > limit:
+            msg = "Given input too long. Given: %s, Max: %s"
+            raise InvalidInputError(msg % (length, limit))
+
+        job = Job(wrapper, raw, options, priority, length)
+        with self._lock:
+            if self._closed:
+                raise SchedulerClosedError("Scheduler has been shut down")
+            key = (job.program, length >= self.large)
+            heapq.heappush(self._queues.setdefault(key, []),
+                           (-priority, self._count, job))
+            self._pending += 1
+            self._count += 1
+            self._lock.notify()
+        return job
+
+    def map(self, wrapper, inputs, options=None, priority=0):
+        """Submit many inputs and wait for all of them.
+
+        :returns: A list of the results or raised exceptions for each input, in
+        the same order as the input.
+        """
+        jobs = []
+        for raw in inputs:
+            try:
+                jobs.append(self.submit(wrapper, raw, options, priority))
+            except InvalidInputError, err:
+                jobs.append(err)
+
+        results = []
+        for job in jobs:
+            if isinstance(job, Exception):
+                results.append(job)
+                continue
+            try:
+                results.append(job.result())
+            except Exception, err:
+                results.append(err)
+        return results
+
+    def __allowed__(self, program, large):
+        cap = self.caps.get(program)
+        if cap is not None and self._running.get(program, 0) >= cap:
+            return False
+        if large and self._large_running >= self.large_slots:
+            return False
+        return True
+
+    def __take__(self):
+        """Take the best job that may run now, or None if there is none."""
+        best = None
+        for key, queue in self._queues.iteritems():
+            if not self.__allowed__(*key):
+                continue
+            if best is None or queue[0] < self._queues[best][0]:
+                best = key
+        if best is None:
+            return None
+        queue = self._queues[best]
+        job = heapq.heappop(queue)[2]
+        if not queue:
+            del self._queues[best]
+        self._pending -= 1
+        return job
+
+    def __work__(self):
+        while True:
+            with self._lock:
+                job = self.__take__()
+                while job is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._lock.wait()
+                    job = self.__take__()
+                self._running[job.program] = \
+                    self._running.get(job.program, 0) + 1
+                if job.length >= self.large:
+                    self._large_running += 1
+                job.started = monotonic()
+
+            self.__run__(job)
+
+            with self._lock:
+                self._running[job.program] -= 1
+                if job.length >= self.large:
+                    self._large_running -= 1
+                self._finished.append(job)
+                self._lock.notify_all()
+
+    def __run__(self, job):
+        wrapper = job.wrapper
+        if self.rlimits:
+            wrapper = copy.copy(wrapper)
+            limits = dict(getattr(wrapper, 'rlimits', None) or {})
+            limits.update(self.rlimits)
+            wrapper.rlimits = limits
+        try:
+            if job.options is None:
+                value = wrapper(job.raw)
+            else:
+                value = wrapper(job.raw, job.options)
+        except Exception, err:
+            job.__finish__(error=err)
+        else:
+            job.__finish__(value=value)
+
+    def pending(self):
+        """The number of jobs waiting to start."""
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        """Summarize the queue wait and run times of recently finished jobs.
+
+        :returns: A dict from program name to the count of jobs and the mean,
+        p50 and p95 of both queue_wait and run_time.
+        """
+        with self._lock:
+            finished = list(self._finished)
+
+        grouped = {}
+        for job in finished:
+            grouped.setdefault(job.program, []).append(job)
+
+        summary = {}
+        for program, jobs in grouped.iteritems():
+            data = {'count': len(jobs)}
+            for name in ('queue_wait', 'run_time'):
+                values = sorted(getattr(job, name) for job in jobs)
+                data[name] = {
+                    'mean': sum(values) / len(values),
+                    'p50': percentile(values, 0.50),
+                    'p95': percentile(values, 0.95),
+                }
+            summary[program] = data
+        return summary
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs. Jobs already queued are still run.
+
+        :wait: If true then wait for all queued jobs to finish.
+        """
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
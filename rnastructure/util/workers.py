@@ -0,0 +1,328 @@
+"""This module keeps programs running between calls. Starting a program can
+take much longer than folding a short sequence, so programs which can read
+several records from stdin are started once and then sent one record after
+another. A Worker is a single such program and a WorkerPool runs several of
+them at once, restarting any which crash or time out.
+
+Wrappers take part by implementing persistent_arguments, record and
+read_record, see Wrapper for details.
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import errno
+import select
+import Queue
+import threading
+from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+
+from rnastructure.util import workspace
+from rnastructure.util.wrapper import ProgramFailedError
+from rnastructure.util.wrapper import ProgramTimeOutError
+
+
+class LineReader(object):
+    """Reads lines from a pipe, waiting no longer than a deadline for each.
+    """
+
+    chunk = 65536
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.deadline = None
+        self._buffer = ''
+
+    def readline(self):
+        """Read a single line.
+
+        :returns: The line, including the newline, or '' at the end of input.
+        """
+        while '\n' not in self._buffer:
+            wait = None
+            if self.deadline is not None:
+                wait = max(self.deadline - time.time(), 0)
+            readable, _, _ = select.select([self.fd], [], [], wait)
+            if not readable:
+                raise ProgramTimeOutError("No output before the deadline")
+            data = os.read(self.fd, self.chunk)
+            if not data:
+                line, self._buffer = self._buffer, ''
+                return line
+            self._buffer += data
+        line, self._buffer = self._buffer.split('\n', 1)
+        return line + '\n'
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+class Worker(object):
+    """A single long running program. It is started when first needed and is
+    restarted after it crashes or times out.
+    """
+
+    def __init__(self, wrapper, options=None, workspaces=None):
+        """Create a new Worker.
+
+        :wrapper: The Wrapper which knows how to run the program.
+        :options: Options for the program.
+        :workspaces: The WorkspacePool to run the program in.
+        """
+        self.wrapper = wrapper
+        self.options = options or {}
+        self.workspaces = workspaces or workspace.default_pool()
+        self.arguments = wrapper.persistent_arguments(self.options)
+        self.process = None
+        self.directory = None
+        self.reader = None
+        self.served = 0
+        self.restarts = 0
+
+    def start(self):
+        """Start the program if it is not running."""
+        if self.process is not None:
+            return
+        arguments = [self.wrapper.executable()] + self.arguments[1:]
+        self.directory = self.workspaces.acquire()
+        # Workers are started from several threads at once. A pipe of another
+        # program started at the same moment may not be marked close on exec
+        # yet, and a worker holding it open would keep that program from ever
+        # reading the end of its input.
+        with open(os.path.join(self.directory, 'stderr'), 'w') as stderr:
+            self.process = Popen(arguments, stdin=PIPE, stdout=PIPE,
+                                 stderr=stderr, cwd=self.directory,
+                                 close_fds=True)
+        self.reader = LineReader(self.process.stdout.fileno())
+
+    def stop(self, failed=False):
+        """Stop the program, killing it if it does not exit on its own.
+
+        :failed: True if the program is stopped because it failed.
+        """
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        if failed and process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+        self.workspaces.release(self.directory, failed=failed)
+        self.directory = None
+
+    def __error__(self):
+        try:
+            with open(os.path.join(self.directory, 'stderr'), 'r') as raw:
+                return raw.read().strip()
+        except IOError:
+            return ''
+
+    def __call__(self, raw):
+        """Send a single record to the program and read its result.
+
+        :raw: The raw input.
+        :returns: The result as read by the wrapper's read_record.
+        """
+        self.wrapper.validate(raw, self.options)
+        self.start()
+        try:
+            self.process.stdin.write(self.wrapper.record(raw))
+            self.process.stdin.flush()
+        except (IOError, OSError), err:
+            if getattr(err, 'errno', None) not in (errno.EPIPE, None):
+                raise
+            self.__failed__()
+        return self.__read__()
+
+    def __read__(self):
+        """Read the result of the next record, stopping the program if it
+        fails, times out or its output can not be read. The rest of a record
+        which could not be read would otherwise be read as the result of the
+        next one.
+        """
+        try:
+            self.reader.deadline = None
+            if self.wrapper._time is not None:
+                self.reader.deadline = time.time() + self.wrapper._time
+            result = self.wrapper.read_record(self.reader)
+        except ProgramTimeOutError:
+            self.restarts += 1
+            self.stop(failed=True)
+            raise ProgramTimeOutError("Program %s timed out" %
+                                      self.wrapper.program)
+        except (IOError, OSError), err:
+            if getattr(err, 'errno', None) not in (errno.EPIPE, None):
+                self.__abandon__()
+            result = None
+        except Exception:
+            self.__abandon__()
+
+        if result is None:
+            self.__failed__()
+        self.served += 1
+        return result
+
+    def __abandon__(self):
+        """Stop the program and raise the exception being handled again."""
+        info = sys.exc_info()
+        self.restarts += 1
+        self.stop(failed=True)
+        raise info[0], info[1], info[2]
+
+    def __failed__(self):
+        """Stop the program which failed and raise a ProgramFailedError.
+        """
+        self.process.poll()
+        code = self.process.returncode
+        message = self.__error__()
+        self.restarts += 1
+        self.stop(failed=True)
+        msg = "Program %s failed. Status: %s. Message: %s."
+        raise ProgramFailedError(msg % (self.wrapper.program, code, message))
+
+    def stream(self, inputs, window=64):
+        """Send many records to the program and read their results as the
+        program writes them. Records are written by a separate thread while
+        results are read, but no more than window records are ever sent ahead
+        of the results read so far, so inputs are only taken from the iterable
+        as fast as results are taken from the generator. An invalid input does
+        not stop the others, instead the exception is given in its place.
+
+        :inputs: An iterable of raw inputs.
+        :window: The most records to send before their results are read.
+        :returns: A generator of the result, or exception, of each input in
+        the same order as the inputs.
+        :raises: ProgramFailedError or ProgramTimeOutError if the program
+        fails, after which the program is restarted when next used.
+        """
+        self.start()
+        slots = threading.Semaphore(window)
+        sent = Queue.Queue()
+        stop = threading.Event()
+        feeder = threading.Thread(target=self.__feed__,
+                                  args=(inputs, slots, sent, stop))
+        feeder.daemon = True
+        feeder.start()
+
+        finished = False
+        try:
+            while True:
+                kind, value = sent.get()
+                if kind == 'done':
+                    break
+                if kind == 'error':
+                    raise value
+                if kind == 'sent':
+                    value = self.__read__()
+                slots.release()
+                yield value
+            finished = True
+        finally:
+            stop.set()
+            slots.release()
+            # Results which were sent but not read would be read as the
+            # results of later records, so the program is not reused.
+            if not finished and self.process is not None:
+                self.restarts += 1
+                self.stop(failed=True)
+            feeder.join()
+
+    def __feed__(self, inputs, slots, sent, stop):
+        stdin = self.process.stdin
+        try:
+            for raw in inputs:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                try:
+                    self.wrapper.validate(raw, self.options)
+                except Exception, err:
+                    sent.put(('invalid', err))
+                    continue
+                sent.put(('sent', None))
+                try:
+                    stdin.write(self.wrapper.record(raw))
+                    stdin.flush()
+                except (IOError, OSError, ValueError):
+                    # The program stopped, which is found when its output is
+                    # read.
+                    return
+        except Exception, err:
+            sent.put(('error', err))
+        finally:
+            sent.put(('done', None))
+
+
+class WorkerPool(object):
+    """A fixed number of Workers running the same program. Inputs are handed
+    to whichever worker is free.
+    """
+
+    def __init__(self, wrapper, size=4, options=None, workspaces=None):
+        """Create a new WorkerPool.
+
+        :wrapper: The Wrapper which knows how to run the program.
+        :size: The number of programs to keep running.
+        :options: Options for the program.
+        :workspaces: The WorkspacePool to run the programs in.
+        """
+        self.size = size
+        self.workers = [Worker(wrapper, options=options,
+                               workspaces=workspaces) for _ in xrange(size)]
+        self._free = Queue.Queue()
+        for worker in self.workers:
+            self._free.put(worker)
+
+    def __call__(self, raw):
+        """Run a single input on a free worker, waiting for one if needed.
+        """
+        worker = self._free.get()
+        try:
+            return worker(raw)
+        finally:
+            self._free.put(worker)
+
+    def map(self, inputs):
+        """Run many inputs on all workers at once. A failure for one input
+        does not stop the others, instead the exception that was raised is
+        returned in its place.
+
+        :inputs: An iterable of raw inputs.
+        :returns: A list of the results or raised exceptions for each input, in
+        the same order as the input.
+        """
+        inputs = list(inputs)
+        if not inputs:
+            return []
+
+        def run(raw):
+            try:
+                return self(raw)
+            except Exception, err:
+                return err
+
+        threads = ThreadPool(min(self.size, len(inputs)))
+        try:
+            return threads.map(run, inputs, chunksize=1)
+        finally:
+            threads.close()
+            threads.join()
+
+    def close(self):
+        """Stop all workers."""
+        for worker in self.workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,390 @@
+"""This module spreads a batch of jobs over several machines which share a
+file system. There is no server, all coordination is done with files in a
+single queue directory:
+
+    manifest/shard-NNNNN.pickle  The (name, raw) inputs of each shard.
+    leases/shard-NNNNN.lease     Held by the node working on a shard.
+    output/shard-NNNNN.pickle    The (name, result) outputs of a shard.
+
+Inputs are assigned to shards by a hash of their name, so the same manifest
+always produces the same shards. A node claims a shard by creating its lease
+file exclusively and keeps it alive by touching it. A lease that has not been
+touched for longer than the expiry belongs to a node which crashed, and any
+other node may reclaim it. Outputs are written to a temporary file and renamed
+into place, and a shard is done once its output exists.
+
+Jobs are any callable taking a raw input. Wrappers are run with their map
+method, so each node runs several programs at once, and CifJob runs a
+function on parsed CIF files.
+"""
+
+from __future__ import with_statement
+
+import os
+import time
+import errno
+import socket
+import cPickle
+import tempfile
+import threading
+
+from rnastructure.util.cache import digest
+
+
+class LeaseLostError(Exception):
+    """This indicates that a node lost its lease on a shard, because it was
+    reclaimed by another node, before it could write its output.
+    """
+    pass
+
+
+def shard_of(name, shards):
+    """Get the shard an input belongs to.
+
+    :name: The name of the input.
+    :shards: The total number of shards.
+    """
+    return int(digest(name)[:8], 16) % shards
+
+
+def _write_atomic(filename, data):
+    directory = os.path.dirname(filename)
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.rename(temp, filename)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+class CifJob(object):
+    """A job which parses CIF files and runs a function on them. The raw
+    inputs are the filenames of the CIF files. The function must be picklable
+    if the job is run in several processes, so it should be a module level
+    function.
+    """
+
+    def __init__(self, function):
+        """Create a new CifJob.
+
+        :function: A callable given a tertiary.cif.CIF which returns the
+        result.
+        """
+        self.function = function
+
+    def __call__(self, filename):
+        from rnastructure.tertiary.cif import CIF
+        with open(filename, 'rb') as raw:
+            return self.function(CIF(raw))
+
+
+class Lease(object):
+    """A claim by a node on a single shard.
+    """
+
+    def __init__(self, queue, shard, token):
+        self.queue = queue
+        self.shard = shard
+        self.token = token
+        self.filename = queue.path('leases', shard, '.lease')
+
+    def held(self):
+        """Check if the lease file is still ours."""
+        try:
+            with open(self.filename, 'rb') as raw:
+                return raw.read() == self.token
+        except IOError:
+            return False
+
+    def heartbeat(self):
+        """Keep the lease from expiring.
+
+        :returns: True if the lease is still held.
+        """
+        if not self.held():
+            return False
+        try:
+            os.utime(self.filename, None)
+        except OSError:
+            return False
+        return True
+
+    def release(self):
+        """Give up the lease if it is still held."""
+        if self.held():
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+
+class WorkQueue(object):
+    """A queue of sharded inputs stored in a directory.
+    """
+
+    def __init__(self, directory, expiry=300):
+        """Open a queue.
+
+        :directory: The queue directory.
+        :expiry: Seconds after the last heartbeat at which a lease expires.
+        """
+        self.directory = directory
+        self.expiry = expiry
+
+    @classmethod
+    def create(cls, directory, inputs, shards=16, expiry=300):
+        """Create a queue from a manifest of inputs. Creating a queue again
+        with the same inputs gives the same shards.
+
+        :directory: The queue directory, it is created if needed.
+        :inputs: An iterable of (name, raw) tuples. Names must be unique.
+        :shards: The number of shards to split the inputs into.
+        :expiry: Seconds after the last heartbeat at which a lease expires.
+        :returns: The WorkQueue.
+        """
+        for name in ('manifest', 'leases', 'output'):
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        split = [[] for _ in xrange(shards)]
+        for name, raw in inputs:
+            split[shard_of(name, shards)].append((name, raw))
+
+        queue = cls(directory, expiry=expiry)
+        for shard, items in enumerate(split):
+            data = cPickle.dumps(items, cPickle.HIGHEST_PROTOCOL)
+            _write_atomic(queue.path('manifest', shard, '.pickle'), data)
+        return queue
+
+    def path(self, kind, shard, suffix):
+        return os.path.join(self.directory, kind,
+                            'shard-%05d%s' % (shard, suffix))
+
+    def shards(self):
+        """Get the numbers of all shards, in order."""
+        numbers = []
+        for name in os.listdir(os.path.join(self.directory, 'manifest')):
+            if name.startswith('shard-') and name.endswith('.pickle'):
+                numbers.append(int(name[6:-7]))
+        return sorted(numbers)
+
+    def inputs(self, shard):
+        """Get the (name, raw) inputs of a shard."""
+        with open(self.path('manifest', shard, '.pickle'), 'rb') as raw:
+            return cPickle.load(raw)
+
+    def is_done(self, shard):
+        return os.path.exists(self.path('output', shard, '.pickle'))
+
+    def remaining(self):
+        """Get the shards which are not done."""
+        return [shard for shard in self.shards() if not self.is_done(shard)]
+
+    def __expired__(self, filename):
+        try:
+            return time.time() - os.stat(filename).st_mtime > self.expiry
+        except OSError:
+            return False
+
+    def claim(self, shard, owner):
+        """Try to claim a shard. An expired lease is reclaimed.
+
+        :shard: The shard to claim.
+        :owner: A string identifying the claiming node.
+        :returns: A Lease or None if the shard is done or held by another node.
+        """
+        if self.is_done(shard):
+            return None
+        filename = self.path('leases', shard, '.lease')
+        token = '%s %s' % (owner, digest(owner, repr(time.time()),
+                                         repr(os.urandom(8))))
+
+        if os.path.exists(filename) and self.__expired__(filename):
+            self.__reclaim__(filename)
+
+        try:
+            handle = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0644)
+        except OSError, err:
+            if err.errno == errno.EEXIST:
+                return None
+            raise
+        with os.fdopen(handle, 'wb') as out:
+            out.write(token)
+
+        # The shard may have been finished while we were claiming it
+        lease = Lease(self, shard, token)
+        if self.is_done(shard):
+            lease.release()
+            return None
+        return lease
+
+    def __reclaim__(self, filename):
+        """Move an expired lease out of the way. If another node reclaimed it
+        and took a fresh lease in the meantime, that lease is put back.
+        """
+        try:
+            with open(filename, 'rb') as raw:
+                stale = raw.read()
+        except IOError:
+            return
+        tomb = '%s.%s.expired' % (filename, digest(repr(os.urandom(8))))
+        if not self.__expired__(filename):
+            return
+        try:
+            os.rename(filename, tomb)
+        except OSError:
+            return
+        try:
+            with open(tomb, 'rb') as raw:
+                moved = raw.read()
+            if moved != stale:
+                try:
+                    os.link(tomb, filename)
+                except OSError:
+                    pass
+        finally:
+            os.remove(tomb)
+
+    def complete(self, lease, results):
+        """Store the outputs of a shard.
+
+        :lease: The Lease on the shard.
+        :results: A list of (name, result) tuples.
+        :raises: LeaseLostError if the lease was lost.
+        """
+        if not lease.held():
+            raise LeaseLostError("Lost the lease on shard %s" % lease.shard)
+        data = cPickle.dumps(results, cPickle.HIGHEST_PROTOCOL)
+        _write_atomic(self.path('output', lease.shard, '.pickle'), data)
+        lease.release()
+
+    def outputs(self, shard):
+        """Get the (name, result) outputs of a finished shard."""
+        with open(self.path('output', shard, '.pickle'), 'rb') as raw:
+            return cPickle.load(raw)
+
+    def merge(self):
+        """Iterate over the outputs of all shards, in shard order.
+
+        :returns: A generator of (name, result) tuples.
+        :raises: ValueError if some shard is not done.
+        """
+        remaining = self.remaining()
+        if remaining:
+            raise ValueError("Shards %s are not done" % remaining)
+        for shard in self.shards():
+            for pair in self.outputs(shard):
+                yield pair
+
+    def merge_to(self, filename):
+        """Merge the outputs of all shards into a single pickled dict from
+        name to result.
+
+        :filename: The file to write.
+        """
+        data = cPickle.dumps(dict(self.merge()), cPickle.HIGHEST_PROTOCOL)
+        _write_atomic(os.path.abspath(filename), data)
+
+
+def default_owner():
+    """Identify this process across all nodes."""
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+class Node(object):
+    """Works through a queue by claiming one shard after another until none
+    are left.
+    """
+
+    def __init__(self, queue, job, owner=None, workers=4, heartbeat=None):
+        """Create a new Node.
+
+        :queue: The WorkQueue to work on.
+        :job: The callable to run on each raw input. A Wrapper is run with its
+        map method.
+        :owner: A string identifying this node.
+        :workers: The number of inputs to run at once, for wrappers.
+        :heartbeat: Seconds between heartbeats, a third of the expiry if not
+        given.
+        """
+        self.queue = queue
+        self.job = job
+        self.owner = owner or default_owner()
+        self.workers = workers
+        self.heartbeat = heartbeat or queue.expiry / 3.0
+        self.completed = []
+
+    def __run_inputs__(self, items):
+        raws = [raw for _, raw in items]
+        if hasattr(self.job, 'map') and hasattr(self.job, 'program'):
+            values = self.job.map(raws, max_workers=self.workers)
+        else:
+            values = []
+            for raw in raws:
+                try:
+                    values.append(self.job(raw))
+                except Exception, err:
+                    values.append(err)
+        return zip([name for name, _ in items], values)
+
+    def __beat__(self, lease, stop):
+        while True:
+            stop.wait(self.heartbeat)
+            if stop.is_set() or not lease.heartbeat():
+                return
+
+    def work(self, lease):
+        """Run all inputs of a claimed shard and store the outputs.
+
+        :lease: The Lease of the shard.
+        :raises: LeaseLostError if the lease was lost.
+        """
+        stop = threading.Event()
+        beat = threading.Thread(target=self.__beat__, args=(lease, stop))
+        beat.daemon = True
+        beat.start()
+        try:
+            results = self.__run_inputs__(self.queue.inputs(lease.shard))
+        finally:
+            stop.set()
+            beat.join()
+        self.queue.complete(lease, results)
+        self.completed.append(lease.shard)
+
+    def run(self, wait=False, poll=1.0):
+        """Claim and work on shards until there are none left.
+
+        :wait: If true then keep waiting for shards held by other nodes, in
+        case their leases expire, until every shard is done.
+        :poll: Seconds to wait between looking for shards when waiting.
+        :returns: The shards this node completed.
+        """
+        while True:
+            remaining = self.queue.remaining()
+            if not remaining:
+                break
+            # Start at a different shard on each node to avoid contention
+            start = shard_of(self.owner, len(remaining))
+            remaining = remaining[start:] + remaining[:start]
+            claimed = False
+            for shard in remaining:
+                lease = self.queue.claim(shard, self.owner)
+                if lease is None:
+                    continue
+                claimed = True
+                try:
+                    self.work(lease)
+                except LeaseLostError:
+                    pass
+            if not claimed:
+                if not wait:
+                    break
+                time.sleep(poll)
+        return self.completed
@@ -0,0 +1,154 @@
+"""This module manages the scratch directories programs are run in. Creating a
+new temp directory for every call and never removing it leaks directories and
+puts all of the small input and output files on disk. A WorkspacePool instead
+hands out directories from a single root, preferably on a memory backed file
+system, cleans them when they are released and keeps a bounded number of them
+around for reuse.
+"""
+
+from __future__ import with_statement
+
+import os
+import atexit
+import shutil
+import tempfile
+import threading
+
+
+def default_root():
+    """Get the directory new pools create their root in. This is /dev/shm if
+    it can be written to, otherwise the usual temp directory.
+    """
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return shm
+    return None
+
+
+def clean(path):
+    """Remove everything inside of a directory, but not the directory itself.
+    """
+    for name in os.listdir(path):
+        name = os.path.join(path, name)
+        if os.path.isdir(name) and not os.path.islink(name):
+            shutil.rmtree(name, ignore_errors=True)
+        else:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+class WorkspacePool(object):
+    """A pool of scratch directories. Each workspace is acquired, possibly
+    retained by results which still need its files, and released. Once it
+    has been released as often as it was acquired or retained it is cleaned
+    and kept for reuse, unless more than size workspaces are already waiting
+    to be reused in which case it is removed.
+    """
+
+    def __init__(self, root=None, size=32, keep_failed=False):
+        """Create a new WorkspacePool.
+
+        :root: Directory to create the pool's own directory in. If not given
+        /dev/shm is used if possible.
+        :size: The maximum number of idle workspaces to keep.
+        :keep_failed: If true then workspaces released after a failure are
+        left untouched, for debugging, and never reused.
+        """
+        if root is None:
+            root = default_root()
+        self.root = tempfile.mkdtemp(prefix='rnastructure-', dir=root)
+        self.size = size
+        self.keep_failed = keep_failed
+        self.failed = []
+        self._idle = []
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Get an empty workspace.
+
+        :returns: The absolute path of the workspace.
+        """
+        with self._lock:
+            if self._idle:
+                path = self._idle.pop()
+            else:
+                path = tempfile.mkdtemp(dir=self.root)
+            self._refs[path] = 1
+        return path
+
+    def retain(self, path):
+        """Keep a workspace from being reused until it is released once more.
+
+        :path: The workspace to retain.
+        :returns: True if the path is a workspace of this pool that is in use.
+        """
+        with self._lock:
+            if path not in self._refs:
+                return False
+            self._refs[path] += 1
+        return True
+
+    def release(self, path, failed=False):
+        """Give a workspace back to the pool.
+
+        :path: The workspace to release.
+        :failed: True if the workspace was used by a call that failed.
+        """
+        with self._lock:
+            if path not in self._refs:
+                return
+            if failed and self.keep_failed:
+                del self._refs[path]
+                self.failed.append(path)
+                return
+            self._refs[path] -= 1
+            if self._refs[path] > 0:
+                return
+            del self._refs[path]
+            reuse = len(self._idle) < self.size
+
+        if not reuse:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        clean(path)
+        with self._lock:
+            self._idle.append(path)
+
+    def in_use(self):
+        """Get the number of workspaces that have not been released."""
+        with self._lock:
+            return len(self._refs)
+
+    def close(self):
+        """Remove all idle workspaces and the pool's directory if it is empty.
+        Workspaces which are in use or were kept after a failure are left.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for path in idle:
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rmdir(self.root)
+        except OSError:
+            pass
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """Get the pool shared by all wrappers which are not given a directory or
+    a pool of their own. It is created the first time it is needed and closed
+    when the interpreter exits.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = WorkspacePool()
+            atexit.register(_default.close)
+        return _default
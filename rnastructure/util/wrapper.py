@@ -5,10 +5,27 @@ from __future__ import with_statement
 
 
 import os
+import sys
 import abc
+import copy
+import time
+import errno
+import fcntl
+import itertools
+import shutil
 import select
 import tempfile
+import threading
+from cStringIO import StringIO
+from collections import deque
+from tempfile import SpooledTemporaryFile
 from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+
+from rnastructure.util import metrics
+from rnastructure.util import programs
+from rnastructure.util import workspace
+from rnastructure.util.programs import ProgramNotFoundError
 
 
 def is_number(arg):
@@ -60,6 +77,34 @@ class ProgramFailedError(Exception):
     pass
 
 
+class CallCancelledError(Exception):
+    """This class indicates that a running program was cancelled before it
+    finished.
+    """
+    pass
+
+
+TRANSPORTS = ('file', 'stdin', 'fifo')
+"""The ways input can be given to a program, see Wrapper.transport."""
+
+_LIMITED = """import os, sys, resource
+for item in sys.argv[1].split():
+    limit, soft, hard = [int(value) for value in item.split(':')]
+    resource.setrlimit(limit, (soft, hard))
+os.execv(sys.argv[2], sys.argv[2:])
+"""
+"""The script which applies rlimits and then runs the program in its place.
+Limits are applied by this separate interpreter and not by a preexec_fn, as
+running Python code in a child forked from a process with several threads
+can deadlock."""
+
+
+def _nonblocking(stream):
+    fd = stream.fileno()
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
 class Wrapper(object):
     """This is a class to ease wrapper of various command line programs.
     Classes inherting from this must define a program to run.
@@ -70,18 +115,54 @@ class Wrapper(object):
 
     options = {}
 
+    stream_results = False
+    """If true then results is called as soon as the program has started, and
+    the stdout it is given yields lines as the program writes them. Any
+    failure of the program is still raised once it has finished."""
+
+    reuse_directory = False
+    """If true then map will reuse a single working directory for all calls
+    made by the same thread when this wrapper was given a directory. This is
+    only safe if the results do not refer to the files in the working
+    directory after they are returned."""
+
+    workspaces = None
+    """The WorkspacePool to run programs in when no directory is given. If
+    None the pool shared by all wrappers is used."""
+
+    cache = None
+    """A util.cache.ResultCache to look results up in before running the
+    program. Results are only cached if this is set."""
+
+    version_arguments = ['--version']
+    """Arguments that make the program print its version."""
+
+    transport = 'file'
+    """How the input written by input_file is given to the program. With
+    'file' it is written to filename in the working directory. With 'stdin'
+    it is written to the program's stdin and the arguments are generated with
+    a filename of None. With 'fifo' a named pipe is created at filename and
+    the input is written to it as the program reads it. Only 'file' writes
+    the input to a file. If input_file is a generator then with 'stdin' and
+    'fifo' its chunks are only generated as the program reads them."""
+
+    rlimits = None
+    """A dict from resource limits, like resource.RLIMIT_CPU, to the limit to
+    apply to the program. A limit may be a single number or a (soft, hard)
+    tuple. The limits are applied by a small script which then executes the
+    program, so they are safe to use from several threads."""
+
     def __init__(self, filename, directory=None, time=120):
         """Generate a new Wrapper.
 
         :filename: Filename to write to for input.
-        :directory: Directory to write to. If not given then a tempdir is used.
+        :directory: Directory to write to. If not given then a workspace from
+        a WorkspacePool is used.
         :time: Maximum time for the program.
         """
         self._filename = filename
         self._base = directory
         self._time = time
-        self.stdout = None
-        self.stderr = None
         self.known_options = set(self.options.keys())
 
     @abc.abstractmethod
@@ -170,6 +251,8 @@ class Wrapper(object):
         :filename: Input filename.
         :options: Options hash.
         """
+        if filename is None:
+            return []
         return [filename]
 
     def generate_options(self, filename, options):
@@ -197,67 +280,759 @@ class Wrapper(object):
     def _program_failed_(self, process):
         return False
 
-    def __call__(self, raw, options=None):
-        """Run the program after generating the required input and return the
-        produced results.
+    def persistent_arguments(self, options):
+        """Create the command line to start the program so that it reads one
+        record after another from stdin, as used by util.workers. Programs
+        which can not do this should not implement it. The first argument is
+        replaced by the path the program is found at.
+
+        :options: Options hash.
         """
+        raise NotImplementedError("%s can not read several records from "
+                                  "stdin" % self.program)
 
-        if not self.program:
-            raise ValueError("Must define a program to run.")
+    def record(self, raw):
+        """Format a single input as a record for a persistent program.
+
+        :raw: The raw input.
+        """
+        raise NotImplementedError("Must implement record")
 
+    def read_record(self, stream):
+        """Read the result of a single record from a persistent program.
+
+        :stream: A file like object with the program's stdout.
+        :returns: The result or None if the output ended before a whole record
+        was read.
+        """
+        raise NotImplementedError("Must implement read_record")
+
+    def __input__(self, stream, raw):
+        """Write the input with input_file. If input_file is a generator then
+        the chunks it yields are written as well.
+        """
+        chunks = self.input_file(stream, raw)
+        if chunks is not None:
+            for chunk in chunks:
+                stream.write(chunk)
+
+    def __setup__(self, raw, options, record):
+        """Validate the input, create the working directory and write the input
+        file. This returns the working directory, the absolute input filename,
+        the command line, the content to write to stdin, the pool of the
+        working directory and the fifo to write the content to instead, if
+        any.
+        """
+        if self.transport not in TRANSPORTS:
+            raise ValueError("Unknown transport %s" % self.transport)
         # Check the input and options are valid
-        options = options or {}
-        if not self.validate(raw, options):
-            raise ValueError("Could not validate options and input")
+        with record.phase('validate'):
+            if not self.validate(raw, options):
+                raise ValueError("Could not validate options and input")
 
-        # Generate temp directory if needed.
+        # Find the program before anything is written
+        executable = self.executable()
+
+        # Get a workspace if needed. The program is run inside of it but we
+        # never change our own working directory, so several calls may run at
+        # once in different threads.
+        pool = None
         temp_dir = self._base
         if not temp_dir:
-            temp_dir = tempfile.mkdtemp()
-        cur_dir = os.getcwd()
-
-        # Write input file
-        os.chdir(temp_dir)
-        if self._filename is not None:
-            with open(self._filename, 'w') as input_file:
-                self.input_file(input_file, raw)
-
-        # Generate arguments
-        arguments = [self.program]
-        args = self.generate_program_arguments(self._filename, options)
-        if args:
-            arguments.extend(args)
-
-        content = self.stdin(temp_dir, raw, options)
+            pool = self.workspaces or workspace.default_pool()
+            temp_dir = pool.acquire()
+        temp_dir = os.path.abspath(temp_dir)
+
+        try:
+            record.begin('input')
+            # Write input file, or keep it for the program to read from a
+            # pipe. Generated input is not collected first, its chunks are
+            # only taken as the program reads them.
+            filename = None
+            content = None
+            fifo = None
+            if self.transport == 'file':
+                if self._filename is not None:
+                    filename = os.path.join(temp_dir, self._filename)
+                    with open(filename, 'w') as input_file:
+                        self.__input__(input_file, raw)
+                    record.bytes_in += os.path.getsize(filename)
+            else:
+                buffer = StringIO()
+                chunks = self.input_file(buffer, raw)
+                content = buffer.getvalue()
+                if chunks is not None:
+                    content = itertools.chain([content], chunks)
+                if self.transport == 'fifo':
+                    filename = os.path.join(temp_dir, self._filename)
+                    os.mkfifo(filename)
+                    fifo, content = content, None
+
+            # Generate arguments
+            arguments = [executable]
+            args = self.generate_program_arguments(filename, options)
+            if args:
+                arguments.extend(args)
+
+            extra = self.stdin(temp_dir, raw, options)
+            if extra is not None:
+                if content is not None:
+                    raise ValueError("%s writes its own stdin so it can not "
+                                     "use the stdin transport" % self.program)
+                content = extra
+            record.end('input')
+        except:
+            if pool:
+                pool.release(temp_dir, failed=True)
+            raise
+        return temp_dir, filename, arguments, content, pool, fifo
+
+    def start(self, raw, options=None):
+        """Start the program without waiting for it to finish. The returned
+        Call must be pumped, see Call and Multiplexer, until it is done and
+        then its result is what calling this object would have returned.
+
+        :raw: The raw input.
+        :options: The options hash.
+        :returns: A Call for the running program.
+        """
+        options = options or {}
+        record = metrics.CallRecord(self.program)
+        try:
+            setup = self.__setup__(raw, options, record)
+        except (InvalidInputError, InvalidOptionError, UnknownOptionError):
+            record.finish('invalid')
+            raise
+        except:
+            record.finish('error')
+            raise
+
+        temp_dir, filename, arguments, content, pool, fifo = setup
         stdin = None
         if content is not None:
             stdin = PIPE
-        process = Popen(arguments, stdout=PIPE, stderr=PIPE, stdin=stdin)
-        self.stdout = process.stdout
-        self.stderr = process.stderr
+        try:
+            # Calls are started from several threads at once, so the program
+            # must not inherit the pipes of one started at the same moment.
+            with record.phase('spawn'):
+                process = Popen(self.__limited__(arguments), stdout=PIPE,
+                                stderr=PIPE, stdin=stdin, cwd=temp_dir,
+                                close_fds=True)
+        except:
+            record.finish('error')
+            if pool:
+                pool.release(temp_dir, failed=True)
+            raise
+        if fifo is not None:
+            fifo = (filename, fifo)
+        return Call(self, process, temp_dir, self._filename, content=content,
+                    workspace=pool, record=record, fifo=fifo)
 
-        if content is not None:
-            process.stdin.write(content)
+    def __limited__(self, arguments):
+        """Wrap the command line so the program runs with the rlimits of this
+        wrapper. This costs the start up of a small Python script, so it is
+        only done when there are limits to apply.
+        """
+        if not self.rlimits:
+            return arguments
+        limits = []
+        for limit, value in sorted(self.rlimits.items()):
+            if not isinstance(value, tuple):
+                value = (value, value)
+            limits.append('%d:%d:%d' % ((limit,) + tuple(value)))
+        return [sys.executable, '-S', '-c', _LIMITED, ' '.join(limits)] + \
+            arguments
 
-        # Use select to wait until process is done.
-        rlist, wlist, xlist = select.select([process.stderr], [],
-                                            [process.stdout, process.stderr],
-                                            self._time)
-        os.chdir(cur_dir)
+    def __call__(self, raw, options=None):
+        """Run the program after generating the required input and return the
+        produced results. Both stdout and stderr are read while the program
+        runs, so programs with large outputs never block on a full pipe, and
+        the program is killed once it has run for longer than the allowed time.
+        Nothing about the call is kept on this object, use start to get at the
+        output of the program.
+        """
+        key = None
+        if self.cache is not None:
+            options = options or {}
+            self.validate(raw, options)
+            key = self.cache.key(self, raw, options)
+            found, result = self.cache.get(key)
+            if found:
+                return result
+
+        call = self.start(raw, options)
+        try:
+            result = call.result()
+        finally:
+            call.cancel()
 
-        if hasattr(stdin, 'close'):
-            stdin.close()
+        if key is not None:
+            self.cache.put(key, result)
+        return result
 
-        if not rlist and not wlist and not xlist:
-            process.kill()
-            raise ProgramTimeOutError("Program %s timed out" % self.program)
+    def executable(self):
+        """Find the program to run, see util.programs.
 
-        process.poll()
+        :returns: The absolute path to the program.
+        :raises: ProgramNotFoundError if the program can not be found.
+        """
+        if not self.program:
+            raise ValueError("Must define a program to run.")
+        return programs.registry.resolve(self.program)
+
+    def version(self):
+        """Get the version the program reports. The version is only probed
+        again once the program has changed.
+
+        :returns: The first line the program prints when given the
+        version_arguments, or 'unknown' if it could not be run.
+        """
+        try:
+            return programs.registry.version(self.program,
+                                             self.version_arguments)
+        except ProgramNotFoundError:
+            return 'unknown'
+
+    def __check__(self, process):
+        """Raise a ProgramFailedError if the finished program failed.
+        """
         code = process.returncode
         error_message = self._program_failed_(process)
         if code or error_message:
             msg = "Program %s failed. Status: %s. Message: %s."
             raise ProgramFailedError(msg % (self.program, code, error_message))
 
-        # Generate result to return.
-        return self.results(process, temp_dir, self._filename)
+    def map(self, inputs, max_workers=4, options=None):
+        """Run the program on many inputs using a pool of threads. Each call
+        gets a working directory of its own, either a workspace or, if this
+        wrapper was given a directory, one inside of it. A failure for one input
+        does not stop the others, instead the exception that was raised is
+        returned in its place.
+
+        :inputs: An iterable of raw inputs.
+        :max_workers: The maximum number of programs to run at once.
+        :options: Options to use for every input. If not given then each input
+        is run without an options argument.
+        :returns: A list of the results or raised exceptions for each input, in
+        the same order as the input.
+        """
+        inputs = list(inputs)
+        if not inputs:
+            return []
+
+        root = None
+        if self._base:
+            root = tempfile.mkdtemp(dir=self._base)
+        local = threading.local()
+
+        def run(raw):
+            try:
+                worker = self
+                if root:
+                    directory = getattr(local, 'directory', None)
+                    if directory is None or not self.reuse_directory:
+                        directory = tempfile.mkdtemp(dir=root)
+                        local.directory = directory
+                    else:
+                        workspace.clean(directory)
+                    worker = copy.copy(self)
+                    worker._base = directory
+                if options is None:
+                    return worker(raw)
+                return worker(raw, options)
+            except Exception, err:
+                return err
+
+        pool = ThreadPool(max(1, min(max_workers, len(inputs))))
+        try:
+            return pool.map(run, inputs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            if root and self.reuse_directory:
+                shutil.rmtree(root, ignore_errors=True)
+
+
+class Call(object):
+    """A program started by Wrapper.start. Nothing is read from or written to
+    the program until pump is called, so many calls can be run at once from a
+    single thread by selecting on their readers and writers and pumping the
+    ones which are ready. Output is collected in buffers which are kept in
+    memory while small and spooled to disk once they grow past spool bytes.
+    Once a call is done its stdout, stderr and returncode are available, like
+    those of a finished process, and result gives what calling the wrapper
+    would have.
+    """
+
+    chunk = 65536
+
+    spool = 1024 * 1024
+
+    poll = 0.01
+    """How often to check if the program has opened its fifo."""
+
+    def __init__(self, wrapper, process, temp_dir, filename, content=None,
+                 workspace=None, record=None, fifo=None):
+        """Create a new Call.
+
+        :wrapper: The Wrapper which started the program.
+        :process: The running process.
+        :temp_dir: The directory the program runs in.
+        :filename: The input filename.
+        :content: Content to write to the program's stdin, if any. This is
+        either a string or an iterable of strings, which are only taken from
+        it as the program reads them.
+        :workspace: The WorkspacePool temp_dir was acquired from, if any. It
+        is released once the result has been computed.
+        :record: The metrics.CallRecord to add the measurements of this call
+        to. One is created if not given.
+        :fifo: A tuple of the path of a fifo the program reads and the content
+        to write to it, as for content, if any.
+        """
+        self.wrapper = wrapper
+        self.workspace = workspace
+        self.record = record or metrics.CallRecord(wrapper.program)
+        self.record.begin('run')
+        self.process = process
+        self.temp_dir = temp_dir
+        self.filename = filename
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+        self.timed_out = False
+        self.cancelled = False
+        self.deadline = None
+        if wrapper._time is not None:
+            self.deadline = time.time() + wrapper._time
+
+        self._fifo = None
+        if fifo is not None:
+            self._fifo, content = fifo
+        self._pending = ''
+        self._chunks = None
+        if isinstance(content, basestring):
+            self._pending = content
+        elif content is not None:
+            self._chunks = iter(content)
+        self._sink = None
+        self._fds = (process.stdout.fileno(), process.stderr.fileno())
+        self._output = {}
+        for pipe in (process.stdout, process.stderr):
+            _nonblocking(pipe)
+            buffer = SpooledTemporaryFile(max_size=self.spool)
+            self._output[pipe.fileno()] = (pipe, buffer)
+        self._streams = dict(self._output)
+        if process.stdin is not None:
+            _nonblocking(process.stdin)
+            self._sink = process.stdin.fileno()
+            if not self.__refill__():
+                self.__close_sink__()
+        elif self._fifo is not None:
+            self.__open_fifo__()
+
+    def readers(self):
+        """The file descriptors that must be read from."""
+        return self._streams.keys()
+
+    def writers(self):
+        """The file descriptors that must be written to."""
+        if self._sink is not None and self.__refill__():
+            return [self._sink]
+        return []
+
+    def __refill__(self):
+        """Take chunks of generated input until there is some to write.
+
+        :returns: True if there is input left to write.
+        """
+        while not self._pending and self._chunks is not None:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                self._chunks = None
+        return bool(self._pending)
+
+    def timeout(self):
+        """The longest time to wait before this call must be pumped again even
+        if none of its descriptors are ready, or None to wait for them.
+        """
+        wait = None
+        if self.deadline is not None:
+            wait = max(self.deadline - time.time(), 0)
+        if self._fifo is not None:
+            wait = min(wait, self.poll) if wait is not None else self.poll
+        return wait
+
+    def __open_fifo__(self):
+        # Opening the writing end of a fifo without blocking fails until the
+        # program has opened the reading end.
+        try:
+            self._sink = os.open(self._fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError, err:
+            if err.errno == errno.ENXIO:
+                return
+            raise
+        self._fifo = None
+        if not self.__refill__():
+            self.__close_sink__()
+
+    def __close_sink__(self):
+        self._pending = ''
+        self._chunks = None
+        if self._sink is None:
+            return
+        if self.process.stdin is not None:
+            self.process.stdin.close()
+        else:
+            os.close(self._sink)
+        self._sink = None
+
+    def pump(self, readable=(), writable=()):
+        """Move data between the program and our buffers without blocking.
+        This should be called with the descriptors from readers and writers
+        which select reported as ready. If the deadline has passed the program
+        is killed.
+
+        :readable: Descriptors that are ready to read.
+        :writable: Descriptors that are ready to write.
+        :returns: True if the call is done.
+        """
+        if self.done():
+            return True
+
+        if self._fifo is not None:
+            self.__open_fifo__()
+
+        for fd in writable:
+            self.__write__()
+
+        for fd in readable:
+            if fd not in self._streams:
+                continue
+            pipe, buffer = self._streams[fd]
+            try:
+                data = os.read(fd, self.chunk)
+            except OSError, err:
+                if err.errno == errno.EAGAIN:
+                    continue
+                raise
+            if data:
+                buffer.seek(0, os.SEEK_END)
+                buffer.write(data)
+                self.record.bytes_out += len(data)
+            else:
+                pipe.close()
+                del self._streams[fd]
+
+        if not self._streams:
+            self.__finished__()
+        elif self.deadline is not None and time.time() > self.deadline:
+            self.timed_out = True
+            self.__kill__()
+        return self.done()
+
+    def __write__(self):
+        if self._sink is None or not self.__refill__():
+            return
+        try:
+            written = os.write(self._sink, self._pending[:self.chunk])
+        except OSError, err:
+            if err.errno == errno.EAGAIN:
+                return
+            if err.errno != errno.EPIPE:
+                raise
+            # The program stopped reading, so the rest is never generated.
+            written = len(self._pending)
+            self._chunks = None
+        else:
+            self.record.bytes_in += written
+        self._pending = self._pending[written:]
+        if not self.__refill__():
+            self.__close_sink__()
+
+    def __finished__(self):
+        self.returncode = self.process.wait()
+        self.record.end('run')
+        self._fifo = None
+        self.__close_sink__()
+        self.stdout, self.stderr = [self._output[fd][1] for fd in self._fds]
+        self.stdout.seek(0)
+        self.stderr.seek(0)
+
+    def __kill__(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.returncode = self.process.wait()
+        self.record.end('run')
+        for pipe, _ in self._streams.values():
+            pipe.close()
+        self._streams = {}
+        self._fifo = None
+        self.__close_sink__()
+
+    def done(self):
+        """Check if the program has finished, timed out or was cancelled."""
+        return self.returncode is not None
+
+    def cancel(self):
+        """Kill the program if it is still running and release its workspace.
+        """
+        if not self.done():
+            self.cancelled = True
+            self.__kill__()
+        self.__release__(self.cancelled)
+        self.record.finish('cancelled', self.returncode)
+
+    def step(self):
+        """Block until the program can make some progress and pump it.
+
+        :returns: True if the call is done.
+        """
+        if self.done():
+            return True
+        wait = self.timeout()
+        readers, writers = self.readers(), self.writers()
+        readable, writable, _ = select.select(readers, writers, [], wait)
+        return self.pump(readable, writable)
+
+    def wait(self):
+        """Block until the program is done."""
+        while not self.step():
+            pass
+
+    def lines(self):
+        """Iterate over the lines the program writes to stdout as they are
+        written. This drives the program itself, so it must not be used while
+        the call is pumped by something else.
+        """
+        buffer = self._output[self._fds[0]][1]
+        offset = 0
+        partial = ''
+        while True:
+            finished = self.done()
+            buffer.seek(offset)
+            data = buffer.read()
+            offset = buffer.tell()
+            if data:
+                lines = (partial + data).split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+            if finished:
+                break
+            self.step()
+        if partial:
+            yield partial
+
+    def __raise_stopped__(self):
+        if self.cancelled:
+            raise CallCancelledError("Program %s was cancelled" %
+                                     self.wrapper.program)
+        if self.timed_out:
+            raise ProgramTimeOutError("Program %s timed out" %
+                                      self.wrapper.program)
+
+    def __release__(self, failed):
+        if self.workspace is not None:
+            self.workspace.release(self.temp_dir, failed=failed)
+            self.workspace = None
+
+    def result(self):
+        """Get the result of the program, waiting for it if needed. This
+        raises the same errors as calling the wrapper would. If the wrapper
+        streams its results they are computed from the output as it is
+        written. Afterwards the workspace of the call is released, so results
+        which need its files later must retain it.
+        """
+        try:
+            value = self.__result__()
+        except Exception, err:
+            self.__release__(True)
+            self.record.finish(self.__status__(err), self.returncode)
+            raise
+        self.__release__(False)
+        self.record.finish('ok', self.returncode)
+        return value
+
+    def __status__(self, err):
+        if isinstance(err, ProgramTimeOutError):
+            return 'timeout'
+        if isinstance(err, CallCancelledError):
+            return 'cancelled'
+        if isinstance(err, ProgramFailedError):
+            return 'failed'
+        return 'error'
+
+    def __result__(self):
+        if not self.wrapper.stream_results or self.done():
+            self.wait()
+            self.__raise_stopped__()
+            self.wrapper.__check__(self)
+            with self.record.phase('results'):
+                return self.wrapper.results(self, self.temp_dir,
+                                            self.filename)
+
+        try:
+            with self.record.phase('results'):
+                value = self.wrapper.results(_Running(self), self.temp_dir,
+                                             self.filename)
+        except Exception:
+            self.wait()
+            self.__raise_stopped__()
+            self.wrapper.__check__(self)
+            raise
+        self.wait()
+        self.__raise_stopped__()
+        self.wrapper.__check__(self)
+        return value
+
+
+class _Stream(object):
+    """A read only file like view of the stdout of a running Call."""
+
+    def __init__(self, call):
+        self._lines = call.lines()
+
+    def __iter__(self):
+        return self._lines
+
+    def readline(self):
+        return next(self._lines, '')
+
+    def readlines(self):
+        return list(self._lines)
+
+    def read(self):
+        return ''.join(self._lines)
+
+
+class _Running(object):
+    """What results is given for a Call of a wrapper that streams its results.
+    This is the call itself except that stdout gives lines as they are
+    written.
+    """
+
+    def __init__(self, call):
+        self.stdout = _Stream(call)
+        self._call = call
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+class Multiplexer(object):
+    """This runs many programs at once from a single thread. Programs are
+    submitted along with the wrapper to run them with and are started as
+    long as fewer than limit are running. A single select call then waits on
+    all running programs at once.
+    """
+
+    def __init__(self, limit=16):
+        """Create a new Multiplexer.
+
+        :limit: The maximum number of programs to run at once.
+        """
+        self.limit = limit
+        self._queue = deque()
+        self._running = {}
+        self._count = 0
+
+    def submit(self, wrapper, raw, options=None):
+        """Add a program to run.
+
+        :wrapper: The Wrapper to run the program with.
+        :raw: The raw input.
+        :options: The options hash.
+        :returns: The index of the submitted program.
+        """
+        index = self._count
+        self._count += 1
+        self._queue.append((index, wrapper, raw, options))
+        return index
+
+    def __len__(self):
+        return len(self._queue) + len(self._running)
+
+    def __start__(self):
+        failed = []
+        while self._queue and len(self._running) < self.limit:
+            index, wrapper, raw, options = self._queue.popleft()
+            try:
+                self._running[index] = wrapper.start(raw, options)
+            except Exception, err:
+                failed.append((index, err))
+        return failed
+
+    def step(self, timeout=None):
+        """Start what programs can be started and wait until some running
+        program can make progress.
+
+        :timeout: The longest time to wait.
+        :returns: A list of (index, result) for all programs which finished.
+        Programs that failed have the exception they raised as the result.
+        """
+        finished = self.__start__()
+        readers = {}
+        writers = {}
+        waits = []
+        for index, call in self._running.iteritems():
+            for fd in call.readers():
+                readers[fd] = index
+            for fd in call.writers():
+                writers[fd] = index
+            wait = call.timeout()
+            if wait is not None:
+                waits.append(wait)
+
+        if waits:
+            wait = min(waits)
+            if timeout is None or wait < timeout:
+                timeout = wait
+
+        if readers or writers:
+            readable, writable, _ = select.select(readers.keys(),
+                                                  writers.keys(), [], timeout)
+        else:
+            readable, writable = [], []
+
+        for index, call in self._running.items():
+            ready = [fd for fd in readable if readers[fd] == index]
+            ready_write = [fd for fd in writable if writers[fd] == index]
+            if not call.pump(ready, ready_write):
+                continue
+            del self._running[index]
+            try:
+                finished.append((index, call.result()))
+            except Exception, err:
+                finished.append((index, err))
+        return finished
+
+    def completed(self):
+        """Run all submitted programs, yielding (index, result) as each one
+        finishes.
+        """
+        while len(self):
+            for pair in self.step():
+                yield pair
+
+    def run(self):
+        """Run all submitted programs.
+
+        :returns: A list of the results or raised exceptions for each program,
+        in the order they were submitted.
+        """
+        results = dict(self.completed())
+        return [results[index] for index in sorted(results)]
+
+    def cancel(self):
+        """Cancel all running and waiting programs.
+
+        :returns: The indices of the cancelled programs.
+        """
+        cancelled = [entry[0] for entry in self._queue]
+        self._queue.clear()
+        for index, call in self._running.items():
+            call.cancel()
+            cancelled.append(index)
+        self._running = {}
+        return sorted(cancelled)
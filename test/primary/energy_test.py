@@ -0,0 +1,127 @@
+import random
+import unittest
+
+from rnastructure.primary import energy
+from rnastructure.primary.energy import Nussinov
+from rnastructure.util.wrapper import InvalidInputError
+from rnastructure.util.wrapper import InvalidOptionError
+from rnastructure.util.wrapper import UnknownOptionError
+
+CANONICAL = set(['CG', 'GC', 'GU', 'UG', 'AU', 'UA'])
+
+
+def most_pairs(sequence, min_loop=3):
+    """Count the most nested pairs by the plain recursion."""
+    found = {}
+
+    def best(first, second):
+        if second - first <= min_loop:
+            return 0
+        if (first, second) not in found:
+            value = best(first + 1, second)
+            for other in xrange(first + min_loop + 1, second + 1):
+                if sequence[first] + sequence[other] in CANONICAL:
+                    value = max(value, 1 + best(first + 1, other - 1) +
+                                best(other + 1, second))
+            found[(first, second)] = value
+        return found[(first, second)]
+    return best(0, len(sequence) - 1)
+
+
+def pairs_of(parser):
+    return [(index, partner) for index, partner in enumerate(parser._pairs)
+            if partner is not None and index < partner]
+
+
+class EncodeTest(unittest.TestCase):
+    def test_encodes(self):
+        val = energy.encode('ACGUacgut-N').tolist()
+        self.assertEqual(val, [0, 1, 2, 3, 0, 1, 2, 3, 3, 4, 4])
+
+
+class PairsModelTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = Nussinov(model='pairs')
+        self.random = random.Random(3)
+
+    def test_matches_recursion(self):
+        for _ in xrange(100):
+            sequence = ''.join(self.random.choice('ACGU') for _ in
+                               xrange(self.random.randint(1, 24)))
+            val = self.fold(sequence)[0]
+            self.assertEqual(len(pairs_of(val)), most_pairs(sequence))
+            self.assertEqual(val.energy, -most_pairs(sequence))
+
+    def test_pairs_are_valid(self):
+        sequence = ''.join(self.random.choice('ACGU') for _ in xrange(60))
+        for first, second in pairs_of(self.fold(sequence)[0]):
+            self.assertTrue(sequence[first] + sequence[second] in CANONICAL)
+            self.assertTrue(second - first > 3)
+
+    def test_gaps_do_not_pair(self):
+        val = self.fold('GGG-AAAA-CCC')[0]
+        self.assertEqual(val._pairs[3], None)
+        self.assertEqual(val._pairs[8], None)
+
+
+class StackingModelTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = Nussinov()
+
+    def test_hairpin(self):
+        val = self.fold('ggggaaaacccc')[0]
+        self.assertEqual(pairs_of(val), [(0, 11), (1, 10), (2, 9), (3, 8)])
+        self.assertAlmostEqual(val.energy, 3.0 - 3.3 - 3.3 - 3.3)
+        self.assertEqual(val.sequence, 'ggggaaaacccc')
+
+    def test_no_structure(self):
+        val = self.fold('aaaaaaaa')[0]
+        self.assertEqual(val._pairs, [None] * 8)
+        self.assertEqual(val.energy, 0.0)
+
+    def test_prefers_stacks(self):
+        # Two isolated pairs are worse than leaving them unpaired
+        val = self.fold('gaaaacaaaaaaa')[0]
+        self.assertEqual(pairs_of(val), [])
+
+    def test_span(self):
+        sequence = 'gggaaaccc' + 'a' * 20 + 'gggaaaccc'
+        val = self.fold(sequence, {'span': 10})[0]
+        for first, second in pairs_of(val):
+            self.assertTrue(second - first <= 10)
+        self.assertEqual(len(pairs_of(val)), 6)
+
+    def test_span_matches_unlimited(self):
+        rand = random.Random(5)
+        sequence = ''.join(rand.choice('ACGU') for _ in xrange(80))
+        full = self.fold(sequence)[0]
+        wide = self.fold(sequence, {'span': 79})[0]
+        self.assertEqual(full._pairs, wide._pairs)
+        self.assertAlmostEqual(full.energy, wide.energy)
+
+
+class NussinovInterfaceTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = Nussinov(length=20)
+
+    def test_too_long(self):
+        self.assertRaises(InvalidInputError, self.fold, 'a' * 21)
+
+    def test_bad_options(self):
+        self.assertRaises(InvalidOptionError, self.fold, 'gac',
+                          {'model': 'turner'})
+        self.assertRaises(UnknownOptionError, self.fold, 'gac', {'T': 37})
+
+    def test_map(self):
+        val = self.fold.map(['ggggaaaacccc', 'x', 'a' * 21])
+        self.assertEqual(len(pairs_of(val[0][0])), 4)
+        self.assertTrue(isinstance(val[1], InvalidInputError))
+        self.assertTrue(isinstance(val[2], InvalidInputError))
+
+    def test_fold_many(self):
+        val = list(self.fold.fold_many(['ggggaaaacccc', 'acgu'] * 3, chunk=2))
+        self.assertEqual(len(val), 6)
+        self.assertEqual(val[5][0].sequence, 'acgu')
+
+    def test_no_pool(self):
+        self.assertRaises(NotImplementedError, self.fold.pool, 2)
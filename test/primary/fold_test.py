@@ -1,9 +1,20 @@
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 from StringIO import StringIO
 
+from rnastructure.primary.fold import RNAfold
 from rnastructure.primary.fold import UNAFold
+from rnastructure.primary.fold import Result
+from rnastructure.primary.fold import ResultSet
 from rnastructure.primary.fold import RNAalifold
+from rnastructure.primary.fold import FoldingFailedError
+from rnastructure.util import workspace
 from rnastructure.util.wrapper import InvalidInputError
+from rnastructure.util.wrapper import InvalidOptionError
+from rnastructure.util.wrapper import ProgramFailedError
 from rnastructure.util.wrapper import ProgramTimeOutError
 
 
@@ -114,3 +125,316 @@ class ResultTest(unittest.TestCase):
         val = self.result.loops()
         ans = {'hairpin': ['aaaaaaaa']}
         self.assertEqual(val, ans)
+
+
+class EmptyResultTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        open(os.path.join(self.directory, 'empty.ct'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty_connect_file(self):
+        self.assertRaises(FoldingFailedError, Result,
+                          os.path.join(self.directory, 'empty'))
+
+
+class ResultSetPickleTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy('files/simple_connect.ct',
+                    os.path.join(self.directory, 'seq_file.ct'))
+        results = ResultSet(self.directory, 'seq_file')
+        data = pickle.dumps(results, 2)
+        shutil.rmtree(self.directory)
+        self.results = pickle.loads(data)
+
+    def test_keeps_results(self):
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(self.results[0].sequence, 'g' * 9 + 'a' * 7 + 'c' * 11)
+
+    def test_keeps_connect_file(self):
+        val = self.results[0].connect_file()[0]
+        self.assertEqual(val, '27\tdG = -23.1\tsequence\n')
+
+
+
+class StreamingResultSetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open('files/simple_connect.ct', 'r') as raw:
+            lines = raw.readlines()
+        first, second = lines[:28], lines[28:]
+        # The first file holds all foldings followed by a broken one, which
+        # must never be read.
+        with open(os.path.join(self.directory, 'seq_file.ct'), 'w') as out:
+            out.writelines(first + second + ['broken\n'])
+        for index in xrange(1, 12):
+            name = os.path.join(self.directory, 'seq_file_%s.ct' % index)
+            with open(name, 'w') as out:
+                out.writelines(second if index % 2 else first)
+        for name in ['seq_file.ct.bak', 'other_1.ct', 'seq_file_x.ct']:
+            open(os.path.join(self.directory, name), 'w').close()
+        self.results = ResultSet(self.directory, 'seq_file')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def energy(self, result):
+        return result.connect_file()[0].split()[3]
+
+    def test_finds_numbered_foldings(self):
+        self.assertEqual(len(self.results), 12)
+
+    def test_reads_first_folding_of_file(self):
+        self.assertEqual(len(self.results[0].connect_file()), 28)
+
+    def test_result_pickles(self):
+        data = pickle.dumps(self.results[1], 2)
+        shutil.rmtree(self.directory)
+        os.mkdir(self.directory)
+        val = pickle.loads(data)
+        self.assertEqual(self.energy(val), '-22.4')
+
+    def test_result_outlives_results(self):
+        pool = workspace.WorkspacePool(root=self.directory)
+        directory = pool.acquire()
+        shutil.copy('files/simple_connect.ct',
+                    os.path.join(directory, 'seq_file.ct'))
+        results = ResultSet(directory, 'seq_file', workspace=pool)
+        pool.release(directory)
+        result = results[0]
+        del results
+        self.assertNotEqual(pool.acquire(), directory)
+        self.assertEqual(len(result.connect_file()), 28)
+        del result
+        self.assertEqual(pool.acquire(), directory)
+
+    def test_orders_by_number(self):
+        val = [self.energy(result) for result in self.results[:4]]
+        self.assertEqual(val, ['-23.1', '-22.4', '-23.1', '-22.4'])
+
+    def test_negative_index(self):
+        self.assertEqual(self.energy(self.results[-1]), '-22.4')
+        self.assertEqual(self.energy(self.results[-12]), '-23.1')
+        self.assertRaises(IndexError, self.results.__getitem__, -13)
+        self.assertRaises(IndexError, self.results.__getitem__, 12)
+
+    def test_slices(self):
+        self.assertEqual(len(self.results[::2]), 6)
+        self.assertEqual(len(self.results[-3:]), 3)
+        self.assertEqual(self.results[20:], [])
+
+    def test_does_not_keep_foldings(self):
+        self.assertFalse(self.results[0] is self.results[0])
+
+    def test_caches_recent_foldings(self):
+        results = ResultSet(self.directory, 'seq_file', cache_size=2)
+        first = results[0]
+        self.assertTrue(results[0] is first)
+        results[1]
+        results[2]
+        self.assertFalse(results[0] is first)
+
+    def test_iterates(self):
+        self.assertEqual(len(list(self.results)), 12)
+
+    def test_pickles(self):
+        results = pickle.loads(pickle.dumps(self.results, 2))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(self.energy(results[-1]), '-22.4')
+
+
+class RNAfoldReadRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = RNAfold()
+
+    def read(self, text):
+        return self.fold.read_record(StringIO(text))
+
+    def test_parses_record(self):
+        val = self.read(">first\nGGGAAAUCC\n((.....)) ( -1.20)\n")
+        self.assertEqual(val.name, 'first')
+        self.assertEqual(val.sequence, 'GGGAAAUCC')
+        self.assertEqual(val.energy, -1.2)
+        self.assertEqual(val._pairs[0], 8)
+
+    def test_parses_without_header(self):
+        val = self.read("GGGAAAUCC\n((.....)) (-11.20)\n")
+        self.assertEqual(val.name, None)
+        self.assertEqual(val.energy, -11.2)
+
+    def test_incomplete_record(self):
+        self.assertEqual(self.read(">first\nGGGAAAUCC\n"), None)
+
+    def test_bad_structure_line(self):
+        self.assertRaises(FoldingFailedError, self.read,
+                          "GGGAAAUCC\n((...)) ( -1.20)\n")
+
+    def test_options(self):
+        val = self.fold.persistent_arguments({'noLP': True, 'dangles': 2})
+        self.assertEqual(val, ['RNAfold', '--noPS', '--noLP', '-d2'])
+
+    def test_partition_is_not_persistent(self):
+        self.assertRaises(InvalidOptionError, self.fold.pool, 1,
+                          {'partition': True})
+
+
+class Finished(object):
+    def __init__(self, stdout):
+        self.stdout = StringIO(stdout)
+
+
+class RNAfoldProbabilitiesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fold = RNAfold()
+        self.output = (">sequence\nGGGGAAAACCCCAUUU\n"
+                       "((((....)))).... ( -4.20)\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_dot_plot(self):
+        shutil.copy('files/dot.ps',
+                    os.path.join(self.directory, 'sequence_dp.ps'))
+        val = self.fold.results(Finished(self.output), self.directory, None)
+        self.assertEqual(len(val[0].probabilities), 7)
+        self.assertEqual(val[0].probabilities.sequence, val[0].sequence)
+
+    def test_without_dot_plot(self):
+        val = self.fold.results(Finished(self.output), self.directory, None)
+        self.assertEqual(val[0].probabilities, None)
+
+
+# Writes an unpaired structure of every sequence, exits on uuuu and writes a
+# line of garbage before the result of cccc
+UNPAIRED = r"""
+while read line; do
+    case "$line" in
+        \>*) echo "$line" ;;
+        uuuu) exit 3 ;;
+        cccc) echo garbage
+              echo CCCC
+              echo ".... ( -1.20)" ;;
+        *) echo "$line" | tr acgu ACGU
+           echo "$(echo "$line" | tr -c '\n' .) ( -1.20)" ;;
+    esac
+done
+"""
+
+
+class Unpaired(RNAfold):
+    program = 'sh'
+
+    def generate_options(self, filename, options):
+        return ['-c', UNPAIRED]
+
+
+class RNAfoldStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = Unpaired(length=20)
+        self.taken = 0
+
+    def sequences(self, count):
+        for index in xrange(count):
+            self.taken += 1
+            yield 'ac' * (index % 10 + 1)
+
+    def test_call(self):
+        val = self.fold('gacu')
+        self.assertEqual(len(val), 1)
+        self.assertEqual(val[0].sequence, 'GACU')
+        self.assertEqual(val[0].energy, -1.2)
+
+    def test_streams_in_order(self):
+        val = list(self.fold.stream(self.sequences(100), window=8))
+        self.assertEqual(len(val), 100)
+        self.assertEqual(val[3].sequence, 'AC' * 4)
+        self.assertEqual(val[99].sequence, 'AC' * 10)
+
+    def test_invalid_in_place(self):
+        val = list(self.fold.stream(['gac', 'x', 'a' * 21, 'acgu']))
+        self.assertEqual(val[0].sequence, 'GAC')
+        self.assertTrue(isinstance(val[1], InvalidInputError))
+        self.assertTrue(isinstance(val[2], InvalidInputError))
+        self.assertEqual(val[3].sequence, 'ACGU')
+
+    def test_back_pressure(self):
+        results = self.fold.stream(self.sequences(10000), window=4)
+        next(results)
+        self.assertTrue(self.taken <= 6)
+        results.close()
+
+    def test_failure(self):
+        results = self.fold.stream(['gac', 'uuuu', 'acgu'])
+        self.assertEqual(next(results).sequence, 'GAC')
+        self.assertRaises(ProgramFailedError, next, results)
+
+    def test_pool(self):
+        with self.fold.pool(2) as pool:
+            val = pool.map(['gac', 'acgu'])
+        self.assertEqual([result.sequence for result in val], ['GAC', 'ACGU'])
+
+    def test_unreadable_output(self):
+        with self.fold.pool(1) as pool:
+            val = pool.map(['cccc', 'gac', 'acgu'])
+        self.assertTrue(isinstance(val[0], FoldingFailedError))
+        self.assertEqual([result.sequence for result in val[1:]],
+                         ['GAC', 'ACGU'])
+
+
+# As UNPAIRED, but names every result after the process that folded it
+NAMED = UNPAIRED.replace('\\>*) echo "$line"', '\\>*) echo ">$$"')
+
+
+class Named(Unpaired):
+    def generate_options(self, filename, options):
+        return ['-c', NAMED]
+
+
+class FoldManyTest(unittest.TestCase):
+    def setUp(self):
+        self.fold = Named(length=20)
+        self.taken = 0
+
+    def sequences(self, count):
+        for index in xrange(count):
+            self.taken += 1
+            yield 'ac' * (index % 10 + 1)
+
+    def test_folds_in_one_run(self):
+        val = list(self.fold.fold_many(['gac', 'ggg', 'acgu', 'ccca']))
+        self.assertEqual([result[0].sequence for result in val],
+                         ['GAC', 'GGG', 'ACGU', 'CCCA'])
+        self.assertEqual(len(set(result[0].name for result in val)), 1)
+
+    def test_invalid_in_place(self):
+        val = list(self.fold.fold_many(['gac', 'x', 'a' * 21, 'acgu']))
+        self.assertTrue(isinstance(val[1], InvalidInputError))
+        self.assertTrue(isinstance(val[2], InvalidInputError))
+        self.assertEqual(val[0][0].name, val[3][0].name)
+
+    def test_restarts_after_failure(self):
+        val = list(self.fold.fold_many(['gac', 'uuuu', 'acgu', 'cccc', 'gg']))
+        self.assertTrue(isinstance(val[1], ProgramFailedError))
+        self.assertTrue(isinstance(val[3], FoldingFailedError))
+        self.assertEqual([val[index][0].sequence for index in (0, 2, 4)],
+                         ['GAC', 'ACGU', 'GG'])
+        names = [val[index][0].name for index in (0, 2, 4)]
+        self.assertEqual(len(set(names)), 3)
+
+    def test_is_lazy(self):
+        results = self.fold.fold_many(self.sequences(10000))
+        next(results)
+        self.assertTrue(self.taken <= 70)
+        results.close()
+
+    def test_maps_when_not_persistent(self):
+        val = list(self.fold.fold_many(['gac', 'acgu', 'x'],
+                                       options={'partition': True}))
+        self.assertEqual([result[0].sequence for result in val[:2]],
+                         ['GAC', 'ACGU'])
+        self.assertNotEqual(val[0][0].name, val[1][0].name)
+        self.assertTrue(isinstance(val[2], InvalidInputError))
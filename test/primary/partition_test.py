@@ -0,0 +1,142 @@
+import math
+import random
+import unittest
+
+import numpy as np
+
+from rnastructure.primary import energy
+from rnastructure.primary.partition import Ensemble
+from rnastructure.primary.partition import logsumexp
+
+
+def structures(codes, first, last, min_loop=3):
+    """Every nested structure of first..last as a list of pairs."""
+    if last - first <= min_loop:
+        yield []
+        return
+    for rest in structures(codes, first + 1, last, min_loop):
+        yield rest
+    for other in xrange(first + min_loop + 1, last + 1):
+        if energy.PAIRS[codes[first], codes[other]] < 0:
+            continue
+        for inside in structures(codes, first + 1, other - 1, min_loop):
+            for outside in structures(codes, other + 1, last, min_loop):
+                yield [(first, other)] + inside + outside
+
+
+def boltzmann(sequence, model, kt):
+    """The weight of every structure of a sequence by enumeration."""
+    codes = energy.encode(sequence)
+    weights = []
+    for pairs in structures(codes, 0, len(codes) - 1, model.min_loop):
+        found = set(pairs)
+        total = 0.0
+        for first, second in pairs:
+            ends = (np.array([first]), np.array([second]))
+            if (first + 1, second - 1) in found:
+                total += model.stack(codes, *ends)[0]
+            else:
+                total += model.closing(codes, *ends)[0]
+        weights.append((pairs, math.exp(-total / kt)))
+    return weights
+
+
+class LogSumExpTest(unittest.TestCase):
+    def test_large_values(self):
+        val = logsumexp(np.array([[1000.0, 1000.0], [-np.inf, -np.inf]]))
+        self.assertAlmostEqual(val[0], 1000.0 + math.log(2))
+        self.assertEqual(val[1], -np.inf)
+
+
+class EnumerationTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(7)
+
+    def check(self, model):
+        for _ in xrange(15):
+            sequence = ''.join(self.random.choice('ACGU') for _ in
+                               xrange(self.random.randint(1, 15)))
+            ensemble = Ensemble(sequence, model)
+            weights = boltzmann(sequence, model, ensemble.kt)
+            total = sum(weight for _, weight in weights)
+            self.assertAlmostEqual(ensemble.log_partition, math.log(total))
+
+            expected = {}
+            for pairs, weight in weights:
+                for pair in pairs:
+                    expected[pair] = expected.get(pair, 0.0) + weight / total
+            found = ensemble.probabilities(threshold=1e-12)
+            for first, second, value in found.pairs(0.0):
+                self.assertAlmostEqual(value, expected.pop((first, second)))
+            self.assertTrue(all(value < 1e-12 for value in expected.values()))
+
+    def test_stacking_model(self):
+        self.check(energy.Model())
+
+    def test_pairs_model(self):
+        self.check(energy.Model(stacking=False))
+
+
+class EnsembleTest(unittest.TestCase):
+    def setUp(self):
+        self.sequence = 'GGGGAAAACCCCAUGCAUGCGGAUUCCGAUCG'
+        self.ensemble = Ensemble(self.sequence)
+
+    def test_energy(self):
+        self.assertTrue(self.ensemble.energy < 0)
+
+    def test_probabilities(self):
+        val = self.ensemble.probabilities()
+        self.assertEqual(val.sequence, self.sequence)
+        self.assertTrue(val.get(0, 11) > 0.5)
+        self.assertTrue((val.paired() <= 1 + 1e-9).all())
+
+    def test_sample_pairs(self):
+        table = self.ensemble.sample_pairs(2000, seed=1)
+        self.assertEqual(table.shape, (2000, len(self.sequence)))
+        paired = table >= 0
+        rows = np.nonzero(paired)[0]
+        self.assertTrue((table[rows, table[paired]] ==
+                         np.nonzero(paired)[1]).all())
+
+        val = self.ensemble.probabilities(threshold=1e-3)
+        for first, second, value in val.pairs(0.05):
+            frequency = (table[:, first] == second).mean()
+            self.assertTrue(abs(frequency - value) < 0.05)
+
+    def test_sample_is_repeatable(self):
+        first = self.ensemble.sample_pairs(50, seed=3)
+        second = self.ensemble.sample_pairs(50, seed=3)
+        self.assertTrue((first == second).all())
+
+    def test_sample_parsers(self):
+        val = self.ensemble.sample(3, seed=2)
+        self.assertEqual(len(val), 3)
+        self.assertEqual(val[0].sequence, self.sequence)
+
+    def test_span(self):
+        ensemble = Ensemble(self.sequence, span=8)
+        table = ensemble.sample_pairs(200, seed=4)
+        spans = np.abs(table - np.arange(len(self.sequence)))
+        self.assertTrue((spans[table >= 0] <= 8).all())
+        for first, second, _ in ensemble.probabilities().pairs(0.0):
+            self.assertTrue(second - first <= 8)
+
+    def test_temperature(self):
+        hot = Ensemble(self.sequence, temperature=95.0)
+        self.assertTrue(hot.probabilities().get(0, 11) <
+                        self.ensemble.probabilities().get(0, 11))
+
+    def test_long_sequence(self):
+        rand = random.Random(11)
+        sequence = ''.join(rand.choice('ACGU') for _ in xrange(1500))
+        ensemble = Ensemble(sequence, span=60)
+        self.assertTrue(np.isfinite(ensemble.log_partition))
+        self.assertTrue(ensemble.log_partition > 700)
+        self.assertTrue((ensemble.probabilities().paired() <= 1 + 1e-9).all())
+
+    def test_unpairable(self):
+        ensemble = Ensemble('AAAAAAAA')
+        self.assertEqual(ensemble.log_partition, 0.0)
+        self.assertEqual(len(ensemble.probabilities()), 0)
+        self.assertEqual(ensemble.sample(1)[0]._pairs, [None] * 8)
@@ -1,7 +1,9 @@
+import pickle
 import unittest
 
 from rnastructure.secondary.basic import Parser
 from rnastructure.secondary.basic import EmptyStructureError
+from rnastructure.secondary.dot_bracket import Parser as DotParser
 
 
 class BadInputTest(unittest.TestCase):
@@ -48,3 +50,17 @@ class MultiLoopTest(unittest.TestCase):
         val = self.indices['hairpin']
         ans = [tuple([[18, 19, 20]]), tuple([[8, 9, 10]])]
         self.assertEqual(val, ans)
+
+
+class PickleTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = DotParser('..((..((...))..))..')
+        self.parser.sequence = 'aaggaaggaaaccaaccaa'
+        self.copy = pickle.loads(pickle.dumps(self.parser, 2))
+
+    def test_keeps_pairs(self):
+        self.assertEqual(self.copy._pairs, self.parser._pairs)
+        self.assertEqual(self.copy.sequence, self.parser.sequence)
+
+    def test_rebuilds_loops(self):
+        self.assertEqual(self.copy.indices(), self.parser.indices())
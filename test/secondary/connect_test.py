@@ -1,3 +1,5 @@
+from __future__ import with_statement
+
 import unittest
 
 from StringIO import StringIO
@@ -5,6 +7,7 @@ from StringIO import StringIO
 from rnastructure.secondary import dot_bracket as DB
 
 from rnastructure.secondary.connect import Parser
+from rnastructure.secondary.connect import Reader
 from rnastructure.secondary.connect import Writer
 from rnastructure.secondary.connect import InvalidConnectLine
 
@@ -77,3 +80,37 @@ class ConnectWriterTest(unittest.TestCase):
         val = parser.indices()['hairpin']
         ans = [([2, 3],)]
         self.assertEqual(val, ans)
+
+
+class ConnectReaderTest(unittest.TestCase):
+    def setUp(self):
+        with open('files/simple_connect.ct', 'r') as raw:
+            self.structures = list(Reader(raw))
+
+    def test_reads_each_structure(self):
+        self.assertEqual(len(self.structures), 2)
+
+    def test_reads_names(self):
+        val = [name for name, _ in self.structures]
+        self.assertEqual(val, ['sequence', 'sequence'])
+
+    def test_includes_header(self):
+        val = [len(lines) for _, lines in self.structures]
+        self.assertEqual(val, [28, 28])
+
+    def test_structures_parse(self):
+        parser = Parser(self.structures[1][1])
+        self.assertEqual(len(parser), 27)
+
+    def test_reads_written_structures(self):
+        parser = DB.Parser('((..))')
+        parser.sequence = 'GGAACC'
+        parser.energy = -1.0
+        text = Writer().format(parser) * 2
+        val = [name for name, _ in Reader(StringIO(text))]
+        self.assertEqual(val, ['', ''])
+
+    def test_complains_without_header(self):
+        lines = ['1 G 0 2 0 1\n']
+        self.assertRaises(InvalidConnectLine, list, Reader(lines))
+
@@ -0,0 +1,102 @@
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+from rnastructure.secondary.dot_plot import PairProbabilities
+from rnastructure.secondary.dot_plot import NoProbabilitiesError
+
+
+class DotPlotTest(unittest.TestCase):
+    def setUp(self):
+        with open('files/dot.ps', 'r') as raw:
+            self.plot = PairProbabilities.from_postscript(raw)
+
+    def test_sequence(self):
+        self.assertEqual(self.plot.sequence, 'GGGGAAAACCCCAUUU')
+        self.assertEqual(self.plot.length, 16)
+
+    def test_only_upper_boxes(self):
+        self.assertEqual(len(self.plot), 7)
+
+    def test_sorted_zero_based(self):
+        self.assertEqual(self.plot.left.tolist(), [0, 0, 1, 1, 2, 3, 4])
+        self.assertEqual(self.plot.right.tolist(), [11, 15, 10, 14, 9, 8, 15])
+
+    def test_squares_probabilities(self):
+        self.assertAlmostEqual(self.plot.get(0, 11), 0.99, places=5)
+        self.assertAlmostEqual(self.plot.get(11, 0), 0.99, places=5)
+        self.assertAlmostEqual(self.plot.get(4, 15), 0.01, places=5)
+        self.assertEqual(self.plot.get(2, 3), 0.0)
+
+    def test_threshold(self):
+        with open('files/dot.ps', 'r') as raw:
+            plot = PairProbabilities.from_postscript(raw, threshold=0.5,
+                                                     chunk=2)
+        self.assertEqual(len(plot), 4)
+
+    def test_pairs(self):
+        val = [(left, right) for left, right, _ in self.plot.pairs(0.95)]
+        self.assertEqual(val, [(0, 11), (1, 10), (2, 9)])
+
+    def test_paired(self):
+        val = self.plot.paired()
+        self.assertAlmostEqual(val[0], 0.995, places=5)
+        self.assertAlmostEqual(val[15], 0.015, places=5)
+        self.assertEqual(val[6], 0.0)
+
+    def test_csr(self):
+        pointers, columns, values = self.plot.csr()
+        self.assertEqual(pointers.tolist(),
+                         [0, 2, 4, 5, 6, 7] + [7] * 11)
+        self.assertEqual(columns[pointers[1]:pointers[2]].tolist(), [10, 14])
+
+    def test_symmetric_csr_matches_dense(self):
+        pointers, columns, values = self.plot.csr(symmetric=True)
+        dense = self.plot.dense()
+        for row in xrange(self.plot.length):
+            found = np.zeros(self.plot.length)
+            found[columns[pointers[row]:pointers[row + 1]]] = \
+                values[pointers[row]:pointers[row + 1]]
+            self.assertTrue(np.allclose(found, dense[row]))
+
+    def test_mea(self):
+        val = self.plot.mea()
+        self.assertEqual(val._pairs[:4], [11, 10, 9, 8])
+        self.assertEqual(val._pairs[15], None)
+        self.assertEqual(val.sequence, 'GGGGAAAACCCCAUUU')
+
+    def test_mea_gamma(self):
+        val = self.plot.mea(gamma=0.001)
+        self.assertEqual(val._pairs, [None] * 16)
+
+    def test_no_probabilities(self):
+        stream = StringIO("%!PS-Adobe-3.0\n/sequence (\\\nGGG\\\n) def\n")
+        self.assertRaises(NoProbabilitiesError,
+                          PairProbabilities.from_postscript, stream)
+
+
+class AlignmentDotPlotTest(unittest.TestCase):
+    def setUp(self):
+        with open('files/alidot.ps', 'r') as raw:
+            self.plot = PairProbabilities.from_postscript(raw)
+
+    def test_sequence(self):
+        self.assertEqual(self.plot.sequence, 'GGGAAAUCC')
+
+    def test_skips_colours(self):
+        val = [(left, right) for left, right, _ in self.plot.pairs(0.5)]
+        self.assertEqual(val, [(0, 8), (1, 7)])
+        self.assertAlmostEqual(self.plot.get(0, 7), 0.02, places=5)
+
+
+class PairProbabilitiesTest(unittest.TestCase):
+    def test_rejects_bad_pairs(self):
+        self.assertRaises(ValueError, PairProbabilities, [3], [1], [0.5])
+        self.assertRaises(ValueError, PairProbabilities, [0], [5], [0.5],
+                          length=4)
+
+    def test_empty(self):
+        plot = PairProbabilities([], [], [], length=5)
+        self.assertEqual(plot.paired().tolist(), [0.0] * 5)
+        self.assertEqual(plot.mea()._pairs, [None] * 5)
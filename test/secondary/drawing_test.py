@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from rnastructure.secondary import drawing
+from rnastructure.secondary import dot_bracket as db
+
+
+def distances(coordinates, pairs):
+    return [np.hypot(*(coordinates[i] - coordinates[j]))
+            for i, j in enumerate(pairs) if j is not None and i < j]
+
+
+class NestedPairsTest(unittest.TestCase):
+    def test_keeps_nested(self):
+        pairs = db.Parser('((..))..')._pairs
+        self.assertEqual(drawing.nested_pairs(pairs), pairs)
+
+    def test_removes_crossing(self):
+        pairs = db.Parser('((..{{..))}}')._pairs
+        val = drawing.nested_pairs(pairs)
+        ans = db.Parser('((......))..')._pairs
+        self.assertEqual(val, ans)
+
+    def test_tree(self):
+        root = drawing.as_tree(db.Parser('((..))()')._pairs)
+        val = [child.value for child in root.children]
+        self.assertEqual(val, [(0, 5), (6, 7)])
+
+
+class RadialTest(unittest.TestCase):
+    def setUp(self):
+        self.structure = db.Parser('((((((...((((....))))..((((....))))...'
+                                   '))))))....')
+        self.structure.sequence = 'g' * len(self.structure)
+        self.drawing = drawing.Drawer()(self.structure, layout_type=0)
+
+    def test_interface(self):
+        self.assertEqual(len(self.drawing.locations), len(self.structure))
+        self.assertEqual(len(self.drawing.box), 4)
+        self.assertEqual(self.drawing._pairs, self.structure._pairs)
+
+    def test_backbone_spacing(self):
+        steps = np.diff(self.drawing.layout.coordinates, axis=0)
+        self.assertTrue(np.allclose(np.hypot(*steps.T), 15.0))
+
+    def test_pairs_spacing(self):
+        val = distances(self.drawing.layout.coordinates, self.structure._pairs)
+        self.assertTrue(np.allclose(val, 15.0))
+
+    def test_box_contains_drawing(self):
+        x0, y0, x1, y1 = self.drawing.layout.bounds()
+        box = self.drawing.box
+        self.assertTrue(box[0] <= x0 and box[1] <= y0)
+        self.assertTrue(box[2] >= x1 and box[3] >= y1)
+
+    def test_empty_hairpin(self):
+        for structure in ['()....', '(())..', '((..))()']:
+            val = drawing.Radial(db.Parser(structure)).layout.coordinates
+            self.assertEqual(len(val), len(structure))
+            steps = np.diff(val, axis=0)
+            self.assertTrue(np.allclose(np.hypot(*steps.T), 15.0))
+
+
+class LoopsTest(unittest.TestCase):
+    def setUp(self):
+        self.structure = db.Parser('..((((...((((....))))..((((....))))...'
+                                   '))))..((...))')
+        self.drawing = drawing.Drawer()(self.structure, layout_type=1)
+        self.coordinates = self.drawing.layout.coordinates
+
+    def test_backbone_spacing(self):
+        steps = np.diff(self.coordinates, axis=0)
+        self.assertTrue(np.allclose(np.hypot(*steps.T), 15.0))
+
+    def test_pairs_spacing(self):
+        val = distances(self.coordinates, self.structure._pairs)
+        self.assertTrue(np.allclose(val, drawing.Loops.pair))
+
+    def test_no_overlaps(self):
+        diff = self.coordinates[:, None] - self.coordinates[None]
+        near = np.hypot(diff[..., 0], diff[..., 1])
+        np.fill_diagonal(near, np.inf)
+        self.assertTrue(near.min() > 14.9)
+
+    def test_draws_knots_unpaired(self):
+        structure = db.Parser('((..{{..))}}')
+        val = drawing.Loops(structure).locations
+        self.assertEqual(len(val), 12)
+
+    def test_unknown_layout(self):
+        self.assertRaises(ValueError, drawing.Drawer(), self.structure, 3)
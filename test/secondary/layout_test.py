@@ -0,0 +1,96 @@
+from __future__ import with_statement
+
+import unittest
+
+import numpy as np
+
+from rnastructure.secondary import layout
+from rnastructure.secondary import rnaplot as rp
+
+
+class LayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.layout = layout.Layout([(0.0, 0.0), (10.0, 0.0), (10.0, 20.0)])
+
+    def test_stores_array(self):
+        val = self.layout.coordinates.shape
+        self.assertEqual(val, (3, 2))
+
+    def test_locations(self):
+        val = self.layout.locations()
+        ans = [(0.0, 0.0), (10.0, 0.0), (10.0, 20.0)]
+        self.assertEqual(val, ans)
+
+    def test_bounds(self):
+        self.assertEqual(self.layout.bounds(), (0.0, 0.0, 10.0, 20.0))
+
+    def test_translate(self):
+        val = self.layout.translate(1, 2).locations()[0]
+        self.assertEqual(val, (1.0, 2.0))
+
+    def test_scale(self):
+        val = self.layout.scale(2, origin=(0, 0)).locations()[2]
+        self.assertEqual(val, (20.0, 40.0))
+
+    def test_rotate(self):
+        val = self.layout.rotate(90, origin=(0, 0)).coordinates[1]
+        self.assertTrue(np.allclose(val, [0.0, 10.0]))
+
+    def test_scale_around_array(self):
+        val = self.layout.scale(2, origin=np.zeros(2)).locations()[2]
+        self.assertEqual(val, (20.0, 40.0))
+
+    def test_rotate_around_array(self):
+        val = self.layout.rotate(90, origin=np.zeros(2)).coordinates[1]
+        self.assertTrue(np.allclose(val, [0.0, 10.0]))
+
+    def test_fit(self):
+        val = self.layout.fit((0, 0, 100, 100)).bounds()
+        ans = (25.0, 0.0, 75.0, 100.0)
+        self.assertTrue(np.allclose(val, ans))
+
+    def test_transforms_do_not_modify(self):
+        self.layout.scale(3)
+        self.assertEqual(self.layout.locations()[1], (10.0, 0.0))
+
+    def test_empty(self):
+        self.assertRaises(layout.EmptyLayoutError, layout.Layout, [])
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        state = np.random.RandomState(1)
+        self.points = state.uniform(-500, 500, size=(3000, 2))
+        self.layout = layout.Layout(self.points)
+
+    def test_nearest(self):
+        for x, y in [(0, 0), (123.4, -321.0), (499, 499), (-900, 10)]:
+            distances = np.hypot(*(self.points - [x, y]).T)
+            self.assertEqual(self.layout.nearest(x, y), np.argmin(distances))
+
+    def test_nearest_radius(self):
+        self.assertEqual(self.layout.nearest(5000, 5000, radius=10), None)
+
+    def test_within(self):
+        val = self.layout.within(100, 100, -50, -20)
+        inside = (self.points[:, 0] >= -50) & (self.points[:, 0] <= 100) & \
+            (self.points[:, 1] >= -20) & (self.points[:, 1] <= 100)
+        ans = np.flatnonzero(inside)
+        self.assertEqual(val.tolist(), ans.tolist())
+
+    def test_within_outside(self):
+        self.assertEqual(len(self.layout.within(600, 600, 700, 700)), 0)
+
+
+class ParserLayoutTest(unittest.TestCase):
+    def setUp(self):
+        with open('files/alirna.ps', 'r') as raw:
+            self.parser = rp.PostScriptParser(raw)
+
+    def test_has_layout(self):
+        val = self.parser.layout.coordinates.shape
+        self.assertEqual(val, (74, 2))
+
+    def test_nearest_nucleotide(self):
+        val = self.parser.layout.nearest(110.0, 226.0)
+        self.assertEqual(val, 0)
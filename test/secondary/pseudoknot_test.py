@@ -1,6 +1,8 @@
 import unittest
 
+from rnastructure.secondary import pseudoknot
 from rnastructure.secondary.pseudoknot import RemovePseudoknots
+from rnastructure.util.wrapper import InvalidInputError
 from rnastructure.secondary.dot_bracket import Parser as DotParser
 
 
@@ -17,3 +19,88 @@ class SimpleRemoveTest(unittest.TestCase):
         ans = ans_parser._pairs
         val = self.parsed._pairs
         self.assertEqual(val, ans)
+
+
+class CrossingTest(unittest.TestCase):
+    def test_finds_crossing_pairs(self):
+        pairs = DotParser('((..{{..))}}..()')._pairs
+        left, right, crosses = pseudoknot.crossing(pairs)
+        self.assertEqual(left.tolist(), [0, 1, 4, 5, 14])
+        self.assertEqual(crosses.tolist(), [True, True, True, True, False])
+
+    def test_nested_structure(self):
+        pairs = DotParser('((..))..')._pairs
+        self.assertFalse(pseudoknot.crossing(pairs)[2].any())
+
+
+class NestedSubsetTest(unittest.TestCase):
+    def test_prefers_heavier_pairs(self):
+        val = pseudoknot.nested_subset([0, 1, 2], [4, 5, 3], [1, 3, 1])
+        self.assertEqual(val.tolist(), [False, True, True])
+
+    def test_ties_keep_leftmost(self):
+        val = pseudoknot.nested_subset([0, 2], [3, 5], [1, 1])
+        self.assertEqual(val.tolist(), [True, False])
+
+    def test_empty(self):
+        self.assertEqual(len(pseudoknot.nested_subset([], [], [])), 0)
+
+
+class MaximumNestedSubsetTest(unittest.TestCase):
+    def setUp(self):
+        self.raw = DotParser('((..{{..))}}')
+        self.raw.sequence = 'ggaaccttccgg'
+
+    def test_simple_removal(self):
+        val = pseudoknot.MaximumNestedSubset()(self.raw)._pairs
+        ans = DotParser('((......))..')._pairs
+        self.assertEqual(val, ans)
+
+    def test_keeps_largest(self):
+        raw = DotParser('(((..[[..)))..]]')
+        val = pseudoknot.MaximumNestedSubset()(raw)._pairs
+        ans = DotParser('(((......)))....')._pairs
+        self.assertEqual(val, ans)
+
+    def test_stem_weights(self):
+        raw = DotParser('((.[[[..)).]]]')
+        val = pseudoknot.MaximumNestedSubset('stems')(raw)._pairs
+        ans = DotParser('...(((.....)))')._pairs
+        self.assertEqual(val, ans)
+
+    def test_energy_weights(self):
+        raw = DotParser('((.[[..))..]]')
+        raw.sequence = 'aaaggaauuaacc'
+        val = pseudoknot.MaximumNestedSubset('energy')(raw)._pairs
+        ans = DotParser('...((......))')._pairs
+        self.assertEqual(val, ans)
+
+    def test_keeps_sequence(self):
+        val = pseudoknot.MaximumNestedSubset()(self.raw).sequence
+        self.assertEqual(val, 'ggaaccttccgg')
+
+    def test_nested_unchanged(self):
+        raw = DotParser('((..))..')
+        val = pseudoknot.MaximumNestedSubset()(raw)._pairs
+        self.assertEqual(val, raw._pairs)
+
+    def test_unknown_weight(self):
+        self.assertRaises(ValueError, pseudoknot.MaximumNestedSubset, 'bad')
+
+
+class MapTest(unittest.TestCase):
+    def setUp(self):
+        self.remover = RemovePseudoknots()
+
+    def test_failures_in_place(self):
+        val = self.remover.map(['bad', 'input'], max_workers=2)
+        self.assertEqual(len(val), 2)
+        for result in val:
+            self.assertTrue(isinstance(result, InvalidInputError))
+
+    def test_inline(self):
+        val = self.remover.map(['bad'])
+        self.assertTrue(isinstance(val[0], InvalidInputError))
+
+    def test_empty(self):
+        self.assertEqual(self.remover.map([], max_workers=4), [])
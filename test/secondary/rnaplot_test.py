@@ -1,9 +1,14 @@
 from __future__ import with_statement
 
+import os
+import shutil
+import tempfile
 import unittest
+from StringIO import StringIO
 
 from rnastructure.secondary import dot_bracket
 from rnastructure.secondary import rnaplot as rp
+from rnastructure.util import wrapper
 
 
 class PostScriptParserTest(unittest.TestCase):
@@ -75,3 +80,155 @@ class WrapperTest(unittest.TestCase):
     #     val = self.plotter(self.data, output_format='ps').locations[0:2]
     #     ans = None
     #     self.assertEquals(ans, val)
+
+
+class BatchInputTest(unittest.TestCase):
+    def setUp(self):
+        self.plotter = rp.RNAplot()
+        self.data = dot_bracket.Parser("((....))")
+        self.data.sequence = "ccaaaagg"
+
+    def test_named_record(self):
+        val = self.plotter.record(self.data, name='structure-0')
+        ans = ">structure-0\nccaaaagg\n((....))\n"
+        self.assertEqual(val, ans)
+
+    def test_program_options(self):
+        options = {'layout_type': 1, 'output_format': 'svg'}
+        val = self.plotter.generate_program_arguments(None, options)
+        ans = ['-t', '1', '--output-format=svg']
+        self.assertEqual(val, ans)
+
+    def test_rejects_invalid_structures(self):
+        missing = dot_bracket.Parser("((....))")
+        self.assertRaises(wrapper.InvalidInputError, self.plotter.batch,
+                          [self.data, missing])
+
+    def test_rejects_unparsable_formats(self):
+        self.assertRaises(rp.UnimplementedParser, self.plotter.batch,
+                          [self.data], output_format='gml')
+
+
+DRAW = """
+while read line; do
+    case "$line" in
+        '>'*) name=${line#>}; echo "$line" ;;
+        *) if [ -z "$sequence" ]; then sequence=$line; else
+               cp %s "${name}_ss.ps"; sequence=''; fi ;;
+    esac
+done
+"""
+
+
+class ShellPlotter(rp.RNAplot):
+    program = 'sh'
+
+    def __init__(self, script):
+        super(ShellPlotter, self).__init__(time=10)
+        self.script = script
+
+    def generate_program_arguments(self, filename, options):
+        return ['-c', self.script]
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.data = dot_bracket.Parser("((....))")
+        self.data.sequence = "ccaaaagg"
+        self.drawing = os.path.abspath('files/alirna.ps')
+
+    def test_draws_each_structure(self):
+        plotter = ShellPlotter(DRAW % self.drawing)
+        val = list(plotter.batch([self.data] * 3))
+        self.assertEqual(len(val), 3)
+        for drawing in val:
+            self.assertTrue(isinstance(drawing, rp.PostScriptParser))
+
+    def test_missing_drawing(self):
+        plotter = ShellPlotter('cat > /dev/null')
+        batch = plotter.batch([self.data])
+        self.assertRaises(wrapper.ProgramFailedError, list, batch)
+
+
+class BinaryFormatTest(unittest.TestCase):
+    def setUp(self):
+        with open('files/alirna.ps', 'r') as raw:
+            self.parser = rp.PostScriptParser(raw)
+        data = rp.BinaryWriter().format(self.parser)
+        self.loaded = rp.BinaryParser(StringIO(data))
+
+    def test_roundtrip(self):
+        self.assertEqual(self.loaded.sequence, self.parser.sequence)
+        self.assertEqual(self.loaded._pairs, self.parser._pairs)
+        self.assertEqual(self.loaded.locations, self.parser.locations)
+        self.assertEqual(self.loaded.box, self.parser.box)
+
+
+class CountingPlotter(object):
+    program = 'RNAplot'
+
+    def __init__(self):
+        self.drawn = 0
+        self.release = '2.0'
+
+    def version(self):
+        return self.release
+
+    def __call__(self, secondary, **kwargs):
+        self.drawn += 1
+        with open('files/alirna.ps', 'r') as raw:
+            return rp.PostScriptParser(raw)
+
+    def batch(self, structures, **kwargs):
+        for structure in structures:
+            yield self(structure, **kwargs)
+
+
+class LayoutCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.plotter = CountingPlotter()
+        self.cache = rp.LayoutCache(plotter=self.plotter,
+                                    directory=self.directory)
+        self.data = dot_bracket.Parser("((....))")
+        self.data.sequence = "ccaaaagg"
+        self.other = dot_bracket.Parser("((...))")
+        self.other.sequence = "ccaaagg"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_repeats_are_cached(self):
+        first = self.cache(self.data, layout_type=1)
+        second = self.cache(self.data, layout_type=1)
+        self.assertEqual(self.plotter.drawn, 1)
+        self.assertEqual(first.locations, second.locations)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_options_are_part_of_key(self):
+        self.cache(self.data, layout_type=1)
+        self.cache(self.data, layout_type=0)
+        self.assertEqual(self.plotter.drawn, 2)
+
+    def test_version_is_part_of_key(self):
+        self.cache(self.data)
+        self.plotter.release = '2.1'
+        self.cache(self.data)
+        self.assertEqual(self.plotter.drawn, 2)
+
+    def test_default_format_is_postscript(self):
+        self.cache(self.data)
+        self.cache(self.data, output_format='ps')
+        self.assertEqual(self.plotter.drawn, 1)
+
+    def test_batch_only_draws_missing(self):
+        self.cache(self.data)
+        val = list(self.cache.batch([self.data, self.other, self.data]))
+        self.assertEqual(len(val), 3)
+        self.assertEqual(self.plotter.drawn, 2)
+
+    def test_shared_between_instances(self):
+        self.cache(self.data)
+        other = rp.LayoutCache(plotter=self.plotter, directory=self.directory)
+        other(self.data)
+        self.assertEqual(self.plotter.drawn, 1)
@@ -6,6 +6,11 @@ from rnastructure.tertiary.cif import CIF
 # from rnastructure.tertiary.cif import Chain
 from rnastructure.tertiary.cif import MissingColumn
 from rnastructure.tertiary.cif import MissingBlockException
+from rnastructure.util.workqueue import CifJob
+
+
+def cif_name(cif):
+    return cif.name
 
 
 class SimpleCIFTest(unittest.TestCase):
@@ -312,6 +317,11 @@ class CifPolymersTest(unittest.TestCase):
         self.assertEqual(val, ans)
 
 
+class CifJobTest(unittest.TestCase):
+    def test_runs_function_on_parsed_file(self):
+        self.assertEqual(CifJob(cif_name)('files/1FAT.cif'), '1FAT')
+
+
 # class SimpleResidueTest(unittest.TestCase):
 #     @classmethod
 #     def setUpClass(cls):
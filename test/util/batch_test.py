@@ -0,0 +1,137 @@
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from rnastructure.util import batch
+from test.util import stubs
+
+
+class Cat(stubs.Cat):
+    """Counts the calls made to it."""
+
+    def __init__(self):
+        super(Cat, self).__init__()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, raw, options=None):
+        with self.lock:
+            self.calls += 1
+        return super(Cat, self).__call__(raw, options)
+
+
+class Lazy(object):
+    """A result which only reads its file when pickled."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __getstate__(self):
+        with open(self.filename, 'r') as raw:
+            return {'value': raw.read()}
+
+    def __setstate__(self, state):
+        self.value = state['value']
+
+
+class Files(stubs.Cat):
+    def results(self, process, temp_dir, filename):
+        return Lazy(os.path.join(temp_dir, filename))
+
+
+def named(count, prefix='input'):
+    return [('name-%s' % index, '%s-%s' % (prefix, index))
+            for index in xrange(count)]
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cat = Cat()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def batch(self, **kwargs):
+        return batch.Batch(self.cat, self.directory, workers=3, **kwargs)
+
+    def test_runs_all(self):
+        progress = self.batch().run(named(20))
+        self.assertEqual(progress.done, 20)
+        self.assertEqual(dict(self.batch().results()), dict(named(20)))
+
+    def test_reads_generators(self):
+        self.batch().run(iter(named(5)))
+        self.assertEqual(len(list(self.batch().results())), 5)
+
+    def test_shards(self):
+        self.batch(shard_size=4).run(named(10))
+        self.assertEqual(self.batch().shards(), [0, 1, 2])
+
+    def test_resumes(self):
+        self.batch().run(named(10))
+        progress = self.batch().run(named(15))
+        self.assertEqual(self.cat.calls, 15)
+        self.assertEqual(progress.skipped, 10)
+        self.assertEqual(progress.done, 5)
+        self.assertEqual(dict(self.batch().results()), dict(named(15)))
+
+    def test_reruns_changed_input(self):
+        self.batch().run(named(3))
+        self.batch().run(named(3, prefix='changed'))
+        self.assertEqual(self.cat.calls, 6)
+        self.assertEqual(dict(self.batch().results()),
+                         dict(named(3, prefix='changed')))
+
+    def test_records_failures(self):
+        progress = self.batch().run([('a', 'good'), ('b', 'bad')])
+        self.assertEqual((progress.done, progress.failed), (1, 1))
+        self.assertEqual(self.batch().failures(), ['b'])
+        self.assertEqual(list(self.batch().results()), [('a', 'good')])
+
+        self.batch().run([('a', 'good'), ('b', 'bad')])
+        self.assertEqual(self.cat.calls, 2)
+        self.batch(retry_failed=True).run([('a', 'good'), ('b', 'bad')])
+        self.assertEqual(self.cat.calls, 3)
+
+    def test_escapes_names(self):
+        self.batch().run([('a\tb\nc', 'x')])
+        self.assertEqual(list(self.batch().results()), [('a\tb\nc', 'x')])
+
+    def test_ignores_partial_journal_line(self):
+        self.batch().run(named(3))
+        with open(os.path.join(self.directory, 'journal'), 'ab') as out:
+            out.write('name-5\tabc')
+        self.assertEqual(len(self.batch().entries()), 3)
+        self.batch().run(named(6))
+        self.assertEqual(dict(self.batch().results()), dict(named(6)))
+
+    def test_ignores_partial_shard(self):
+        self.batch().run(named(3))
+        shard = os.path.join(self.directory, 'shard-00000.pickle')
+        with open(shard, 'ab') as out:
+            out.write('\x80\x02(U')
+        self.assertEqual(dict(self.batch().results()), dict(named(3)))
+
+    def test_reports(self):
+        reports = []
+        self.batch().run(named(5), report=reports.append, interval=0)
+        self.assertEqual(reports[-1].done, 5)
+        self.assertTrue(reports[-1].rate() > 0)
+
+    def test_results_read_from_their_directory(self):
+        base = tempfile.mkdtemp()
+        try:
+            files = Files(directory=base)
+            progress = batch.Batch(files, self.directory, workers=3).run(
+                named(6))
+            self.assertEqual(progress.failed, 0)
+            val = dict((name, result.value) for name, result in
+                       self.batch().results())
+            self.assertEqual(val, dict(named(6)))
+        finally:
+            shutil.rmtree(base)
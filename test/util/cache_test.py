@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rnastructure.util import cache
+from rnastructure.util import wrapper
+from rnastructure.secondary.dot_bracket import Parser as DotParser
+
+
+class DigestTest(unittest.TestCase):
+    def test_is_stable(self):
+        self.assertEqual(cache.digest('a', 'b'), cache.digest('a', 'b'))
+
+    def test_separates_parts(self):
+        self.assertNotEqual(cache.digest('ab', 'c'), cache.digest('a', 'bc'))
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.DiskCache(self.directory, max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing(self):
+        self.assertEqual(self.cache.get(cache.digest('missing')), None)
+
+    def test_roundtrip(self):
+        key = cache.digest('a')
+        self.cache.put(key, 'data')
+        self.assertEqual(self.cache.get(key), 'data')
+        self.assertTrue(key in self.cache)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 1000
+        keys = [cache.digest(str(index)) for index in range(3)]
+        for index, key in enumerate(keys):
+            self.cache.put(key, 'x' * 40)
+            os.utime(self.cache.path(key), (index, index))
+        self.cache.get(keys[0])
+        self.cache.max_size = 100
+        self.cache.evict()
+        val = [key in self.cache for key in keys]
+        self.assertEqual(val, [True, False, True])
+        self.assertTrue(self.cache.size() <= 100)
+
+    def test_discard(self):
+        key = cache.digest('a')
+        self.cache.put(key, 'data')
+        self.cache.discard(key)
+        self.assertFalse(key in self.cache)
+
+
+class LRUTest(unittest.TestCase):
+    def setUp(self):
+        self.lru = cache.LRU(2)
+
+    def test_get(self):
+        self.lru.put('a', 1)
+        self.assertEqual(self.lru.get('a'), 1)
+        self.assertEqual(self.lru.get('b', 'missing'), 'missing')
+
+    def test_forgets_least_recently_used(self):
+        self.lru.put('a', 1)
+        self.lru.put('b', 2)
+        self.lru.get('a')
+        self.lru.put('c', 3)
+        self.assertTrue('a' in self.lru)
+        self.assertFalse('b' in self.lru)
+        self.assertEqual(len(self.lru), 2)
+
+    def test_zero_size_keeps_nothing(self):
+        lru = cache.LRU(0)
+        lru.put('a', 1)
+        self.assertEqual(len(lru), 0)
+
+    def test_discard(self):
+        self.lru.put('a', 1)
+        self.lru.discard('a')
+        self.lru.discard('b')
+        self.assertEqual(len(self.lru), 0)
+
+
+class Count(wrapper.Wrapper):
+    program = 'wc'
+    options = {'c': wrapper.is_true}
+
+    def __init__(self):
+        super(Count, self).__init__('input.txt', time=10)
+        self.runs = 0
+
+    def input_file(self, input_file, raw):
+        input_file.write(raw)
+
+    def generate_options(self, filename, options):
+        return ['-%s' % key for key in options]
+
+    def results(self, process, temp_dir, filename):
+        self.runs += 1
+        return int(process.stdout.read().split()[0])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.ResultCache(self.directory, memory_size=2)
+        self.wrapper = Count()
+        self.wrapper.cache = self.cache
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_skips_program(self):
+        first = self.wrapper('a b c')
+        second = self.wrapper('a b c')
+        self.assertEqual((first, second), (0, 0))
+        self.assertEqual(self.wrapper.runs, 1)
+        self.assertEqual(self.cache.stats()['memory_hits'], 1)
+
+    def test_options_in_key(self):
+        self.wrapper('a b c')
+        self.assertEqual(self.wrapper('a b c', {'c': True}), 5)
+        self.assertEqual(self.wrapper.runs, 2)
+
+    def test_disk_tier(self):
+        self.wrapper('a')
+        other = Count()
+        other.cache = cache.ResultCache(self.directory)
+        other('a')
+        self.assertEqual(other.runs, 0)
+        self.assertEqual(other.cache.stats()['disk_hits'], 1)
+
+    def test_memory_is_bounded(self):
+        for raw in ['a', 'b', 'c']:
+            self.wrapper(raw)
+        self.assertEqual(len(self.cache._memory), 2)
+
+    def test_stats(self):
+        self.wrapper('a')
+        self.wrapper('a')
+        val = self.cache.stats()
+        self.assertEqual(val['misses'], 1)
+        self.assertEqual(val['stores'], 1)
+        self.assertEqual(val['hit_ratio'], 0.5)
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_strings(self):
+        self.assertEqual(cache.normalize(' acgu\n'), 'acgu')
+
+    def test_lists(self):
+        self.assertEqual(cache.normalize(['ac', 'gu']), '[ac\ngu]')
+
+    def test_structures(self):
+        structure = DotParser('(.)')
+        structure.sequence = 'gac'
+        self.assertEqual(cache.normalize(structure), 'gac|2,-,0')
@@ -0,0 +1,82 @@
+import unittest
+
+from rnastructure.util import metrics
+from rnastructure.util import wrapper
+from test.util.stubs import Cat
+from test.util.stubs import Sleep
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        metrics.add_hook(self.records.append)
+
+    def tearDown(self):
+        metrics.remove_hook(self.records.append)
+
+    def test_phases(self):
+        Cat()('some input')
+        record = self.records[-1]
+        self.assertEqual(record.status, 'ok')
+        self.assertEqual(record.returncode, 0)
+        self.assertEqual(sorted(record.phases), sorted(metrics.PHASES))
+        self.assertTrue(all(value >= 0 for value in record.phases.values()))
+
+    def test_bytes(self):
+        Cat()('some input')
+        record = self.records[-1]
+        self.assertEqual((record.bytes_in, record.bytes_out), (10, 10))
+
+    def test_invalid(self):
+        self.assertRaises(wrapper.InvalidInputError, Cat(), 'bad')
+        record = self.records[-1]
+        self.assertEqual(record.status, 'invalid')
+        self.assertEqual(record.phases.keys(), ['validate'])
+
+    def test_timeout(self):
+        self.assertRaises(wrapper.ProgramTimeOutError, Sleep(time=0.1), '')
+        self.assertEqual(self.records[-1].status, 'timeout')
+        self.assertTrue(self.records[-1].phases['run'] >= 0.1)
+
+    def test_finish_once(self):
+        record = metrics.CallRecord('test')
+        record.finish('ok')
+        record.finish('failed')
+        self.assertEqual(self.records, [record])
+
+    def test_hook_errors_ignored(self):
+        def broken(record):
+            raise ValueError("broken")
+        metrics.add_hook(broken)
+        try:
+            self.assertEqual(Cat()('a'), 'a')
+        finally:
+            metrics.remove_hook(broken)
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = metrics.Stats(samples=100)
+        for index in xrange(200):
+            record = metrics.CallRecord('prog')
+            record.phases = {'run': float(index), 'results': 1.0}
+            record.status = 'ok' if index % 4 else 'failed'
+            record.bytes_out = 2
+            self.stats(record)
+        self.snapshot = self.stats.snapshot()['prog']
+
+    def test_counts(self):
+        self.assertEqual(self.snapshot['count'], 200)
+        self.assertEqual(self.snapshot['statuses'], {'ok': 150, 'failed': 50})
+        self.assertEqual(self.snapshot['bytes_out'], 400)
+
+    def test_percentiles_use_recent(self):
+        run = self.snapshot['timings']['run']
+        self.assertEqual(run['p50'], 150.0)
+        self.assertEqual(run['p95'], 194.0)
+        self.assertEqual(run['p99'], 198.0)
+        self.assertEqual(self.snapshot['timings']['total']['p50'], 151.0)
+
+    def test_default_stats(self):
+        Cat()('a')
+        self.assertTrue(metrics.stats.snapshot()['cat']['count'] >= 1)
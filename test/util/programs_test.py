@@ -0,0 +1,136 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from rnastructure.util import wrapper
+from rnastructure.util import programs
+from rnastructure.util import workspace
+
+SCRIPT = '''#!/bin/sh
+echo probed >> "%s"
+echo "Fake %s"
+echo "extra line"
+'''
+
+
+class Missing(wrapper.Wrapper):
+    program = 'rnastructure-missing-program'
+
+    def __init__(self, pool):
+        super(Missing, self).__init__('input.txt')
+        self.workspaces = pool
+
+    def input_file(self, input_file, raw):
+        input_file.write(raw)
+
+    def results(self, process, temp_dir, filename):
+        return process.stdout.read()
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.bin = os.path.join(self.base, 'bin')
+        os.mkdir(self.bin)
+        self.log = os.path.join(self.base, 'log')
+        self.program = self.__write__('fake', '1.0')
+        self.path = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.bin + os.pathsep + self.path
+        self.registry = programs.Registry(os.path.join(self.base, 'cache'))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.base)
+
+    def __write__(self, name, version):
+        filename = os.path.join(self.bin, name)
+        with open(filename, 'w') as out:
+            out.write(SCRIPT % (self.log, version))
+        os.chmod(filename, 0755)
+        return filename
+
+    def probes(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log, 'r') as raw:
+            return len(raw.readlines())
+
+    def test_resolves_on_path(self):
+        self.assertEqual(self.registry.resolve('fake'), self.program)
+
+    def test_resolves_path(self):
+        self.assertEqual(self.registry.resolve(self.program), self.program)
+
+    def test_missing_program(self):
+        self.assertRaises(programs.ProgramNotFoundError,
+                          self.registry.resolve, 'rnastructure-missing')
+
+    def test_missing_is_os_error(self):
+        self.assertTrue(issubclass(programs.ProgramNotFoundError, OSError))
+
+    def test_not_executable(self):
+        os.chmod(self.program, 0644)
+        self.assertRaises(programs.ProgramNotFoundError,
+                          self.registry.resolve, 'fake')
+
+    def test_follows_path_changes(self):
+        self.registry.resolve('fake')
+        os.environ['PATH'] = self.path
+        self.assertRaises(programs.ProgramNotFoundError,
+                          self.registry.resolve, 'fake')
+
+    def test_version(self):
+        self.assertEqual(self.registry.version('fake'), 'Fake 1.0')
+
+    def test_probes_once(self):
+        self.registry.version('fake')
+        self.registry.version('fake')
+        self.assertEqual(self.probes(), 1)
+
+    def test_version_stored_on_disk(self):
+        self.registry.version('fake')
+        other = programs.Registry(os.path.join(self.base, 'cache'))
+        self.assertEqual(other.version('fake'), 'Fake 1.0')
+        self.assertEqual(self.probes(), 1)
+
+    def test_probes_changed_program(self):
+        self.registry.version('fake')
+        self.__write__('fake', '2.0')
+        stat = os.stat(self.program)
+        os.utime(self.program, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(self.registry.version('fake'), 'Fake 2.0')
+        self.assertEqual(self.probes(), 2)
+
+    def test_unknown_version(self):
+        quiet = os.path.join(self.bin, 'quiet')
+        with open(quiet, 'w') as out:
+            out.write('#!/bin/sh\n')
+        os.chmod(quiet, 0755)
+        self.assertEqual(self.registry.version('quiet'), 'unknown')
+
+    def test_probe_times_out(self):
+        slow = os.path.join(self.bin, 'slow')
+        with open(slow, 'w') as out:
+            out.write('#!/bin/sh\nexec sleep 30\n')
+        os.chmod(slow, 0755)
+        self.registry.timeout = 0.2
+        start = time.time()
+        self.assertEqual(self.registry.version('slow'), 'unknown')
+        self.assertTrue(time.time() - start < 5)
+
+
+class WrapperTest(unittest.TestCase):
+    def test_fails_before_writing(self):
+        pool = workspace.WorkspacePool()
+        try:
+            self.assertRaises(programs.ProgramNotFoundError, Missing(pool),
+                              'a')
+            self.assertEqual(pool.in_use(), 0)
+            self.assertEqual(os.listdir(pool.root), [])
+        finally:
+            pool.close()
+
+    def test_unknown_version(self):
+        self.assertEqual(Missing(None).version(), 'unknown')
@@ -0,0 +1,141 @@
+from __future__ import with_statement
+
+import threading
+import unittest
+
+from rnastructure.util import wrapper
+from rnastructure.util import scheduler
+from test.util.stubs import Shell
+from test.util.stubs import Sleep
+
+
+class Tracked(object):
+    """Records how many calls of a wrapper run at once."""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self.program = wrapped.program
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+        self.order = []
+
+    def __call__(self, raw, options=None):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+            self.order.append(raw)
+        try:
+            return self.wrapped(raw, options)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class PriorityTest(unittest.TestCase):
+    def test_runs_higher_priority_first(self):
+        blocker = Shell('sleep 0.3')
+        tracked = Tracked(Shell('cat "$1"'))
+        sched = scheduler.Scheduler(workers=1)
+        first = sched.submit(blocker, 'x')
+        jobs = [sched.submit(tracked, str(priority), priority=priority)
+                for priority in [1, 5, 3]]
+        sched.shutdown()
+        self.assertEqual(first.result(), '')
+        self.assertEqual(tracked.order, ['5', '3', '1'])
+        self.assertEqual([job.result() for job in jobs], ['1', '5', '3'])
+
+    def test_equal_priority_in_order(self):
+        tracked = Tracked(Shell('cat "$1"'))
+        sched = scheduler.Scheduler(workers=1)
+        for index in xrange(5):
+            sched.submit(tracked, str(index))
+        sched.shutdown()
+        self.assertEqual(tracked.order, ['0', '1', '2', '3', '4'])
+
+
+class CapTest(unittest.TestCase):
+    def test_caps_program(self):
+        tracked = Tracked(Sleep('0.1'))
+        sched = scheduler.Scheduler(workers=4, caps={'sleep': 2})
+        results = sched.map(tracked, ['a'] * 6)
+        sched.shutdown()
+        self.assertEqual(results, [''] * 6)
+        self.assertEqual(tracked.most, 2)
+
+    def test_capped_program_does_not_block_others(self):
+        slow = Tracked(Sleep('0.3'))
+        fast = Tracked(Shell('cat "$1"'))
+        sched = scheduler.Scheduler(workers=2, caps={'sleep': 1})
+        slow_jobs = [sched.submit(slow, 'a', priority=5) for _ in xrange(2)]
+        fast_job = sched.submit(fast, 'b')
+        self.assertEqual(fast_job.result(), 'b')
+        self.assertFalse(slow_jobs[1].done())
+        sched.shutdown()
+
+    def test_large_inputs_share_slots(self):
+        tracked = Tracked(Sleep('0.1'))
+        sched = scheduler.Scheduler(workers=4, large=10, large_slots=1)
+        sched.map(tracked, ['a' * 20] * 3)
+        sched.shutdown()
+        self.assertEqual(tracked.most, 1)
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_rejects_long_input(self):
+        sched = scheduler.Scheduler(workers=1)
+        self.assertRaises(wrapper.InvalidInputError, sched.submit,
+                          Shell('cat "$1"', length=5), 'a' * 6)
+        self.assertEqual(sched.pending(), 0)
+        sched.shutdown()
+
+    def test_map_returns_rejection(self):
+        sched = scheduler.Scheduler(workers=1)
+        results = sched.map(Shell('cat "$1"', length=5), ['aaa', 'a' * 6])
+        sched.shutdown()
+        self.assertEqual(results[0], 'aaa')
+        self.assertTrue(isinstance(results[1], wrapper.InvalidInputError))
+
+    def test_rejects_after_shutdown(self):
+        sched = scheduler.Scheduler(workers=1)
+        sched.shutdown()
+        self.assertRaises(scheduler.SchedulerClosedError, sched.submit,
+                          Shell('true'), 'a')
+
+
+class LimitTest(unittest.TestCase):
+    def test_cpu_limit_kills_program(self):
+        sched = scheduler.Scheduler(workers=1, cpu=1)
+        job = sched.submit(Shell('while :; do :; done'), 'a')
+        sched.shutdown()
+        self.assertRaises(wrapper.ProgramFailedError, job.result)
+
+    def test_limits_do_not_change_wrapper(self):
+        shell = Shell('ulimit -t')
+        sched = scheduler.Scheduler(workers=1, cpu=7)
+        job = sched.submit(shell, 'a')
+        sched.shutdown()
+        self.assertEqual(job.result(), '7\n')
+        self.assertEqual(shell.rlimits, None)
+
+    def test_memory_limit(self):
+        sched = scheduler.Scheduler(workers=1, memory=512 * 1024 * 1024)
+        job = sched.submit(Shell('ulimit -v'), 'a')
+        sched.shutdown()
+        self.assertEqual(job.result(), '%s\n' % (512 * 1024))
+
+
+class StatsTest(unittest.TestCase):
+    def test_separates_queue_wait_and_run_time(self):
+        sched = scheduler.Scheduler(workers=1)
+        jobs = [sched.submit(Shell('sleep 0.1'), 'a') for _ in xrange(3)]
+        sched.shutdown()
+        self.assertTrue(jobs[0].queue_wait < 0.1)
+        self.assertTrue(jobs[2].queue_wait >= 0.2)
+        for job in jobs:
+            self.assertTrue(job.run_time >= 0.1)
+
+        stats = sched.stats()['sh']
+        self.assertEqual(stats['count'], 3)
+        self.assertTrue(stats['run_time']['p50'] >= 0.1)
+        self.assertTrue(stats['queue_wait']['p95'] >= 0.2)
@@ -0,0 +1,49 @@
+"""Small wrappers of standard programs shared by the tests of util."""
+
+from rnastructure.util import wrapper
+
+
+class Cat(wrapper.Wrapper):
+    """Returns its input, which is invalid if it is 'bad'."""
+
+    program = 'cat'
+
+    def __init__(self, directory=None, time=10):
+        super(Cat, self).__init__('input.txt', directory=directory, time=time)
+
+    def validate_input(self, raw):
+        return raw != 'bad'
+
+    def input_file(self, input_file, raw):
+        input_file.write(raw)
+
+    def results(self, process, temp_dir, filename):
+        return process.stdout.read()
+
+
+class Sleep(Cat):
+    """Sleeps for a number of seconds and returns nothing."""
+
+    program = 'sleep'
+
+    def __init__(self, seconds='5', time=10):
+        super(Sleep, self).__init__(time=time)
+        self.seconds = seconds
+
+    def generate_arguments(self, filename, options):
+        return [self.seconds]
+
+
+class Shell(Cat):
+    """Runs a script, which is given the input filename as $1."""
+
+    program = 'sh'
+
+    def __init__(self, script, time=10, length=None):
+        super(Shell, self).__init__(time=time)
+        self.script = script
+        if length is not None:
+            self._length = length
+
+    def generate_arguments(self, filename, options):
+        return ['-c', self.script, 'sh', filename]
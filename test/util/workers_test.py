@@ -0,0 +1,143 @@
+import unittest
+
+from rnastructure.primary.fold import UNAFold
+from rnastructure.util import wrapper
+from rnastructure.util import workers
+
+SCRIPT = '''
+while read line; do
+    case "$line" in
+        crash) echo "crashed" >&2; exit 3 ;;
+        sleep) sleep 5 ;;
+    esac
+    echo "$$ $line"
+done
+'''
+
+
+class Echo(wrapper.Wrapper):
+    program = 'sh'
+
+    def __init__(self, time=10):
+        super(Echo, self).__init__(None, time=time)
+
+    def validate_input(self, raw):
+        return raw != 'bad'
+
+    def input_file(self, input_file, raw):
+        pass
+
+    def results(self, process, temp_dir, filename):
+        pass
+
+    def persistent_arguments(self, options):
+        return ['sh', '-c', SCRIPT]
+
+    def record(self, raw):
+        return raw + '\n'
+
+    def read_record(self, stream):
+        line = stream.readline()
+        if not line:
+            return None
+        pid, value = line.split()
+        return (int(pid), value)
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = workers.Worker(Echo(time=0.5))
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_reuses_process(self):
+        first = self.worker('a')
+        second = self.worker('b')
+        self.assertEqual((first[1], second[1]), ('a', 'b'))
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(self.worker.served, 2)
+
+    def test_restarts_after_crash(self):
+        first = self.worker('a')
+        self.assertRaises(wrapper.ProgramFailedError, self.worker, 'crash')
+        second = self.worker('b')
+        self.assertNotEqual(first[0], second[0])
+        self.assertEqual(self.worker.restarts, 1)
+
+    def test_restarts_after_timeout(self):
+        self.assertRaises(wrapper.ProgramTimeOutError, self.worker, 'sleep')
+        self.assertEqual(self.worker('a')[1], 'a')
+
+    def test_validates(self):
+        self.assertRaises(wrapper.InvalidInputError, self.worker, 'bad')
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = workers.Worker(Echo(time=0.5))
+        self.taken = []
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def inputs(self, count):
+        for index in xrange(count):
+            self.taken.append(index)
+            yield 'input-%s' % index
+
+    def test_results_in_order(self):
+        val = list(self.worker.stream(self.inputs(50), window=4))
+        self.assertEqual([value for _, value in val],
+                         ['input-%s' % index for index in xrange(50)])
+        self.assertEqual(len(set(pid for pid, _ in val)), 1)
+
+    def test_invalid_in_place(self):
+        val = list(self.worker.stream(['a', 'bad', 'b']))
+        self.assertEqual(val[0][1], 'a')
+        self.assertTrue(isinstance(val[1], wrapper.InvalidInputError))
+        self.assertEqual(val[2][1], 'b')
+
+    def test_bounds_inputs_taken(self):
+        results = self.worker.stream(self.inputs(1000), window=3)
+        next(results)
+        next(results)
+        self.assertTrue(len(self.taken) <= 6)
+        results.close()
+
+    def test_failure_stops_stream(self):
+        results = self.worker.stream(['a', 'crash', 'b'])
+        self.assertEqual(next(results)[1], 'a')
+        self.assertRaises(wrapper.ProgramFailedError, next, results)
+        self.assertEqual(self.worker('c')[1], 'c')
+        self.assertEqual(self.worker.restarts, 1)
+
+    def test_restarts_after_close(self):
+        results = self.worker.stream(self.inputs(100), window=10)
+        first = next(results)
+        results.close()
+        self.assertNotEqual(self.worker('a')[0], first[0])
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = workers.WorkerPool(Echo(), size=3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results_in_order(self):
+        inputs = ['input-%s' % index for index in xrange(30)]
+        val = self.pool.map(inputs)
+        self.assertEqual([value for _, value in val], inputs)
+        self.assertTrue(len(set(pid for pid, _ in val)) <= 3)
+
+    def test_failures_in_place(self):
+        val = self.pool.map(['a', 'crash', 'bad', 'b'])
+        self.assertEqual(val[0][1], 'a')
+        self.assertTrue(isinstance(val[1], wrapper.ProgramFailedError))
+        self.assertTrue(isinstance(val[2], wrapper.InvalidInputError))
+        self.assertEqual(val[3][1], 'b')
+
+    def test_unsupported_program(self):
+        self.assertRaises(NotImplementedError, UNAFold().pool, 2)
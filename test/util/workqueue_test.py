@@ -0,0 +1,155 @@
+from __future__ import with_statement
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from rnastructure.util import wrapper
+from rnastructure.util import workqueue
+from test.util.stubs import Cat
+
+
+def upper(raw):
+    if raw == 'bad':
+        raise ValueError("bad input")
+    return raw.upper()
+
+
+def run_node(directory, owner):
+    queue = workqueue.WorkQueue(directory, expiry=1)
+    workqueue.Node(queue, upper, owner=owner).run(wait=True, poll=0.05)
+
+
+def named(count):
+    return [('name-%s' % index, 'input-%s' % index)
+            for index in xrange(count)]
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = workqueue.WorkQueue.create(self.directory, named(40),
+                                                shards=5, expiry=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def age(self, shard, seconds):
+        filename = self.queue.path('leases', shard, '.lease')
+        stamp = time.time() - seconds
+        os.utime(filename, (stamp, stamp))
+
+    def test_shards_deterministically(self):
+        other = os.path.join(self.directory, 'other')
+        queue = workqueue.WorkQueue.create(other, reversed(named(40)),
+                                           shards=5)
+        for shard in xrange(5):
+            self.assertEqual(sorted(queue.inputs(shard)),
+                             sorted(self.queue.inputs(shard)))
+
+    def test_shards_all_inputs(self):
+        found = []
+        for shard in self.queue.shards():
+            found.extend(self.queue.inputs(shard))
+        self.assertEqual(sorted(found), sorted(named(40)))
+
+    def test_claim_is_exclusive(self):
+        lease = self.queue.claim(0, 'a')
+        self.assertTrue(lease.held())
+        self.assertEqual(self.queue.claim(0, 'b'), None)
+        lease.release()
+        self.assertTrue(self.queue.claim(0, 'b') is not None)
+
+    def test_reclaims_expired_lease(self):
+        lease = self.queue.claim(0, 'a')
+        self.age(0, 10)
+        other = self.queue.claim(0, 'b')
+        self.assertTrue(other is not None)
+        self.assertFalse(lease.held())
+        self.assertTrue(other.held())
+
+    def test_heartbeat_keeps_lease(self):
+        lease = self.queue.claim(0, 'a')
+        self.age(0, 10)
+        self.assertTrue(lease.heartbeat())
+        self.assertEqual(self.queue.claim(0, 'b'), None)
+
+    def test_lost_lease_can_not_complete(self):
+        lease = self.queue.claim(0, 'a')
+        self.age(0, 10)
+        self.queue.claim(0, 'b')
+        self.assertFalse(lease.heartbeat())
+        self.assertRaises(workqueue.LeaseLostError, self.queue.complete,
+                          lease, [])
+        self.assertFalse(self.queue.is_done(0))
+
+    def test_done_shard_can_not_be_claimed(self):
+        lease = self.queue.claim(0, 'a')
+        self.queue.complete(lease, [])
+        self.assertEqual(self.queue.claim(0, 'b'), None)
+        self.assertEqual(self.queue.remaining(), [1, 2, 3, 4])
+
+    def test_merge(self):
+        workqueue.Node(self.queue, upper).run()
+        expected = dict((name, raw.upper()) for name, raw in named(40))
+        self.assertEqual(dict(self.queue.merge()), expected)
+
+        merged = os.path.join(self.directory, 'merged.pickle')
+        self.queue.merge_to(merged)
+        self.assertTrue(os.path.exists(merged))
+
+    def test_merge_requires_all_shards(self):
+        self.assertRaises(ValueError, list, self.queue.merge())
+
+    def test_failures_in_place(self):
+        queue = workqueue.WorkQueue.create(
+            os.path.join(self.directory, 'failing'),
+            [('a', 'good'), ('b', 'bad')], shards=1)
+        workqueue.Node(queue, upper).run()
+        val = dict(queue.merge())
+        self.assertEqual(val['a'], 'GOOD')
+        self.assertTrue(isinstance(val['b'], ValueError))
+
+    def test_runs_wrappers(self):
+        queue = workqueue.WorkQueue.create(
+            os.path.join(self.directory, 'wrapped'),
+            [('a', 'first'), ('b', 'bad')], shards=1)
+        workqueue.Node(queue, Cat(), workers=2).run()
+        val = dict(queue.merge())
+        self.assertEqual(val['a'], 'first')
+        self.assertTrue(isinstance(val['b'], wrapper.InvalidInputError))
+
+    def test_does_not_wait_for_held_shards(self):
+        lease = self.queue.claim(0, 'a')
+        done = workqueue.Node(self.queue, upper, owner='b').run()
+        self.assertEqual(sorted(done), [1, 2, 3, 4])
+        self.assertEqual(self.queue.remaining(), [0])
+        lease.release()
+
+    def test_reclaims_work_of_crashed_node(self):
+        self.queue.claim(2, 'crashed')
+        self.age(2, 10)
+        workqueue.Node(self.queue, upper, owner='b').run()
+        self.assertEqual(self.queue.remaining(), [])
+
+    def test_several_processes(self):
+        self.queue.claim(3, 'crashed')
+        self.age(3, 10)
+        processes = [multiprocessing.Process(target=run_node,
+                                             args=(self.directory,
+                                                   'node-%s' % index))
+                     for index in xrange(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            if process.is_alive():
+                process.terminate()
+            self.assertEqual(process.exitcode, 0)
+        merged = list(self.queue.merge())
+        self.assertEqual(sorted(merged),
+                         sorted((name, raw.upper())
+                                for name, raw in named(40)))
@@ -0,0 +1,58 @@
+import os
+import shutil
+import unittest
+
+from rnastructure.util import workspace
+
+
+class WorkspacePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = workspace.WorkspacePool(size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.pool.root, ignore_errors=True)
+
+    def test_acquire_creates_directory(self):
+        path = self.pool.acquire()
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual(os.path.dirname(path), self.pool.root)
+
+    def test_reuses_cleaned_directory(self):
+        path = self.pool.acquire()
+        open(os.path.join(path, 'seq_file'), 'w').close()
+        os.mkdir(os.path.join(path, 'sub'))
+        self.pool.release(path)
+        self.assertEqual(self.pool.acquire(), path)
+        self.assertEqual(os.listdir(path), [])
+
+    def test_bounded(self):
+        paths = [self.pool.acquire() for _ in xrange(4)]
+        for path in paths:
+            self.pool.release(path)
+        self.assertEqual(len(os.listdir(self.pool.root)), 2)
+
+    def test_retain(self):
+        path = self.pool.acquire()
+        self.assertTrue(self.pool.retain(path))
+        self.pool.release(path)
+        self.assertNotEqual(self.pool.acquire(), path)
+        self.pool.release(path)
+        self.assertEqual(self.pool.in_use(), 1)
+
+    def test_retain_unknown(self):
+        self.assertFalse(self.pool.retain('/not/a/workspace'))
+
+    def test_keep_failed(self):
+        pool = workspace.WorkspacePool(keep_failed=True)
+        path = pool.acquire()
+        open(os.path.join(path, 'output.ct'), 'w').close()
+        pool.release(path, failed=True)
+        self.assertEqual(pool.failed, [path])
+        self.assertEqual(os.listdir(path), ['output.ct'])
+        self.assertNotEqual(pool.acquire(), path)
+        shutil.rmtree(pool.root)
+
+    def test_close(self):
+        self.pool.release(self.pool.acquire())
+        self.pool.close()
+        self.assertFalse(os.path.exists(self.pool.root))
@@ -0,0 +1,318 @@
+import os
+import threading
+import time
+import stat
+import shutil
+import tempfile
+import unittest
+
+from rnastructure.util import wrapper
+from rnastructure.util import workspace
+from test.util.stubs import Cat
+from test.util.stubs import Shell
+from test.util.stubs import Sleep
+
+
+class Pwd(Cat):
+    program = 'pwd'
+
+    def generate_arguments(self, filename, options):
+        return []
+
+    def results(self, process, temp_dir, filename):
+        return (process.stdout.read().strip(), temp_dir)
+
+
+class Fail(Cat):
+    program = 'false'
+
+    def generate_arguments(self, filename, options):
+        return []
+
+
+class StreamingShell(Shell):
+    stream_results = True
+
+    def results(self, process, temp_dir, filename):
+        return [line.strip() for line in process.stdout]
+
+
+class Piped(Cat):
+    """Reports the files in its working directory along with its output."""
+
+    program = 'sh'
+
+    def __init__(self, transport, script='cat ${1:-}'):
+        super(Piped, self).__init__()
+        self.transport = transport
+        self.script = script
+
+    def generate_arguments(self, filename, options):
+        arguments = ['-c', self.script, 'sh']
+        if filename is not None:
+            arguments.append(filename)
+        return arguments
+
+    def results(self, process, temp_dir, filename):
+        files = {}
+        for name in os.listdir(temp_dir):
+            mode = os.lstat(os.path.join(temp_dir, name)).st_mode
+            files[name] = stat.S_ISFIFO(mode)
+        return process.stdout.read(), files
+
+
+class Chunked(Piped):
+    def input_file(self, input_file, raw):
+        for line in raw:
+            yield line + '\n'
+
+
+class Counted(Piped):
+    """Generates count chunks of input, recording how many were taken."""
+
+    def input_file(self, input_file, count):
+        self.taken = 0
+        for _ in xrange(count):
+            self.taken += 1
+            yield 'a' * 65536
+
+
+class WorkingDirectoryTest(unittest.TestCase):
+    def test_runs_in_temp_dir(self):
+        cwd = os.getcwd()
+        val, temp_dir = Pwd()('')
+        self.assertEqual(os.path.realpath(val), os.path.realpath(temp_dir))
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_reads_input(self):
+        self.assertEqual(Cat()('some input'), 'some input')
+
+
+class WorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = workspace.WorkspacePool(keep_failed=True)
+        self.pwd = Pwd()
+        self.pwd.workspaces = self.pool
+
+    def tearDown(self):
+        shutil.rmtree(self.pool.root, ignore_errors=True)
+
+    def test_reuses_workspace(self):
+        first = self.pwd('')[1]
+        second = self.pwd('')[1]
+        self.assertEqual(first, second)
+        self.assertEqual(os.path.dirname(first), self.pool.root)
+        self.assertEqual(self.pool.in_use(), 0)
+
+    def test_keeps_failed(self):
+        fail = Fail()
+        fail.workspaces = self.pool
+        self.assertRaises(wrapper.ProgramFailedError, fail, 'input')
+        self.assertEqual(len(self.pool.failed), 1)
+        files = os.listdir(self.pool.failed[0])
+        self.assertEqual(files, ['input.txt'])
+
+    def test_map_releases(self):
+        self.pwd.map([''] * 10, max_workers=3)
+        self.assertEqual(self.pool.in_use(), 0)
+
+
+class ConcurrentCallTest(unittest.TestCase):
+    def test_shared_instance(self):
+        cat = Cat()
+        val = {}
+
+        def run(index):
+            val[index] = cat('input-%s' % index)
+
+        threads = [threading.Thread(target=run, args=(index,))
+                   for index in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ans = dict((index, 'input-%s' % index) for index in xrange(8))
+        self.assertEqual(val, ans)
+
+    def test_output_is_on_the_call(self):
+        cat = Cat()
+        cat('input')
+        self.assertFalse(hasattr(cat, 'stdout'))
+        call = cat.start('input')
+        self.assertEqual(call.result(), 'input')
+        self.assertEqual(call.stderr.read(), '')
+
+
+class MapTest(unittest.TestCase):
+    def setUp(self):
+        self.inputs = ['input-%s' % index for index in xrange(20)]
+
+    def test_results_in_order(self):
+        val = Cat().map(self.inputs, max_workers=4)
+        self.assertEqual(val, self.inputs)
+
+    def test_separate_directories(self):
+        base = tempfile.mkdtemp()
+        val = Pwd(directory=base).map([''] * 6, max_workers=3)
+        self.assertEqual(len(set(directory for _, directory in val)), 6)
+        shutil.rmtree(base)
+
+    def test_failures_in_place(self):
+        val = Cat().map(['a', 'bad', 'c'], max_workers=2)
+        self.assertEqual(val[0], 'a')
+        self.assertTrue(isinstance(val[1], wrapper.InvalidInputError))
+        self.assertEqual(val[2], 'c')
+
+    def test_empty(self):
+        self.assertEqual(Cat().map([]), [])
+
+
+class CallTest(unittest.TestCase):
+    def test_result(self):
+        self.assertEqual(Cat().start('some input').result(), 'some input')
+
+    def test_large_output(self):
+        raw = 'acgu' * 500000
+        self.assertEqual(Cat().start(raw).result(), raw)
+
+    def test_timeout(self):
+        call = Sleep(time=0.2).start('')
+        self.assertRaises(wrapper.ProgramTimeOutError, call.result)
+
+    def test_failure(self):
+        call = Fail().start('')
+        self.assertRaises(wrapper.ProgramFailedError, call.result)
+
+    def test_cancel_kills(self):
+        call = Sleep(time=10).start('')
+        call.cancel()
+        self.assertTrue(call.done())
+        self.assertTrue(call.process.returncode < 0)
+        self.assertRaises(wrapper.CallCancelledError, call.result)
+
+
+class MultiplexerTest(unittest.TestCase):
+    def setUp(self):
+        self.multiplexer = wrapper.Multiplexer(limit=8)
+
+    def test_results_in_order(self):
+        inputs = ['input-%s' % index for index in xrange(50)]
+        for raw in inputs:
+            self.multiplexer.submit(Cat(), raw)
+        self.assertEqual(self.multiplexer.run(), inputs)
+
+    def test_failures_in_place(self):
+        self.multiplexer.submit(Cat(), 'a')
+        self.multiplexer.submit(Cat(), 'bad')
+        self.multiplexer.submit(Sleep(time=0.1), '')
+        val = self.multiplexer.run()
+        self.assertEqual(val[0], 'a')
+        self.assertTrue(isinstance(val[1], wrapper.InvalidInputError))
+        self.assertTrue(isinstance(val[2], wrapper.ProgramTimeOutError))
+
+    def test_limit(self):
+        for index in xrange(12):
+            self.multiplexer.submit(Sleep(time=10), '')
+        self.multiplexer.step(timeout=0)
+        self.assertEqual(len(self.multiplexer._running), 8)
+        self.assertEqual(self.multiplexer.cancel(), range(12))
+        self.assertEqual(len(self.multiplexer), 0)
+
+
+class StreamingTest(unittest.TestCase):
+    def test_timeout_when_called(self):
+        start = time.time()
+        self.assertRaises(wrapper.ProgramTimeOutError, Sleep(time=0.2), '')
+        self.assertTrue(time.time() - start < 2)
+
+    def test_drains_stderr(self):
+        script = 'head -c 3000000 /dev/zero >&2; echo done'
+        self.assertEqual(Shell(script)(''), 'done\n')
+
+    def test_spools_large_output(self):
+        val = Shell('head -c 3000000 /dev/zero')('')
+        self.assertEqual(len(val), 3000000)
+
+    def test_lines_before_exit(self):
+        call = Shell('echo first; sleep 5; echo second').start('')
+        lines = call.lines()
+        self.assertEqual(next(lines), 'first\n')
+        self.assertFalse(call.done())
+        call.cancel()
+
+    def test_lines_without_newline(self):
+        call = Shell('echo first; printf last').start('')
+        self.assertEqual(list(call.lines()), ['first\n', 'last'])
+        call.result()
+
+    def test_streamed_results(self):
+        val = StreamingShell('echo a; echo b')('')
+        self.assertEqual(val, ['a', 'b'])
+
+    def test_streamed_failure(self):
+        shell = StreamingShell('echo a; exit 3')
+        self.assertRaises(wrapper.ProgramFailedError, shell, '')
+
+    def test_streamed_timeout(self):
+        shell = StreamingShell('echo a; sleep 5', time=0.2)
+        self.assertRaises(wrapper.ProgramTimeOutError, shell, '')
+
+
+class TransportTest(unittest.TestCase):
+    def test_file(self):
+        val, files = Piped('file')('abc')
+        self.assertEqual(val, 'abc')
+        self.assertEqual(files, {'input.txt': False})
+
+    def test_stdin_writes_no_files(self):
+        val, files = Piped('stdin')('abc')
+        self.assertEqual(val, 'abc')
+        self.assertEqual(files, {})
+
+    def test_fifo(self):
+        val, files = Piped('fifo')('abc')
+        self.assertEqual(val, 'abc')
+        self.assertEqual(files, {'input.txt': True})
+
+    def test_large_input(self):
+        raw = 'acgu' * 100000
+        for transport in wrapper.TRANSPORTS:
+            self.assertEqual(Piped(transport)(raw)[0], raw)
+
+    def test_empty_input(self):
+        for transport in wrapper.TRANSPORTS:
+            self.assertEqual(Piped(transport)('')[0], '')
+
+    def test_generated_input(self):
+        for transport in wrapper.TRANSPORTS:
+            val = Chunked(transport)(['a', 'b'])[0]
+            self.assertEqual(val, 'a\nb\n')
+
+    def test_generated_input_is_streamed(self):
+        for transport in ('stdin', 'fifo'):
+            counted = Counted(transport, script='head -c 10 ${1:-}')
+            val = counted(2000)[0]
+            self.assertEqual(val, 'a' * 10)
+            self.assertTrue(counted.taken < 100)
+
+    def test_fifo_never_opened(self):
+        val, files = Piped('fifo', script='echo done')('abc')
+        self.assertEqual(val, 'done\n')
+
+    def test_program_stops_reading(self):
+        piped = Piped('fifo', script='head -c 10 $1')
+        self.assertEqual(piped('a' * 300000)[0], 'a' * 10)
+        piped = Piped('stdin', script='head -c 10')
+        self.assertEqual(piped('a' * 300000)[0], 'a' * 10)
+
+    def test_unknown_transport(self):
+        self.assertRaises(ValueError, Piped('socket'), 'abc')
+
+    def test_multiplexed(self):
+        multiplexer = wrapper.Multiplexer(limit=4)
+        inputs = ['input-%s' % index for index in xrange(12)]
+        for index, raw in enumerate(inputs):
+            transport = wrapper.TRANSPORTS[index % 3]
+            multiplexer.submit(Piped(transport), raw)
+        val = [result[0] for result in multiplexer.run()]
+        self.assertEqual(val, inputs)